@@ -0,0 +1,94 @@
+"""
+Benchmark the fuzzy matcher used for autocompletion.
+
+Simulates a user typing queries into a candidate set of 50k names (about the
+number of public names in numpy + scipy + pandas). The target is a match
+time below 2 ms per keystroke. Each query is typed a few times, and the best
+time per keystroke is used, to reduce the noise of other processes. Exits
+with a nonzero status if the target is not met.
+
+Run with ``python benchmarks/bench_matcher.py``.
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyterm.completion._matcher import FuzzyIndex  # noqa: E402
+
+
+WORDS = """
+array matrix linalg solve fft ifft norm mean median std var sum cumsum prod
+reshape transpose concat merge join group by apply map filter sort index
+series frame column row value dtype astype copy fill drop dup interp spline
+integrate optimize minimize root curve fit signal convolve filter window sparse
+csr csc coo dense eig svd qr lu cholesky det inv pinv random normal uniform
+choice shuffle seed stats describe kurtosis skew quantile percentile histogram
+read write csv json parquet excel sql pickle hdf to from get set is has
+""".split()
+
+
+def make_names(n, seed=0):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n:
+        parts = rng.sample(WORDS, rng.randint(1, 4))
+        name = "_".join(parts)
+        if rng.random() < 0.1:
+            name = "_" + name
+        if rng.random() < 0.3:
+            name += str(rng.randint(0, 99))
+        names.add(name)
+    return list(names)
+
+
+TARGET = 0.002
+
+
+def bench(
+    n=50_000,
+    queries=("lin", "get_val", "rdcsv", "fft", "mtx", "zzz", "s"),
+    repeat=5,
+):
+    names = make_names(n)
+
+    t0 = time.perf_counter()
+    index = FuzzyIndex(names)
+    t_build = time.perf_counter() - t0
+    print(f"Building index for {len(index)} names: {t_build * 1000:.1f} ms")
+
+    # Typing a query starts with a single char, which does not extend the
+    # previous query, so each repetition starts afresh.
+    best = {}
+    for _ in range(repeat):
+        for query in queries:
+            for i in range(1, len(query) + 1):
+                t0 = time.perf_counter()
+                result = index.match(query[:i])
+                t = time.perf_counter() - t0
+                best[query[:i]] = min(t, best.get(query[:i], t))
+
+    all_times = []
+    for query in queries:
+        times = [best[query[:i]] for i in range(1, len(query) + 1)]
+        all_times.extend(times)
+        result = index.match(query)
+        print(
+            f"  {query!r:12} mean {1000 * sum(times) / len(times):.3f} ms, "
+            f"max {1000 * max(times):.3f} ms, {len(result)} results"
+        )
+
+    mean = sum(all_times) / len(all_times)
+    print(
+        f"Per keystroke: mean {mean * 1000:.3f} ms, max {max(all_times) * 1000:.3f} ms"
+    )
+    ok = max(all_times) < TARGET
+    print(f"Target of {TARGET * 1000:.0f} ms per keystroke: {'met' if ok else 'NOT met'}")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if bench() else 1)
@@ -0,0 +1,61 @@
+"""
+Benchmark the throughput of print() through the stdout proxy.
+
+Prints short lines through a ProxyStdout that writes to the null device,
+with and without a prompt, and in the different output modes. Compare with
+the "plain" row, which prints to the file directly.
+
+Run with ``python benchmarks/bench_print.py``.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyterm.prompt import Prompt  # noqa: E402
+from pyterm.term import ProxyStdout, OutputWriter  # noqa: E402
+
+
+def bench_print(file, n):
+    t0 = time.perf_counter()
+    for i in range(n):
+        print("hello world", i, file=file)
+    file.flush()
+    return time.perf_counter() - t0
+
+
+def bench(n=100_000):
+    # Note that a proxy closes its file when it is deleted, and a file
+    # closes when it is deleted, so we keep them alive.
+    files = []
+
+    def plain():
+        files.append(open(os.devnull, "w", encoding="utf-8"))
+        return files[-1]
+
+    def proxy(prompt=False, writer=False, **kwargs):
+        devnull = plain()
+        prompt = Prompt(devnull) if prompt else None
+        if writer:
+            kwargs["writer"] = OutputWriter(prompt)
+            kwargs["writer"].start()
+        return ProxyStdout(devnull, "<stdout>", prompt, **kwargs)
+
+    configs = {
+        "plain": plain,
+        "proxy": proxy,
+        "proxy + prompt": lambda: proxy(prompt=True),
+        "flood control": lambda: proxy(prompt=True, flood_control="block"),
+        "output writer": lambda: proxy(prompt=True, writer=True),
+    }
+    for name, create_file in configs.items():
+        file = create_file()
+        files.append(file)
+        t = bench_print(file, n)
+        print(f"{name:16} {n / t:12,.0f} lines/s")
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,69 @@
+"""
+Benchmark pasting a large block of code into the repl.
+
+Pushes a class definition of 100, 1k and 10k lines into Repl.pushline(),
+line by line, as happens when it is pasted. The "compile each line" column
+shows the previous approach, which compiled the whole buffer for each line
+(only measured up to 1k lines, since it is quadratic).
+
+Run with ``python benchmarks/bench_pushline.py``.
+"""
+
+import os
+import sys
+import time
+from codeop import CommandCompiler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyterm.repl import Repl  # noqa: E402
+from pyterm.term import InputBuffer  # noqa: E402
+
+
+def make_block(n):
+    lines = ["class A:"]
+    i = 0
+    while len(lines) < n - 1:
+        lines += [
+            f"    def method{i}(self, x=({i}, 2)):",
+            "        '''Docstring.'''",
+            "        return [x,",
+            "            x]",
+        ]
+        i += 1
+    lines.append("")
+    return lines
+
+
+def compile_each_line(lines):
+    compile = CommandCompiler()
+    buffer = []
+    t0 = time.perf_counter()
+    for line in lines:
+        buffer.append(line)
+        if compile("\n".join(buffer), "<console>", "single") is not None:
+            buffer = []
+    return time.perf_counter() - t0
+
+
+def push_lines(repl, lines):
+    t0 = time.perf_counter()
+    for line in lines:
+        repl.pushline(line)
+    return time.perf_counter() - t0
+
+
+def bench():
+    repl = Repl({}, InputBuffer())
+    print(f"{'lines':>8} {'pushline':>12} {'compile each line':>20}")
+    for n in (100, 1_000, 10_000):
+        lines = make_block(n)
+        t = push_lines(repl, lines)
+        old = "-"
+        if n <= 1_000:
+            old = f"{compile_each_line(lines) * 1000:.1f}ms"
+        print(f"{n:8} {t * 1000:10.1f}ms {old:>20}")
+
+
+if __name__ == "__main__":
+    bench()
@@ -1,13 +1,29 @@
+import os
 import sys
 import time
-import queue
+import logging
 
 from .loops import loop_manager, RawLoop, enable_all_loop_support
-from .term import TerminalContext, ProxyStdin, ProxyStdout, InputReader
+from .term import (
+    TerminalContext,
+    ProxyStdin,
+    ProxyStdout,
+    InputReader,
+    LineReader,
+    InputBuffer,
+    Scrollback,
+    SessionLog,
+    SessionLogTee,
+    OutputBuffer,
+    OutputWriter,
+)
 from .repl import Repl
 from .prompt import Prompt
 
 
+logger = logging.getLogger("pyterm")
+
+
 def main():
 
     # When importing pyterm, nothing should happen just yet.
@@ -19,18 +35,60 @@ def main():
     # allow you to show such exceptions in an error dialog.
     # sys.excepthook = pyterm_excepthook
 
+    # When the output goes to a pipe or file, we don't render a prompt, and
+    # leave the (buffered) streams alone, so output is as fast as with python.
+    if not sys.stdout.isatty():
+        return main_passthrough()
+
     with TerminalContext() as terminal_context:
 
-        # Create queue to store lines from stdin, but thread-safe, and being
-        # able to tell whether there are lines pending.
-        lines_queue = queue.Queue()
+        # Create a buffer to store the submitted lines, thread-safe, and being
+        # able to tell whether there are lines pending. It can also be read
+        # in chunks of bytes, and asynchronously.
+        input_buffer = InputBuffer()
 
-        prompt = Prompt(sys.stdout)
+        # The namespace to run code in, also used for autocompletion.
+        namespace = {}
 
-        # Replace stdin with a variant that uses the queue.
-        sys.stdin = ProxyStdin(lines_queue, "<stdin>")
-        sys.stdout = ProxyStdout(sys.stdout, "<stdout>", prompt)
-        sys.stderr = ProxyStdout(sys.stderr, "<stderr>", prompt)
+        # Keep the last output, so it can be searched.
+        scrollback = Scrollback()
+
+        # Optionally keep a transcript of the session (input and output).
+        session_log = None
+        session_log_filename = os.getenv("PYTERM_SESSION_LOG", "")
+        if session_log_filename:
+            session_log = SessionLog(session_log_filename)
+            session_log.start()
+
+        def on_submit(command):
+            if session_log is not None:
+                session_log.write(f"pyterm> {command}\n".encode())
+            input_buffer.put(command)
+
+        prompt = Prompt(sys.stdout, namespace, scrollback, on_submit)
+
+        # How output is written, for programs that produce a lot of it.
+        output_options = get_output_options(prompt)
+
+        # Replace stdin with a variant that reads from the input buffer.
+        sys.stdin = ProxyStdin(input_buffer, "<stdin>")
+        sys.stdout = ProxyStdout(
+            sys.stdout,
+            "<stdout>",
+            prompt,
+            scrollback=scrollback,
+            session_log=session_log,
+            **output_options,
+        )
+        sys.stderr = ProxyStdout(
+            sys.stderr,
+            "<stderr>",
+            prompt,
+            scrollback=scrollback,
+            color="31",
+            session_log=session_log,
+            **output_options,
+        )
 
         def callback(key):
             if "x" == key:
@@ -43,16 +101,10 @@ def main():
         input_thread = InputReader(sys.__stdin__.fileno(), callback)
         input_thread.start()
 
-        # Create a repl, also reads from the queue.
-        namespace = {}
-        # repl = Repl(namespace, lines_queue)
-
-        # Patching loops
-        enable_all_loop_support()
+        # Create a repl, also reads from the input buffer.
+        # repl = Repl(namespace, input_buffer)
 
-        # Create outer loop
-        loop = RawLoop()
-        loop_manager.add_loop(loop)
+        loop = create_loop()
 
         try:
             loop.run()
@@ -60,6 +112,11 @@ def main():
             pass  # print("except from loop", err)
         finally:
             # Restore original streams, so that SystemExit behaves as intended
+            for f in (sys.stdout, sys.stderr):
+                try:
+                    f.flush()  # write any buffered output
+                except Exception:
+                    pass
             prompt.clear(True)
             try:
                 sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
@@ -70,9 +127,111 @@ def main():
                 sys.stdin.close()
             except (Exception, KeyboardInterrupt):
                 pass
+            if session_log is not None:
+                session_log.stop()
             # Could do more cleanup here
 
 
+def main_passthrough():
+    """Run without terminal context, prompt and proxy streams for the output.
+
+    Output is written straight to the original streams. The lines from the
+    real stdin are fed into the input buffer, like the commands submitted in
+    the prompt. At EOF, or a line with just "x", we quit. If
+    PYTERM_SESSION_LOG is set, the output and input lines are also written
+    to the session log.
+    """
+    input_buffer = InputBuffer()
+    sys.stdin = ProxyStdin(input_buffer, "<stdin>")
+
+    stdout, stderr = sys.stdout, sys.stderr
+    session_log = None
+    session_log_filename = os.getenv("PYTERM_SESSION_LOG", "")
+    if session_log_filename:
+        session_log = SessionLog(session_log_filename)
+        session_log.start()
+        sys.stdout = SessionLogTee(sys.stdout, session_log)
+        sys.stderr = SessionLogTee(sys.stderr, session_log)
+
+    def callback(line):
+        if not line or line.strip() == b"x":
+            input_buffer.close()
+            loop.call_soon(sys.exit)
+        else:
+            if session_log is not None:
+                session_log.write(b"pyterm> " + line)
+            input_buffer.put(line)
+
+    loop = create_loop()
+
+    # Read lines from real stdin, into the buffer.
+    input_thread = LineReader(sys.__stdin__.buffer, callback)
+    input_thread.start()
+
+    try:
+        loop.run()
+    except SystemExit:
+        pass  # quit via the input; other errors (e.g. Ctrl+C) propagate
+    finally:
+        sys.stdin = sys.__stdin__
+        for f in (sys.stdout, sys.stderr):
+            try:
+                f.flush()
+            except Exception:
+                pass
+        if session_log is not None:
+            sys.stdout, sys.stderr = stdout, stderr
+            session_log.stop()
+
+
+def get_output_options(prompt):
+    """Get the options for the ProxyStdout streams, from environment variables.
+
+    * PYTERM_FLOOD_CONTROL: "block" or "skip", to write the output in large
+      chunks, with the given policy for when the terminal cannot keep up.
+    * PYTERM_OUTPUT_WRITER: "1" to write the output from a dedicated thread,
+      so that writing never waits for the terminal or the prompt.
+
+    These two cannot be combined; the writer takes precedence.
+
+    * PYTERM_THREAD_LINES: "1" to buffer the output per thread until it
+      completes a line, or "prefix" to also prefix these lines with the
+      thread name.
+    """
+    options = {}
+    thread_lines = os.getenv("PYTERM_THREAD_LINES", "").lower()
+    if thread_lines == "prefix":
+        options["thread_lines"] = "prefix"
+    elif thread_lines not in ("", "0", "false", "no"):
+        options["thread_lines"] = True
+    flood_control = os.getenv("PYTERM_FLOOD_CONTROL", "")
+    use_writer = os.getenv("PYTERM_OUTPUT_WRITER", "").lower()
+    if use_writer not in ("", "0", "false", "no"):
+        if flood_control:
+            logger.warning("Ignoring PYTERM_FLOOD_CONTROL: using an output writer.")
+        # A single writer for both streams, so that their order is kept
+        writer = OutputWriter(prompt)
+        writer.start()
+        options["writer"] = writer
+    elif flood_control:
+        try:
+            # A single buffer for both streams, so that their order is kept
+            options["flood_control"] = OutputBuffer(None, policy=flood_control)
+        except ValueError as err:
+            logger.warning(f"Ignoring PYTERM_FLOOD_CONTROL: {err}")
+    return options
+
+
+def create_loop():
+    # Patching loops
+    enable_all_loop_support()
+
+    # Create outer loop
+    loop = RawLoop()
+    loop_manager.add_loop(loop)
+    return loop
+
+
 def pyterm_excepthook(type, value, tb):
 
     def writeErr(err):
@@ -0,0 +1,81 @@
+"""
+Lightweight tracing of pyterm internals.
+
+Tracing is off by default (set PYTERM_TRACE=1 to enable it at startup). Code
+on hot paths checks the module-level ``enabled`` flag before doing anything
+else, so that disabled tracing costs a single attribute lookup:
+
+    if _trace.enabled:
+        _trace.event("stdout.write", nbytes=len(bb), duration=t1 - t0)
+
+Events are structured: a name and a few (numeric) fields, never whole
+payloads. They are stored in a bounded ring buffer.
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+
+
+logger = logging.getLogger("pyterm")
+
+enabled = False
+
+_events = deque(maxlen=10_000)
+
+
+def enable(maxlen=None):
+    """Enable tracing, optionally setting the max number of events to keep."""
+    global enabled, _events
+    if maxlen is not None and maxlen != _events.maxlen:
+        _events = deque(_events, maxlen=maxlen)
+    enabled = True
+
+
+def disable():
+    """Disable tracing. The recorded events are kept."""
+    global enabled
+    enabled = False
+
+
+def clear():
+    """Remove all recorded events."""
+    _events.clear()
+
+
+def event(name, **fields):
+    """Record an event. Callers should check ``enabled`` first."""
+    # Appending to a deque is thread-safe
+    _events.append((time.perf_counter(), threading.get_ident(), name, fields))
+
+
+def get_events():
+    """Get a list of the recorded events, as (time, thread_id, name, fields) tuples."""
+    return list(_events)
+
+
+def summarize():
+    """Get a dict that maps event names to counts and sums of their fields."""
+    summary = {}
+    for _, _, name, fields in list(_events):
+        d = summary.setdefault(name, {"count": 0})
+        d["count"] += 1
+        for key, value in fields.items():
+            if isinstance(value, (int, float)):
+                d[key] = d.get(key, 0) + value
+    return summary
+
+
+def _log_summary():
+    if _events:
+        for name, d in sorted(summarize().items()):
+            fields = ", ".join(f"{key}={value:.6g}" for key, value in d.items())
+            logger.info(f"trace {name}: {fields}")
+
+
+if os.getenv("PYTERM_TRACE", "").lower() not in ("", "0", "false", "no"):
+    enable()
+    atexit.register(_log_summary)
@@ -0,0 +1,16 @@
+"""
+Implements autocompletion for the prompt.
+
+Introspecting user objects (``dir()``, properties, ``__getattr__``) can be
+arbitrarily slow, so completions are computed in a worker thread, and the
+results are delivered asynchronously to the prompt.
+"""
+
+from ._worker import CompletionWorker  # noqa
+from ._matcher import FuzzyIndex  # noqa
+from ._lazy import LazyList  # noqa
+from ._modules import ModuleIndex  # noqa
+from ._paths import DirectoryCache, DirectoryListing, MoreMarker, MORE  # noqa
+from ._keys import KeyCache  # noqa
+from ._completer import Completer, get_context, split_name_at_end  # noqa
+from ._signature import TipProvider, SignatureCache, get_call_name  # noqa
@@ -0,0 +1,253 @@
+import re
+import keyword
+import builtins
+
+from ._worker import CompletionWorker
+from ._matcher import FuzzyIndex
+from ._modules import ModuleIndex
+from ._paths import DirectoryCache, split_path, resolve_directory
+from ._keys import KeyCache
+from ._lazy import LazyList
+
+
+class Completer:
+    """Produces completions for the text left of the cursor.
+
+    The names are collected in a worker thread, and passed to the given
+    callback as ``callback(generation, (context, prefix, index))``, where
+    context is as returned by ``get_context()``, and index is a
+    ``FuzzyIndex`` of all names available in that context (or a
+    ``DirectoryListing`` for paths). Only the result of the most recent
+    request is delivered. The result of ``refine()`` has a fourth element:
+    the matches for the prefix, as a ``LazyList``.
+    """
+
+    def __init__(self, namespace, callback):
+        self._namespace = namespace
+        self._modules = ModuleIndex()
+        self._directories = DirectoryCache()
+        self._keys = KeyCache()
+        self._worker = CompletionWorker(callback)
+
+    def is_current(self, generation):
+        """Get whether the request with the given generation is not stale."""
+        return self._worker.is_current(generation)
+
+    def request(self, text):
+        """Request completions for the given text. Returns the generation number."""
+        if not self._worker.is_alive():
+            self._worker.start()
+        return self._worker.submit(
+            get_completions,
+            self._namespace,
+            text,
+            self._modules,
+            self._directories,
+            self._keys,
+        )
+
+    def refine(self, context, prefix, matcher):
+        """Request the matches of a matcher (from an earlier result) for a new
+        prefix. For matchers that read while matching, like a
+        DirectoryListing. Returns the generation number.
+        """
+        if not self._worker.is_alive():
+            self._worker.start()
+        return self._worker.submit(get_matches, context, prefix, matcher)
+
+    def cancel(self):
+        """Cancel the pending request, if any."""
+        self._worker.cancel()
+
+
+def scan_code(text):
+    """Scan the given (single line of) code for brackets and strings.
+
+    Returns a tuple (stack, string_start). The stack is a list of the
+    positions of the unclosed brackets. The string_start is the position of
+    the quote of the unclosed string that the text ends in, or None.
+    """
+    stack = []
+    quote = string_start = None
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if quote:
+            if c == "\\":
+                i += 1
+            elif text.startswith(quote, i):
+                i += len(quote) - 1
+                quote = string_start = None
+        elif c in "'\"":
+            quote = c * 3 if text.startswith(c * 3, i) else c
+            string_start = i
+            i += len(quote) - 1
+        elif c == "#":
+            break
+        elif c in "([{":
+            stack.append(i)
+        elif c in ")]}":
+            if stack:
+                stack.pop()
+        i += 1
+    return stack, string_start
+
+
+def split_name_at_end(text):
+    """Split the (dotted) name at the end of the text in a base and a prefix.
+
+    E.g. "x = foo.bar.sp" produces ("foo.bar", "sp"). Returns None if the text
+    does not end with something that looks like a name.
+    """
+    i = len(text)
+    while i > 0 and (text[i - 1].isalnum() or text[i - 1] in "_."):
+        i -= 1
+    name = text[i:]
+    if name[:1].isdigit() or name.startswith("."):
+        return None
+    base, _, prefix = name.rpartition(".")
+    if base and not all(part.isidentifier() for part in base.split(".")):
+        return None
+    if i > 0 and text[i - 1] in "'\"":
+        return None  # inside a string
+    return base, prefix
+
+
+IMPORT_RE = re.compile(r"(?:import\s+(?:[\w.]+\s*,\s*)*|from\s+)([\w.]*)$")
+FROM_IMPORT_RE = re.compile(r"from\s+([\w.]+)\s+import\s+(?:\w+\s*,\s*)*(\w*)$")
+KEY_RE = re.compile(r"([A-Za-z_][\w.]*)\[\s*(['\"][^'\"\\]*|-?\d*)$")
+
+
+def get_key_context(text, stack, string_start):
+    """Get the key context if the text ends in a subscript, like ``foo['ba``.
+
+    Returns (("key", base), prefix), or None. The prefix includes the opening
+    quote, which is normalized to a single quote, so that it matches reprs.
+    """
+    m = KEY_RE.search(text)
+    if m is None or not stack or stack[-1] != m.end(1):
+        return None
+    prefix = m.group(2)
+    if string_start is not None and string_start != m.start(2):
+        return None
+    if prefix.startswith('"'):
+        prefix = "'" + prefix[1:]
+    return ("key", m.group(1)), prefix
+
+
+def get_context(text):
+    """Determine what to complete for the given text (left of the cursor).
+
+    Returns a tuple (context, prefix), or None if there is nothing to
+    complete. The context is a tuple (kind, base):
+
+    * ("name", base): names in the namespace, or attributes of the object
+      that the dotted base name refers to.
+    * ("module", base): top-level modules, or the submodules of the base package.
+    * ("path", base): the entries of the directory base (when inside a string).
+    * ("key", base): the keys (or columns) of the object that base refers to.
+    """
+    stack, string_start = scan_code(text)
+    context = get_key_context(text, stack, string_start)
+    if context is not None:
+        return context
+    if string_start is not None:
+        quote_start = string_start
+        while quote_start > 0 and text[quote_start - 1].isalpha():
+            quote_start -= 1  # string prefix, like r or b
+        content = text[string_start + 1 :].lstrip(text[string_start])
+        if "r" not in text[quote_start:string_start].lower():
+            content = content.replace("\\\\", "\\")
+        dirpart, prefix = split_path(content)
+        return ("path", dirpart), prefix
+
+    statement = text.rpartition(";")[2].lstrip()
+    m = FROM_IMPORT_RE.match(statement)
+    if m:
+        return ("module", m.group(1)), m.group(2)
+    m = IMPORT_RE.match(statement)
+    if m:
+        base, _, prefix = m.group(1).rpartition(".")
+        return ("module", base), prefix
+    split = split_name_at_end(text)
+    if split is None:
+        return None
+    return ("name", split[0]), split[1]
+
+
+def resolve_name(namespace, name):
+    """Get the object that the given dotted name refers to.
+
+    Only does attribute lookups, no evaluation. Raises NameError or
+    AttributeError if the name cannot be resolved.
+    """
+    first, *parts = name.split(".")
+    if first in namespace:
+        ob = namespace[first]
+    elif hasattr(builtins, first):
+        ob = getattr(builtins, first)
+    else:
+        raise NameError(f"name {first!r} is not defined")
+    for part in parts:
+        ob = getattr(ob, part)
+    return ob
+
+
+def get_names(namespace, base):
+    """Get the list of names available in the namespace, or on the given base object."""
+    if not base:
+        names = set(namespace)
+        names.update(dir(builtins))
+        names.update(keyword.kwlist)
+    else:
+        names = set(dir(resolve_name(namespace, base)))
+    return names
+
+
+def get_completions(namespace, text, modules=None, directories=None, keys=None):
+    """Get the completions for the given text (left of the cursor).
+
+    Returns a tuple (context, prefix, matcher), where the matcher is a
+    FuzzyIndex or a DirectoryListing. This function may be slow,
+    because it introspects user objects (and builds the index), and is
+    therefore called in the worker thread.
+    """
+    context = get_context(text)
+    if context is None:
+        return None, "", FuzzyIndex([])
+    (kind, base), prefix = context
+    if kind == "path":
+        directories = directories or DirectoryCache()
+        listing = directories.get_listing(resolve_directory(base))
+        return context[0], prefix, listing or FuzzyIndex([])
+    if kind == "key":
+        keys = keys or KeyCache()
+        try:
+            index = keys.get_index(resolve_name(namespace, base))
+        except Exception:
+            index = None
+        return context[0], prefix, index or FuzzyIndex([])
+    try:
+        if kind == "module":
+            modules = modules or ModuleIndex()
+            if base:
+                names = modules.get_submodule_names(base)
+            else:
+                names = modules.get_toplevel_names()
+        else:
+            names = get_names(namespace, base)
+    except Exception:
+        names = []
+    return context[0], prefix, FuzzyIndex(names)
+
+
+def get_matches(context, prefix, matcher, n=8):
+    """Get the matches of the matcher for the given prefix, as a LazyList
+    in which the first n are fetched.
+
+    Returns a tuple (context, prefix, matcher, matches). Called in the worker
+    thread, because matching may read a (large) directory.
+    """
+    matches = LazyList(matcher.iter_matches(prefix))
+    matches.fetch(n)
+    return context, prefix, matcher, matches
@@ -0,0 +1,96 @@
+import time
+import weakref
+from collections import OrderedDict
+
+from ._matcher import FuzzyIndex
+
+
+KEY_TYPES = (str, bytes, int, float, bool, tuple)
+
+
+def get_key_source(ob):
+    """Get an iterable of the keys of the given object, and a version stamp.
+
+    Supports mappings, pandas DataFrames and numpy structured arrays, without
+    importing pandas or numpy. Returns (None, None) if the object has no keys.
+    """
+    # Numpy structured array (or record)
+    dtype = getattr(ob, "dtype", None)
+    names = getattr(dtype, "names", None)
+    if names and isinstance(names, tuple):
+        return names, ("dtype", names)
+    # Pandas DataFrame (a Series has index, but we don't complete that)
+    columns = getattr(ob, "columns", None)
+    if columns is not None and hasattr(ob, "dtypes"):
+        return columns, ("columns", len(columns))
+    # Mapping
+    keys = getattr(ob, "keys", None)
+    if callable(keys):
+        try:
+            n = len(ob)
+        except Exception:
+            n = None
+        return keys(), ("mapping", n)
+    return None, None
+
+
+def sample_keys(iterable, time_budget=0.05, max_keys=20_000):
+    """Get the reprs of the keys in the iterable, within the given time budget.
+
+    Only keys of simple types are included. Returns (reprs, complete).
+    """
+    reprs = []
+    t_end = time.perf_counter() + time_budget
+    for i, key in enumerate(iterable):
+        if len(reprs) >= max_keys:
+            return reprs, False
+        elif i % 1000 == 999 and time.perf_counter() > t_end:
+            return reprs, False
+        if isinstance(key, KEY_TYPES):
+            reprs.append(repr(key))
+    return reprs, True
+
+
+class KeyCache:
+    """Cache of FuzzyIndex objects for the keys of mappings and frames.
+
+    Entries are keyed by object identity, and validated with a cheap
+    version stamp (e.g. the length). Objects are not kept alive. Getting the
+    keys of a large mapping is bounded by a time budget and a max number of
+    keys, so the result may be partial.
+    """
+
+    def __init__(self, maxsize=16, time_budget=0.05, max_keys=20_000):
+        self._maxsize = maxsize
+        self._time_budget = time_budget
+        self._max_keys = max_keys
+        self._cache = OrderedDict()  # id -> (check, stamp, index)
+
+    def get_index(self, ob):
+        """Get a FuzzyIndex for the keys of the given object (or None)."""
+        source, stamp = get_key_source(ob)
+        if source is None:
+            return None
+        stamp = type(ob), stamp
+
+        # If possible, we use a weakref to check the identity, otherwise we
+        # rely on the id and stamp (and don't keep the object alive).
+        try:
+            check = weakref.ref(ob)
+        except TypeError:
+            check = None
+
+        key = id(ob)
+        item = self._cache.get(key)
+        if item is not None:
+            item_check, item_stamp, index = item
+            if item_stamp == stamp and (item_check is None or item_check() is ob):
+                self._cache.move_to_end(key)
+                return index
+
+        reprs, _ = sample_keys(source, self._time_budget, self._max_keys)
+        index = FuzzyIndex(reprs)
+        self._cache[key] = check, stamp, index
+        while len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+        return index
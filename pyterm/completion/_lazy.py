@@ -0,0 +1,51 @@
+class LazyList:
+    """A read-only list of candidates that is filled on demand.
+
+    The source can be a sequence (anything with ``__len__`` and
+    ``__getitem__``), which is used as-is without copying. Or it can be an
+    iterable (e.g. a generator or cursor), from which items are pulled only
+    when they are needed, e.g. when the user scrolls down. The length of the
+    list is the number of items known so far.
+    """
+
+    def __init__(self, source=()):
+        if hasattr(source, "__len__") and hasattr(source, "__getitem__"):
+            self._items = source
+            self._iter = None
+        else:
+            self._items = []
+            self._iter = iter(source)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if index >= len(self._items):
+            self.fetch(index + 1)
+        return self._items[index]
+
+    def __iter__(self):
+        i = 0
+        while self.fetch(i + 1) > i:
+            yield self._items[i]
+            i += 1
+
+    @property
+    def exhausted(self):
+        """Whether all items are known."""
+        return self._iter is None
+
+    def fetch(self, n):
+        """Make sure that (at least) n items are known, if possible.
+
+        Returns the number of known items.
+        """
+        it = self._iter
+        items = self._items
+        if it is not None:
+            try:
+                while len(items) < n:
+                    items.append(next(it))
+            except StopIteration:
+                self._iter = None
+        return len(items)
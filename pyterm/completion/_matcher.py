@@ -0,0 +1,207 @@
+import re
+from bisect import bisect_left
+from itertools import islice
+
+
+class FuzzyIndex:
+    """An index over a (possibly large) set of candidate names, for fast fuzzy matching.
+
+    Creating the index is relatively expensive (and is done in the completion
+    worker), matching is cheap, and even cheaper when the query extends the
+    previous one (i.e. while the user is typing).
+
+    The index consists of:
+
+    * The candidates sorted case-insensitively, and their lowercase forms.
+    * All lowercase forms joined in a single string, so that substring
+      matches can be found with ``str.find()``.
+    * For each character, a bitmask (a Python int with one bit per candidate)
+      that marks the candidates containing that character. There are also
+      masks for characters that occur at least twice or three times. AND-ing
+      these rejects non-matching candidates in bulk.
+
+    Matches are ranked in tiers: prefix matches first, then substring matches,
+    then subsequence matches. Names are sorted alphabetically within a tier.
+    Names starting with an underscore are only matched if the query does too.
+    """
+
+    def __init__(self, names):
+        names = sorted(set(names), key=lambda name: (name.lower(), name))
+        lower = [name.lower() for name in names]
+        n = len(names)
+
+        self._names = names
+        self._lower = lower
+        self._joined = "\n".join(lower)
+        self._starts = []  # offset of each name in the joined string
+        offset = 0
+        for s in lower:
+            self._starts.append(offset)
+            offset += len(s) + 1
+
+        # Create the bitmasks. We set the bits in bytearrays, because
+        # OR-ing bits into a big Python int is not O(1).
+        nbytes = (n + 7) // 8
+        arrays = {}
+        public = bytearray(nbytes)
+        for i, s in enumerate(lower):
+            byte, bit = i >> 3, 1 << (i & 7)
+            if not s.startswith("_"):
+                public[byte] |= bit
+            for c in set(s):
+                key = c * min(s.count(c), 3)  # e.g. "z", "zz", "zzz"
+                array = arrays.get(key)
+                if array is None:
+                    array = arrays[key] = bytearray(nbytes)
+                array[byte] |= bit
+        char_bits = {key: int.from_bytes(a, "little") for key, a in arrays.items()}
+        # The mask for "z" must include the names that have "zz", etc.
+        for key in sorted(char_bits, key=len, reverse=True):
+            if len(key) > 1:
+                char_bits[key[1:]] = char_bits.get(key[1:], 0) | char_bits[key]
+        self._char_bits = char_bits
+        self._all_bits = (1 << n) - 1
+        self._public_bits = int.from_bytes(public, "little")
+
+        # The state of the previous match: (query, bits, verified, end,
+        # containing). The verified list contains the indices below end of
+        # the names that (may) match the query. For indices from end, only
+        # the bits are known. While the user is typing, the search usually
+        # stops early (after k matches), so this is what has been scanned so
+        # far. The containing list has the indices of the names that contain
+        # the query, or is None if the search did not get that far.
+        self._last = None
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def names(self):
+        """The list of all candidate names (sorted)."""
+        return self._names
+
+    def _get_bits(self, q):
+        bits = self._all_bits if q.startswith("_") else self._public_bits
+        for c in set(q):
+            bits &= self._char_bits.get(c * min(q.count(c), 3), 0)
+        return bits
+
+    def match(self, query, k=50):
+        """Get the (at most) k best matching names for the given query."""
+        return list(islice(self.iter_matches(query), k))
+
+    def iter_matches(self, query):
+        """Get a generator that yields the matching names, best first.
+
+        Matches are searched for as the generator is consumed, so taking
+        only the first few items is cheap.
+        """
+        q = query.lower()
+
+        # Get the candidates that have all characters of the query. If the
+        # query extends the previous query, we refine the previous result.
+        last = self._last
+        if (
+            last is not None
+            and q.startswith(last[0])
+            and (q[:1] == "_") == (last[0][:1] == "_")
+        ):
+            _, bits, verified, end, containing = last
+            if q != last[0]:
+                bits &= self._get_bits(q)
+        else:
+            bits, verified, end, containing = self._get_bits(q), [], 0, None
+        state = self._last = q, bits, verified, end, containing
+
+        return self._iter_matches(state)
+
+    def _iter_matches(self, state):
+        q, bits, verified, end, containing = state
+        if not bits:
+            return
+        bitstring = format(bits, "b")[::-1]  # bitstring[i] is the bit for name i
+        names = self._names
+        found = set()
+
+        # Tier 1: prefix matches form a contiguous range in the sorted names.
+        # An empty query matches everything, in which case we walk the bits.
+        lower = self._lower
+        if not q:
+            for i in _iter_bits(bitstring):
+                yield names[i]
+            return
+        i = bisect_left(lower, q)
+        while i < len(lower) and lower[i].startswith(q):
+            if bitstring[i : i + 1] == "1":
+                found.add(i)
+                yield names[i]
+            i += 1
+
+        # Tier 2: substring matches. If we know the names that contain the
+        # previous query, only these need to be checked. Otherwise we search
+        # the joined string, which takes a while for a large index.
+        new_containing = []
+        if containing is not None:
+            for i in containing:
+                if bitstring[i : i + 1] == "1" and q in lower[i]:
+                    new_containing.append(i)
+                    if i not in found:
+                        found.add(i)
+                        yield names[i]
+        else:
+            joined, starts = self._joined, self._starts
+            pos = joined.find(q)
+            while pos >= 0:
+                i = bisect_left(starts, pos + 1) - 1
+                if bitstring[i : i + 1] == "1":
+                    new_containing.append(i)
+                    if i not in found:
+                        found.add(i)
+                        yield names[i]
+                pos = joined.find(q, starts[i] + len(lower[i]) + 1)  # next line
+        if self._last is state:
+            state = self._last = q, bits, verified, end, new_containing
+
+        # Tier 3: subsequence matches. Only the candidates that passed the
+        # bitmask test need to be checked, and below end only the names that
+        # matched the previous query. The regex does not backtrack.
+        pattern = re.escape(q[0]) + "".join(
+            f"[^{re.escape(c)}]*{re.escape(c)}" for c in q[1:]
+        )
+        search = re.compile(pattern).search
+        new_verified = []
+        n_done = 0  # the number of processed names from verified
+        new_end = end
+        try:
+            for i in verified:
+                n_done += 1
+                if bitstring[i : i + 1] != "1":
+                    pass
+                elif i in found:
+                    new_verified.append(i)
+                elif search(lower[i]):
+                    new_verified.append(i)
+                    yield names[i]
+            for i in _iter_bits(bitstring, end):
+                new_end = i + 1
+                if i in found:
+                    new_verified.append(i)
+                elif search(lower[i]):
+                    new_verified.append(i)
+                    yield names[i]
+            new_end = len(names)
+        finally:
+            # Keep what we scanned, also if the search stopped early. Unless
+            # a newer query took over in the mean time.
+            if self._last is state:
+                new_verified.extend(verified[n_done:])
+                self._last = q, bits, new_verified, new_end, new_containing
+
+
+def _iter_bits(bitstring, start=0):
+    """Yield the indices of the set bits in the given bitstring."""
+    find = bitstring.find
+    i = find("1", start)
+    while i >= 0:
+        yield i
+        i = find("1", i + 1)
@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import time
+import pkgutil
+import logging
+import threading
+
+
+logger = logging.getLogger("pyterm")
+
+
+def get_cache_dir():
+    """Get the directory where pyterm can store cache files."""
+    if sys.platform.startswith("win"):
+        base = os.getenv("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform.startswith("darwin"):
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "pyterm")
+
+
+def scan_directory(path):
+    """Get the names of the modules in the given directory (or zipfile)."""
+    return sorted({info.name for info in pkgutil.iter_modules([path])})
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class ModuleIndex:
+    """An index of importable module names.
+
+    The module names are stored per directory (i.e. a ``sys.path`` entry or
+    a package directory), together with the directory's mtime, and the whole
+    index is cached on disk. Getting names never walks the filesystem for
+    ``sys.path``: the cached names are returned, and the directories that
+    changed are rescanned in a background thread. The results of that scan
+    are available on the next request.
+    """
+
+    def __init__(self, cache_file=None, min_refresh_interval=5):
+        if cache_file is None:
+            version = "%i.%i" % sys.version_info[:2]
+            cache_file = os.path.join(get_cache_dir(), f"modules-{version}.json")
+        self._cache_file = cache_file
+        self._min_refresh_interval = min_refresh_interval
+        self._lock = threading.Lock()
+        self._entries = None  # path -> (mtime, names), loaded lazily
+        self._dirty = False
+        self._refresh_thread = None
+        self._last_refresh = None  # never refreshed
+
+    def _load(self):
+        # Called with the lock held
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self._cache_file, "rb") as f:
+                    data = json.loads(f.read().decode())
+                for path, (mtime, names) in data.items():
+                    self._entries[path] = mtime, names
+            except FileNotFoundError:
+                pass
+            except Exception as err:
+                logger.warning(f"Could not load module cache: {err}")
+
+    def _save(self):
+        with self._lock:
+            self._dirty = False
+            data = {path: list(entry) for path, entry in self._entries.items()}
+        try:
+            os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+            tmp_filename = self._cache_file + f".{os.getpid()}.tmp"
+            with open(tmp_filename, "wb") as f:
+                f.write(json.dumps(data).encode())
+            os.replace(tmp_filename, self._cache_file)
+        except Exception as err:
+            logger.warning(f"Could not save module cache: {err}")
+
+    def _refresh(self, paths):
+        # Runs in a background thread
+        changed = False
+        for path in paths:
+            mtime = get_mtime(path)
+            with self._lock:
+                entry = self._entries.get(path)
+            if mtime is None or (entry and entry[0] == mtime):
+                continue
+            try:
+                names = scan_directory(path)
+            except Exception:
+                names = []
+            with self._lock:
+                self._entries[path] = mtime, names
+            changed = True
+        if changed or self._dirty:
+            self._save()
+
+    def refresh(self, paths=None):
+        """Rescan the given directories (default sys.path) in a background thread.
+
+        Directories with an unchanged mtime are not scanned. Returns the
+        thread, or None if a refresh is already in progress.
+        """
+        paths = list(sys.path if paths is None else paths)
+        paths = [os.path.abspath(p or ".") for p in paths if isinstance(p, str)]
+        with self._lock:
+            self._load()
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return None
+            self._last_refresh = time.perf_counter()
+            t = threading.Thread(target=self._refresh, args=(paths,), daemon=True)
+            self._refresh_thread = t
+        t.start()
+        return t
+
+    def get_toplevel_names(self):
+        """Get the names of all known top-level modules.
+
+        This does not block on scanning the filesystem, but does schedule
+        a refresh if the last refresh was a while ago.
+        """
+        last_refresh = self._last_refresh
+        if (
+            last_refresh is None
+            or time.perf_counter() - last_refresh > self._min_refresh_interval
+        ):
+            self.refresh()
+        names = set(sys.builtin_module_names)
+        with self._lock:
+            self._load()
+            for p in sys.path:
+                if isinstance(p, str):
+                    entry = self._entries.get(os.path.abspath(p or "."))
+                    if entry:
+                        names.update(entry[1])
+        return names
+
+    def get_submodule_names(self, package):
+        """Get the names of the submodules of the given (dotted) package name.
+
+        The package is not imported. Its directory is looked up on sys.path,
+        and listed if it is not in the cache (or changed). This is a single
+        directory listing, not a walk. Relative names (like ".foo") cannot
+        be resolved at the prompt, so these produce no names.
+        """
+        parts = package.split(".")
+        if not all(parts):
+            return set()
+        names = set()
+        for p in sys.path:
+            if not isinstance(p, str):
+                continue
+            path = os.path.join(os.path.abspath(p or "."), *parts)
+            mtime = get_mtime(path)
+            if mtime is None or not os.path.isdir(path):
+                continue
+            with self._lock:
+                self._load()
+                entry = self._entries.get(path)
+            if not entry or entry[0] != mtime:
+                entry = mtime, scan_directory(path)
+                with self._lock:
+                    self._entries[path] = entry
+                    self._dirty = True
+            names.update(entry[1])
+        return names
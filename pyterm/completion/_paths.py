@@ -0,0 +1,160 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class MoreMarker(str):
+    """The type of the row that indicates that a listing was capped."""
+
+
+MORE = MoreMarker("more…")
+
+
+def split_path(text):
+    """Split a (partial) path into a directory part and a name prefix.
+
+    The directory part includes the trailing separator.
+    """
+    i = max(text.rfind("/"), text.rfind(os.sep))
+    return text[: i + 1], text[i + 1 :]
+
+
+def resolve_directory(dirpart):
+    """Get the absolute directory that the directory part of a path refers to."""
+    path = os.path.expanduser(dirpart) if dirpart else "."
+    return os.path.abspath(path)
+
+
+class DirectoryListing:
+    """A listing of a directory that is read incrementally.
+
+    The entries are read with ``os.scandir()`` only as far as needed. Names
+    of subdirectories have a trailing slash. A listing can be shared between
+    threads; reading entries is protected with a lock.
+    """
+
+    def __init__(self, path, mtime, max_entries=10_000):
+        self.path = path
+        self.mtime = mtime
+        self.max_entries = max_entries
+        self.names = []
+        self._lock = threading.Lock()
+        try:
+            self._iter = os.scandir(path)
+        except OSError:
+            self._iter = None
+
+    @property
+    def complete(self):
+        """Whether all entries have been read."""
+        return self._iter is None
+
+    def close(self):
+        with self._lock:
+            if self._iter is not None:
+                self._iter.close()
+                self._iter = None
+
+    def fetch(self, n):
+        """Read entries until (at least) n are known, if possible.
+
+        Returns the number of known entries.
+        """
+        with self._lock:
+            it = self._iter
+            names = self.names
+            if it is not None:
+                try:
+                    while len(names) < n:
+                        entry = next(it)
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        names.append(entry.name + "/" if is_dir else entry.name)
+                except StopIteration:
+                    self._iter = None
+                    it.close()
+                except OSError:
+                    self._iter = None
+            return len(names)
+
+    def iter_matches(self, prefix):
+        """Get a generator that yields the names that start with the given prefix.
+
+        Entries are read as the generator is consumed. For an empty prefix,
+        at most max_entries entries are examined; if there are more, MORE is
+        yielded last, as a hint to type a prefix. For a non-empty prefix, all
+        entries are examined, so that names beyond the first max_entries can
+        be found. This can take a while for large directories, which is why
+        the prompt refines path completions in the completion worker.
+        """
+        normcase = os.path.normcase
+        limit = None if prefix else self.max_entries
+        prefix = normcase(prefix)
+        names = self.names
+        chunk = 100
+        i = 0
+        while limit is None or i < limit:
+            if i >= len(names) and self.fetch(i + chunk) <= i:
+                return  # all entries are examined
+            end = len(names) if limit is None else min(len(names), limit)
+            for name in names[i:end]:
+                if normcase(name).startswith(prefix):
+                    yield name
+                i += 1
+        if self.fetch(i + 1) > i:
+            yield MORE
+
+
+class DirectoryCache:
+    """A cache of directory listings.
+
+    Listings are validated with the directory's mtime. The cache is bounded
+    by the number of directories and by the total number of entries; the
+    least recently used listings are evicted first.
+    """
+
+    def __init__(self, max_dirs=32, max_total_entries=200_000):
+        self._max_dirs = max_dirs
+        self._max_total_entries = max_total_entries
+        self._listings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_listing(self, path, prefetch=1000):
+        """Get the listing for the given directory, or None if it does not exist.
+
+        If the listing is new, the first entries are read right away. If all
+        entries fit in that, they are sorted.
+        """
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        with self._lock:
+            listing = self._listings.get(path)
+            if listing is not None and listing.mtime == mtime:
+                self._listings.move_to_end(path)
+                return listing
+        listing = DirectoryListing(path, mtime)
+        listing.fetch(prefetch)
+        if listing.complete:
+            listing.names.sort(key=str.lower)
+        with self._lock:
+            old = self._listings.pop(path, None)
+            if old is not None:
+                old.close()
+            self._listings[path] = listing
+            self._evict()
+        return listing
+
+    def _evict(self):
+        # Called with the lock held
+        listings = self._listings
+        total = sum(len(listing.names) for listing in listings.values())
+        while len(listings) > 1 and (
+            len(listings) > self._max_dirs or total > self._max_total_entries
+        ):
+            _, listing = listings.popitem(last=False)
+            total -= len(listing.names)
+            listing.close()
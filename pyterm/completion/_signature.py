@@ -0,0 +1,144 @@
+import inspect
+import weakref
+from collections import OrderedDict
+
+from ._worker import CompletionWorker
+from ._completer import scan_code, split_name_at_end, resolve_name
+
+
+class TipProvider:
+    """Produces call tips (signature and summary) for the callable under the cursor.
+
+    Like the Completer, the (possibly slow) work happens in a worker thread.
+    The result is passed as ``callback(generation, (name, lines))``.
+    """
+
+    def __init__(self, namespace, callback, width=80):
+        self._namespace = namespace
+        self._width = width
+        self._cache = SignatureCache()
+        self._worker = CompletionWorker(callback)
+
+    def is_current(self, generation):
+        """Get whether the request with the given generation is not stale."""
+        return self._worker.is_current(generation)
+
+    def request(self, name):
+        """Request the tip for the callable with the given (dotted) name."""
+        if not self._worker.is_alive():
+            self._worker.start()
+        return self._worker.submit(self._get_tip, name)
+
+    def cancel(self):
+        """Cancel the pending request, if any."""
+        self._worker.cancel()
+
+    def _get_tip(self, name):
+        try:
+            ob = resolve_name(self._namespace, name)
+        except Exception:
+            return name, []
+        if not callable(ob):
+            return name, []
+        return name, self._cache.get_info(ob).get_lines(self._width)
+
+
+def get_call_name(text):
+    """Get the (dotted) name of the callable whose call the text ends in.
+
+    E.g. "x = foo.bar(1, spam(2), " produces "foo.bar". Returns None if the
+    text does not end inside a call.
+    """
+    stack, string_start = scan_code(text)
+    if string_start is not None:
+        text = text[:string_start]
+    for pos in reversed(stack):
+        if text[pos] == "(":
+            split = split_name_at_end(text[:pos])
+            if split and split[1]:
+                return ".".join(part for part in split if part)
+            return None
+    return None
+
+
+class TipInfo:
+    """The signature and summary of a callable, with rendered lines."""
+
+    def __init__(self, ob):
+        name = getattr(ob, "__name__", None) or type(ob).__name__
+        doc = inspect.getdoc(ob) or ""
+        doc_lines = [line.strip() for line in doc.splitlines()]
+        try:
+            signature = name + str(inspect.signature(ob))
+        except (TypeError, ValueError):
+            # Builtins often have the signature on the first line of the docstring
+            if doc_lines and doc_lines[0].startswith(name + "("):
+                signature = doc_lines.pop(0)
+            else:
+                signature = name + "(...)"
+        while doc_lines and not doc_lines[0]:
+            doc_lines.pop(0)
+        self.signature = signature
+        self.summary = doc_lines[0] if doc_lines else ""
+        self._lines = {}
+
+    def get_lines(self, width):
+        """Get the rendered lines for the given terminal width (cached)."""
+        lines = self._lines.get(width)
+        if lines is None:
+            lines = []
+            styled_texts = [
+                (self.signature, "\x1b[0;36m"),
+                (self.summary, "\x1b[0;2m"),
+            ]
+            for text, style in styled_texts:
+                if text:
+                    if len(text) > width:
+                        text = text[: width - 1] + "…"
+                    lines.append(style + text + "\x1b[0m")
+            self._lines[width] = lines
+        return lines
+
+
+class SignatureCache:
+    """Cache of TipInfo objects, per callable.
+
+    Callables that support weak references (functions, classes, most
+    methods) are kept in a weak-keyed dict, so the cache does not keep them
+    alive. For other callables (e.g. builtin functions) a small LRU cache is
+    used, keyed by id, holding a reference to the object so the id stays valid.
+    """
+
+    def __init__(self, maxsize=256):
+        self._weak = weakref.WeakKeyDictionary()
+        self._weak_methods = weakref.WeakKeyDictionary()
+        self._strong = OrderedDict()
+        self._maxsize = maxsize
+
+    def get_info(self, ob):
+        """Get the TipInfo for the given callable."""
+        # A bound method is a new object on each attribute access, so we
+        # key these by the underlying function.
+        cache = self._weak
+        key = ob
+        if inspect.ismethod(ob):
+            cache = self._weak_methods
+            key = ob.__func__
+        try:
+            info = cache.get(key)
+        except TypeError:  # cannot create weak ref, or not hashable
+            pass
+        else:
+            if info is None:
+                info = cache[key] = TipInfo(ob)
+            return info
+        key = id(ob)
+        item = self._strong.get(key)
+        if item is not None and item[0] is ob:
+            self._strong.move_to_end(key)
+            return item[1]
+        info = TipInfo(ob)
+        self._strong[key] = ob, info
+        while len(self._strong) > self._maxsize:
+            self._strong.popitem(last=False)
+        return info
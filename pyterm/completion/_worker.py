@@ -0,0 +1,70 @@
+import logging
+import threading
+
+
+logger = logging.getLogger("pyterm")
+
+
+class CompletionWorker(threading.Thread):
+    """A thread that runs (possibly slow) completion jobs.
+
+    There is at most one pending job: submitting a new job replaces the pending
+    one. A job that is already running cannot be interrupted, but its result is
+    dropped if another job was submitted (or ``cancel()`` was called) in the
+    mean time. The callback is called from the worker thread, with the
+    generation number of the job, and its result.
+    """
+
+    def __init__(self, callback):
+        super().__init__()
+        self._callback = callback
+        self._condition = threading.Condition(threading.Lock())
+        self._generation = 0
+        self._pending = None
+        self.daemon = True
+
+    @property
+    def generation(self):
+        """The generation number of the most recent job."""
+        return self._generation
+
+    def is_current(self, generation):
+        """Get whether the job with the given generation number is not stale."""
+        return generation == self._generation
+
+    def submit(self, func, *args):
+        """Schedule ``func(*args)`` to be called in the worker thread.
+
+        Any pending job is dropped. Returns the generation number of the job.
+        """
+        with self._condition:
+            self._generation += 1
+            self._pending = self._generation, func, args
+            self._condition.notify()
+            return self._generation
+
+    def cancel(self):
+        """Drop the pending job, and the result of the running job (if any)."""
+        with self._condition:
+            self._generation += 1
+            self._pending = None
+
+    def run(self):
+        logger.info("completion thread started")
+        condition = self._condition
+        while True:
+            with condition:
+                while self._pending is None:
+                    condition.wait()
+                generation, func, args = self._pending
+                self._pending = None
+            try:
+                result = func(*args)
+            except Exception as err:
+                logger.error(f"Error in completion job: {err}")
+                continue
+            if generation == self._generation:
+                try:
+                    self._callback(generation, result)
+                except Exception as err:
+                    logger.error(f"Error in handling completion result: {err}")
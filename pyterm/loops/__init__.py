@@ -5,7 +5,11 @@ Implements the loop logic, and support for a variety of GUI toolkits.
 from ._importhook import on_import  # noqa
 from ._base import BaseLoop, LoopManager, loop_manager  # noqa
 from ._raw import RawLoop  # noqa
-from ._asyncio import enable_asyncio_loop_support  # noqa
+from ._asyncio import (  # noqa
+    enable_asyncio_loop_support,
+    get_main_thread_loop,
+    new_private_loop,
+)
 
 
 def enable_all_loop_support():
@@ -47,11 +47,45 @@ def patch_asyncio(asyncio):
         asyncio.events._set_running_loop = pyterm_set_running_loop
 
 
+# The loop last set by the main thread, and loops that pyterm runs itself
+_main_loop_ref = None
+_private_loops = weakref.WeakSet()
+
+
 def main_thread_sets_new_loop(loop):
+    global _main_loop_ref
+    # The running loop is set to None when a loop stops
+    if loop is None or loop in _private_loops:
+        return
+    # A loop can be (re)started multiple times, e.g. by asyncio.run()
+    if _main_loop_ref is not None and _main_loop_ref() is loop:
+        return
     logger.info("Detected new asyncio loop.")
+    _main_loop_ref = weakref.ref(loop)
     loop_manager.add_loop(AsyncioLoop(loop))
 
 
+def get_main_thread_loop():
+    """Get the asyncio loop that was set by the main thread, if it is running."""
+    loop = _main_loop_ref() if _main_loop_ref is not None else None
+    if loop is not None and loop.is_running():
+        return loop
+    return None
+
+
+def new_private_loop():
+    """Create an asyncio loop that pyterm runs itself.
+
+    Unlike loops created by user code, it is not picked up as the main
+    thread's loop when it runs.
+    """
+    import asyncio  # no import at module level, because of the patching
+
+    loop = asyncio.new_event_loop()
+    _private_loops.add(loop)
+    return loop
+
+
 class AsyncioLoop(BaseLoop):
 
     def __init__(self, loop):
@@ -0,0 +1,325 @@
+import io
+import ast
+import sys
+import time
+import shutil
+import pstats
+import cProfile
+import inspect
+import statistics
+
+
+USAGE = """Magic commands:
+  %time code            run code once and show the wall time
+  %timeit [-n N] [-r R] code
+                        run code N times (calibrated by default), repeated
+                        R times, and show the time per loop
+  %prun [-s key] [-l N] code
+                        profile code and show the N (default 20) top
+                        entries of cProfile, sorted by key (default cumulative)
+
+Use %%time, %%timeit or %%prun as the first line of a multi-line cell. In
+the interactive prompt, the cell ends with an empty line.
+"""
+
+
+def format_time(t):
+    """Format a duration in seconds for humans."""
+    for unit, scale in (("s", 1), ("ms", 1e3), ("µs", 1e6)):
+        if t >= 1 / scale:
+            return f"{t * scale:.3g} {unit}"
+    return f"{t * 1e9:.3g} ns"
+
+
+def parse_options(text, defaults):
+    """Parse leading "-x value" options from a magic command.
+
+    Returns a dict with the options (converted to the type of the default),
+    and the remaining text.
+    """
+    options = dict(defaults)
+    text = text.strip()
+    while text[:1] == "-" and text[1:2] in options and text[2:3] == " ":
+        key = text[1]
+        parts = text[3:].lstrip().split(None, 1)
+        if not parts:
+            raise ValueError(f"Option -{key} needs a value.")
+        options[key] = type(defaults[key])(parts[0])
+        text = parts[1] if len(parts) > 1 else ""
+    return options, text
+
+
+class Magician:
+    """Handles magic commands for the repl.
+
+    Magic commands start with "%" and run code in the repl's namespace, and
+    errors are shown by the repl as usual. Code with top-level
+    await is run as a coroutine via Repl.runcoroutine(), so the magics also
+    work inside a running asyncio loop (without blocking it).
+    """
+
+    magics = ("time", "timeit", "prun")
+
+    def __init__(self, repl, timeit_target=0.2, timeit_repeat=7):
+        self._repl = repl
+        self._timeit_target = timeit_target  # min total time per repeat
+        self._timeit_repeat = timeit_repeat
+        self._cell_magic = None  # (name, args) when collecting a cell
+        self._cell_lines = []
+
+    @property
+    def collecting(self):
+        """Whether the lines of a magic cell are being collected."""
+        return self._cell_magic is not None
+
+    def convert_command(self, line):
+        """Convert a command. Returns the command if it is not a magic
+        (so it can be run as normal code), and None if it was handled.
+        """
+        if self._cell_magic is not None:
+            if line.strip():
+                self._cell_lines.append(line)
+            else:
+                (name, args), self._cell_magic = self._cell_magic, None
+                source = "\n".join(self._cell_lines) + "\n"
+                self._cell_lines = []
+                self._call(name, args, source)
+            return None
+
+        stripped = line.strip()
+        if stripped == "?" or stripped == "%magic":
+            print(USAGE)
+            return None
+        elif stripped.startswith("%%"):
+            name, _, args = stripped[2:].partition(" ")
+            if name in self.magics:
+                self._cell_magic = name, args
+                return None
+        elif stripped.startswith("%"):
+            name, _, args = stripped[1:].partition(" ")
+            if name in self.magics:
+                self._call(name, args, None)
+                return None
+        return line
+
+    def run_cell(self, source, filename="<cell>"):
+        """Run a cell if it starts with a cell magic. Returns whether it did.
+
+        The lines up to and including the magic are compiled as empty lines,
+        so that the line numbers of the code match those of the cell.
+        """
+        stripped = source.lstrip()
+        first_line, _, body = stripped.partition("\n")
+        if not first_line.startswith("%%"):
+            return False
+        name, _, args = first_line[2:].strip().partition(" ")
+        if name not in self.magics:
+            return False
+        nlines = source.count("\n", 0, len(source) - len(stripped)) + 1
+        self._call(name, args, "\n" * nlines + body, filename, source)
+        return True
+
+    def _call(self, name, args, source, filename="<magic>", full_source=None):
+        # For line magics the code is in args, after the options.
+        defaults = {
+            "time": {},
+            "timeit": {"n": 0, "r": self._timeit_repeat},
+            "prun": {"s": "cumulative", "l": 20},
+        }[name]
+        try:
+            options, rest = parse_options(args, defaults)
+            for key, minimum in (("n", 0), ("r", 1), ("l", 1)):
+                if options.get(key, minimum) < minimum:
+                    raise ValueError(f"Option -{key} must be at least {minimum}.")
+        except ValueError as err:
+            print(f"%{name}: {err}")
+            return
+        if source is None:
+            source = rest + "\n"
+        try:
+            code = self._repl.compilecode(
+                source, filename, "exec", display_last=name == "time"
+            )
+        except (OverflowError, SyntaxError, ValueError):
+            self._repl.showsyntaxerror(filename)
+            return
+        if not code:
+            print(f"%{name}: the code is incomplete.")
+            return
+        # Store the source, so that tracebacks can show it
+        self._repl._codeCollection.store_source(code, full_source or source)
+        if name == "timeit":
+            options.update(source=source, filename=filename)
+        getattr(self, "_magic_" + name)(code, **options)
+
+    # --- The magics
+
+    def _magic_time(self, code):
+        if code.co_flags & inspect.CO_COROUTINE:
+
+            async def run():
+                t0 = time.perf_counter()
+                try:
+                    await self._eval(code)
+                finally:
+                    print(f"Wall time: {format_time(time.perf_counter() - t0)}")
+
+            return self._repl.runcoroutine(run(), code)
+
+        duration, _ = self._run(code)
+        print(f"Wall time: {format_time(duration)}")
+
+    def _magic_timeit(self, code, n, r, source, filename):
+        # Each measurement runs the code number times in a single call, via
+        # a loop compiled from the source. We stop at the first error.
+        loops = {}
+
+        def get_loop(number):
+            if number not in loops:
+                loops[number] = self._compile_loop(source, filename, number)
+            return loops[number]
+
+        if code.co_flags & inspect.CO_COROUTINE:
+
+            async def atimed(number):
+                loop = get_loop(number)
+                t0 = time.perf_counter()
+                await self._eval(loop)
+                return time.perf_counter() - t0
+
+            async def run():
+                number = n
+                if not number:
+                    # Calibrate
+                    for number in self._iter_numbers():
+                        if await atimed(number) >= self._timeit_target:
+                            break
+                times = []
+                for _ in range(r):
+                    times.append(await atimed(number) / number)
+                self._report_timeit(times, number)
+
+            return self._repl.runcoroutine(run(), code)
+
+        # Run once via execcode, which shows errors, then calibrate and time
+        if not self._repl.execcode(code):
+            return
+        number = n
+        if not number:
+            for number in self._iter_numbers():
+                duration, ok = self._run(get_loop(number))
+                if not ok:
+                    return
+                if duration >= self._timeit_target:
+                    break
+        times = []
+        for _ in range(r):
+            duration, ok = self._run(get_loop(number))
+            if not ok:
+                return
+            times.append(duration / number)
+        self._report_timeit(times, number)
+
+    def _magic_prun(self, code, s, l):  # noqa: E741 - the option is -l
+        profiler = cProfile.Profile()
+        if code.co_flags & inspect.CO_COROUTINE:
+
+            async def run():
+                # Note that other tasks running meanwhile are profiled too
+                profiler.enable()
+                try:
+                    await self._eval(code)
+                finally:
+                    profiler.disable()
+                    self._report_prun(profiler, s, l)
+
+            return self._repl.runcoroutine(run(), code)
+
+        profiler.enable()
+        try:
+            self._repl.execcode(code)
+        finally:
+            profiler.disable()
+        self._report_prun(profiler, s, l)
+
+    # --- Helpers
+
+    def _run(self, code):
+        # Run (non-async) code, and show the traceback if it fails. Returns
+        # the duration, and whether it succeeded. Unlike Repl.execcode(), the
+        # duration does not include the handling of an error.
+        repl = self._repl
+        namespaces = (repl.globals, repl.locals) if repl._dbFrames else (repl.locals,)
+        t0 = time.perf_counter()
+        try:
+            exec(code, *namespaces)
+        except (Exception, KeyboardInterrupt):
+            t1 = time.perf_counter()
+            repl.showtraceback()
+            return t1 - t0, False
+        return time.perf_counter() - t0, True
+
+    def _eval(self, code):
+        repl = self._repl
+        if repl._dbFrames:
+            return eval(code, repl.globals, repl.locals)
+        return eval(code, repl.locals)
+
+    def _compile_loop(self, source, filename, number):
+        # Like timeit, put the code in a loop, so that the overhead per
+        # iteration is only that of the loop. The loop runs in the namespace
+        # like the code itself, and binds no names:
+        # for [] in __import__('itertools').repeat((), number): <code>
+        compiler = getattr(self._repl._compile, "compiler", None)
+        flags = getattr(compiler, "flags", 0)
+        tree = compile(source, filename, "exec", flags | ast.PyCF_ONLY_AST, True)
+        get_itertools = ast.Call(
+            func=ast.Name(id="__import__", ctx=ast.Load()),
+            args=[ast.Constant(value="itertools")],
+            keywords=[],
+        )
+        repeat = ast.Call(
+            func=ast.Attribute(value=get_itertools, attr="repeat", ctx=ast.Load()),
+            args=[ast.Tuple(elts=[], ctx=ast.Load()), ast.Constant(value=number)],
+            keywords=[],
+        )
+        loop = ast.For(
+            target=ast.List(elts=[], ctx=ast.Store()),
+            iter=repeat,
+            body=tree.body or [ast.Pass()],
+            orelse=[],
+        )
+        tree.body = [loop]  # the code keeps its line numbers
+        ast.fix_missing_locations(tree)
+        return compile(tree, filename, "exec", flags, True)
+
+    def _iter_numbers(self):
+        # 1, 2, 5, 10, 20, 50, ... like timeit.Timer.autorange()
+        i = 1
+        while True:
+            for j in (1, 2, 5):
+                yield i * j
+            i *= 10
+
+    def _report_timeit(self, times, number):
+        best = min(times)
+        median = statistics.median(times)
+        stdev = statistics.stdev(times) if len(times) > 1 else 0.0
+        print(
+            f"{format_time(median)} ± {format_time(stdev)} per loop "
+            f"(min {format_time(best)}, median of {len(times)} runs, "
+            f"{number} loops each)"
+        )
+
+    def _report_prun(self, profiler, sort, limit):
+        f = io.StringIO()
+        stats = pstats.Stats(profiler, stream=f)
+        try:
+            stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        except KeyError:
+            print(f"%prun: invalid sort key {sort!r}")
+            return
+        width = shutil.get_terminal_size().columns
+        lines = f.getvalue().strip("\n").splitlines()
+        text = "\n".join(line[:width] for line in lines)
+        sys.stdout.write(text + "\n")
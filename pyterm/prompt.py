@@ -1,16 +1,29 @@
+import re
 import math
 import logging
 import platform
 import threading
 
+from .completion import (
+    Completer,
+    CompletionWorker,
+    TipProvider,
+    LazyList,
+    MoreMarker,
+    get_context,
+    get_call_name,
+)
+
 logger = logging.getLogger("pyterm")
 
 
 class Prompt:
     """A terminal prompt, with history, status and autocomp."""
 
-    def __init__(self, file):
+    def __init__(self, file, namespace=None, scrollback=None, on_submit=None):
         self._file = file
+        self._scrollback = scrollback
+        self._on_submit = on_submit
         self._lock = threading.RLock()
 
         self._pre = "pyterm> "
@@ -19,11 +32,17 @@ class Prompt:
         self._prompt_is_shown = False
         self._lines_below_input = 0
 
+        namespace = {} if namespace is None else namespace
         self._history = HistoryHelper()
         self._status = StatusHelper()
+        self._tip = TipHelper()
+        self._search = SearchHelper()
+        self._search_worker = CompletionWorker(self._on_search)
         self._autocomp = AutocompHelper()
-        self._autocomp.show([str(i) for i in range(100)])
-        # self._autocomp.show(["aap", "noot", "mies", "spam", "eggs"])
+        self._completing = False
+        self._completion_context = None
+        self._completer = Completer(namespace, self._on_completions)
+        self._tipper = TipProvider(namespace, self._on_tip)
 
         self.write_prompt()
 
@@ -44,6 +63,10 @@ class Prompt:
         self._file.buffer.write(text.encode(self._file.encoding, errors="ignore"))
 
     def on_key(self, key):
+        with self._lock:
+            self._on_key(key)
+
+    def _on_key(self, key):
 
         # Reset helpers, apply if necessary
         if key not in ["up", "down"]:
@@ -52,28 +75,43 @@ class Prompt:
         if len(key) == 1:
             # A regular character
             self._in1 += key
+            if key.isidentifier() or key.isdigit() or key in "./\\":
+                self._update_completions()
+            elif self._completion_context and self._completion_context[0] in (
+                "path",
+                "key",
+            ):
+                self._update_completions()
+            else:
+                self._hide_completions()
         elif key == "backspace":
             if self._in1:
                 self._in1 = self._in1[:-1]
+            self._update_completions()
         elif key == "enter":
-            self.submit(self._in1 + self._in2)
+            if self._autocomp.active and self._autocomp.has_selection:
+                self._accept_completion()
+            else:
+                self._hide_completions()
+                self.submit(self._in1 + self._in2)
         elif key == "escape":
-            print("escape was hit!")
-            return
+            self._hide_completions()
+            self._search_worker.cancel()
+            self._search.reset()
         elif key == "tab":
-            import sys
-
-            # print("Tab was hit!")
-            # sys.stdout.write("Tab was hit!|")
-            # sys.stdout.flush()
-            sys.stdout.write("Tab was hit!\n")
-            sys.stdout.flush()
-            return
+            if self._autocomp.active:
+                self._accept_completion()
+            else:
+                self._completing = True
+                self._completer.request(self._in1)
+                return
         elif key == "left":
+            self._hide_completions()
             if self._in1:
                 self._in2 = self._in1[-1] + self._in2
                 self._in1 = self._in1[:-1]
         elif key == "right":
+            self._hide_completions()
             if self._in2:
                 self._in1 += self._in2[0]
                 self._in2 = self._in2[1:]
@@ -91,12 +129,90 @@ class Prompt:
                 self._autocomp.down()
             elif self._history.active:
                 self._in1 = self._history.down()
+        elif key == "pageup":
+            self._request_search_page(-1)
+        elif key == "pagedown":
+            self._request_search_page(1)
         else:
             pass  # ignore
 
+        self._update_tip()
         self.clear()
         self.write_prompt()
 
+    # --- Call tips
+
+    def _update_tip(self):
+        # Cheap if the cursor is still in the same call
+        name = get_call_name(self._in1)
+        if name == self._tip.name:
+            return
+        self._tip.set(name, [])
+        if name is None:
+            self._tipper.cancel()
+        else:
+            self._tipper.request(name)
+
+    def _on_tip(self, generation, result):
+        # Called from the tip thread
+        with self._lock:
+            if not self._tipper.is_current(generation):
+                return
+            name, lines = result
+            if name == self._tip.name:
+                self._tip.set(name, lines)
+                self.clear()
+                self.write_prompt()
+
+    # --- Autocompletion
+
+    def _update_completions(self):
+        # Called when the input changes. Results of a pending request are
+        # now stale. If we're still completing the same object, we can
+        # refine the current candidates, otherwise we request new ones.
+        if not self._completing:
+            return
+        context = get_context(self._in1)
+        if context is None:
+            self._hide_completions()
+        elif context[0] != self._completion_context:
+            self._completer.request(self._in1)
+        elif context[0][0] == "path" and self._autocomp.matcher is not None:
+            # Matching reads the directory, which can take a while, so it's
+            # done in the worker. Until then, the stale matches are hidden.
+            self._completer.refine(context[0], context[1], self._autocomp.matcher)
+            self._autocomp.reset()
+        elif self._autocomp.refine(context[1]):
+            self._completer.cancel()
+        else:
+            self._completer.request(self._in1)
+
+    def _hide_completions(self):
+        self._completing = False
+        self._completion_context = None
+        self._completer.cancel()
+        self._autocomp.reset()
+
+    def _accept_completion(self):
+        name = self._autocomp.get_selected()
+        if name is not None:
+            n = len(self._autocomp.prefix)
+            self._in1 = self._in1[: len(self._in1) - n] + name
+        self._hide_completions()
+
+    def _on_completions(self, generation, result):
+        # Called from the completion thread
+        with self._lock:
+            if not self._completer.is_current(generation):
+                return  # the input has changed since the request was made
+            context, prefix, index = result[:3]
+            matches = result[3] if len(result) > 3 else None
+            self._completion_context = context
+            self._autocomp.show(index, prefix, matches)
+            self._completing = self._autocomp.active
+            self.clear()
+            self.write_prompt()
+
     def submit(self, command):
         # Render the given command
         self._in1 = command
@@ -109,12 +225,78 @@ class Prompt:
 
         # Fresh prompt
         self._in1 = ""
+        self._update_tip()
         self.write_prompt()
 
         # Update history
         self._history.add(command)
         self._history.reset()
 
+        if command.startswith("%search"):
+            self._start_search(command)
+        elif self._on_submit is not None:
+            self._on_submit(command)
+
+    # --- Search in the scrollback
+
+    def _start_search(self, command):
+        # Usage: %search [-r] [-i] pattern
+        pattern = command[len("%search") :].strip()
+        flags = set()
+        while pattern[:2] in ("-r", "-i") and pattern[2:3] in (" ", ""):
+            flags.add(pattern[:2])
+            pattern = pattern[2:].lstrip()
+        if self._scrollback is None or not pattern:
+            title = "Usage: %search [-r] [-i] pattern (needs a scrollback)"
+            self._search_worker.cancel()
+            self._search.show(title, [])
+        else:
+            title = f"Search {pattern!r}"
+            self._search.show(title, None)
+            self._submit_search(
+                self._search_scrollback, title, pattern, "-r" in flags, "-i" in flags
+            )
+        self.clear()
+        self.write_prompt()
+
+    def _request_search_page(self, step):
+        title, hits, page = self._search.state
+        if title is not None and hits is not None:
+            page = max(0, page + step)
+            self._submit_search(self._fetch_search_page, title, hits, page)
+
+    def _submit_search(self, func, *args):
+        # Searching a large scrollback takes a while, so it's done in a
+        # worker thread, without holding the lock.
+        if not self._search_worker.is_alive():
+            self._search_worker.start()
+        self._search_worker.submit(func, *args)
+
+    def _search_scrollback(self, title, pattern, regex, ignore_case):
+        # Called from the search thread
+        try:
+            hits = self._scrollback.search(
+                pattern, regex=regex, ignore_case=ignore_case
+            )
+        except re.error as err:
+            return f"Invalid regex: {err}", LazyList(), 0
+        return self._fetch_search_page(title, LazyList(hits), 0)
+
+    def _fetch_search_page(self, title, hits, page):
+        # Called from the search thread
+        if not self._search.fetch(hits, page):
+            return None  # no such page
+        return title, hits, page
+
+    def _on_search(self, generation, result):
+        # Called from the search thread
+        with self._lock:
+            if not self._search_worker.is_current(generation) or result is None:
+                return
+            self._search.show(*result)
+            self.clear()
+            self.write_prompt()
+
     def clear(self, hard=False):
         # Note: required to work with ProxyStdout
 
@@ -123,7 +305,8 @@ class Prompt:
         if not self._prompt_is_shown:
             return
 
-        write = self._write
+        parts = []
+        write = parts.append
 
         # Restore state. This includes position, but also color and more.
         write("\x1b8")
@@ -155,13 +338,15 @@ class Prompt:
         # Reset color and style.
         write("\x1b[0m")
 
+        self._write("".join(parts))  # encode and write in one go
         self._prompt_is_shown = False
         self._file.buffer.flush()
 
     def write_prompt(self):
         # Note: required to work with ProxyStdout
 
-        write = self._write
+        parts = []
+        write = parts.append
 
         # Save cursor state, right before doing our thing
         write("\x1b7")
@@ -172,6 +357,8 @@ class Prompt:
 
         # Print stuff that goes below the prompt
         lines_below = []
+        lines_below += self._search.get_lines()
+        lines_below += self._tip.get_lines()
         lines_below += self._autocomp.get_lines()
         lines_below += self._status.get_lines()
         self._lines_below_input = len(lines_below)
@@ -198,6 +385,7 @@ class Prompt:
             n = len(self._in2)
             write(f"\x1b[{n}D")
 
+        self._write("".join(parts))  # encode and write in one go
         self._prompt_is_shown = True
         self._file.buffer.flush()
 
@@ -264,11 +452,16 @@ class HistoryHelper:
 class AutocompHelper:
     def __init__(self):
         self._vspace = 7
-        self._list = []
+        self._list = LazyList()
+        self._matcher = None
+        self._prefix = ""
         self._index = None
         self._history = []
 
     def reset(self):
+        self._list = LazyList()
+        self._matcher = None
+        self._prefix = ""
         self._index = None
 
     def activate(self, in1, in2):
@@ -276,44 +469,102 @@ class AutocompHelper:
 
     @property
     def active(self):
-        return True
+        return self._list.fetch(1) > 0
+
+    @property
+    def prefix(self):
+        """The part of the input that the completions replace."""
+        return self._prefix
+
+    @property
+    def matcher(self):
+        """The matcher of the shown names, or None."""
+        return self._matcher
+
+    @property
+    def has_selection(self):
+        """Whether the user explicitly selected an entry."""
+        return self._index is not None
+
+    def get_selected(self):
+        """Get the selected name, or the first if none is selected."""
+        if self.active:
+            entry = self._list[self._index or 0]
+            if not isinstance(entry, MoreMarker):
+                return str(entry)
 
     def up(self):
         index = (self._index or 0) - 1
         if index < 0:
-            index = len(self._list) - 1
+            # Wrap around, but only if we know where the end is
+            n = self._list.fetch(0)
+            index = n - 1 if self._list.exhausted else 0
         self._index = index
 
     def down(self):
         index = (self._index or 0) + 1
-        if index >= len(self._list):
+        if index >= self._list.fetch(index + 1):
             index = 0
         self._index = index
 
-    def show(self, names):
-        self._list = [str(x) for x in names]
+    def show(self, names, prefix="", matches=None):
+        """Show the given names.
+
+        The names can be a sequence, which is not copied, or an iterable,
+        from which names are pulled as they are shown. The entries are
+        converted to str only when shown. If a matcher is given (an object
+        with an ``iter_matches()`` method, like FuzzyIndex), show the best
+        matches for the prefix, and allow refining with ``refine()``. These
+        matches can also be given, if they were obtained elsewhere.
+        """
+        if hasattr(names, "iter_matches"):
+            self._matcher = names
+            names = names.iter_matches(prefix) if matches is None else matches
+        else:
+            self._matcher = None
+        self._list = names if isinstance(names, LazyList) else LazyList(names)
+        self._prefix = prefix
+        self._index = None
+
+    def refine(self, prefix):
+        """Show the best matches for a new prefix, without introspecting
+        any objects. Returns False if this is not possible.
+        """
+        if self._matcher is None:
+            return False
+        self._list = LazyList(self._matcher.iter_matches(prefix))
+        self._prefix = prefix
+        self._index = None
+        return True
 
     def get_lines(self):
         ref_index = self._index or 0
 
+        # Page in the entries that we need. One extra, so that we know
+        # whether there is more. The scroll metrics are based on the
+        # number of entries that we know of.
+        n = self._list.fetch(ref_index + self._vspace + 1)
+        if not n:
+            return []
+
         # How much space do we have / need
-        vspace = min(self._vspace, len(self._list))
+        vspace = min(self._vspace, n)
         nbefore = vspace // 2
         nafter = vspace - nbefore - 1
 
         # Calculate start & end index
         index_first = ref_index - nbefore
         index_last = ref_index + nafter
-        highest_index_first = len(self._list) - vspace
+        highest_index_first = n - vspace
         if index_first < 0:
             index_first = 0
             index_last = vspace - 1
-        elif index_last >= len(self._list):
-            index_last = len(self._list) - 1
+        elif index_last >= n:
+            index_last = n - 1
             index_first = index_last - vspace + 1
 
         # Determine scroll params
-        scroll_size = len(self._list) / vspace
+        scroll_size = n / vspace
         scroll_n = max(1, int(vspace / scroll_size))
         if index_first == 0:
             scroll_first = 0
@@ -337,7 +588,7 @@ class AutocompHelper:
 
             # Add row
             hspace = 40 - 3  # note space for scroll bar and left margin
-            entry = self._list[index]
+            entry = str(self._list[index])
             if len(entry) > hspace:
                 entry = entry[: hspace - 1] + "…"
             line += entry.ljust(hspace)
@@ -358,6 +609,96 @@ class AutocompHelper:
         return lines
 
 
+class TipHelper:
+    """Shows the signature of the callable under the cursor."""
+
+    def __init__(self):
+        self._name = None
+        self._lines = []
+
+    @property
+    def name(self):
+        """The name of the callable that the tip is for."""
+        return self._name
+
+    @property
+    def active(self):
+        return bool(self._lines)
+
+    def set(self, name, lines):
+        self._name = name
+        self._lines = lines
+
+    def get_lines(self):
+        return self._lines
+
+
+class SearchHelper:
+    """Shows the hits of a search in the scrollback, a page at a time."""
+
+    _escape_code_re = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|\x1b[78]")
+
+    def __init__(self, page_size=8, width=80):
+        self._page_size = page_size
+        self._width = width
+        self.reset()
+
+    @property
+    def active(self):
+        return self._title is not None
+
+    @property
+    def state(self):
+        """The title, the hits (a LazyList) and the page index."""
+        return self._title, self._hits, self._page
+
+    def reset(self):
+        self._title = None
+        self._hits = LazyList()
+        self._page = 0
+
+    def show(self, title, hits, page=0):
+        """Show the given hits, an iterable of (line_number, line_bytes) tuples,
+        or None while searching. Only the hits fetched so far are shown.
+        """
+        self._title = title
+        if hits is None or isinstance(hits, LazyList):
+            self._hits = hits
+        else:
+            self._hits = LazyList(hits)
+        self._page = page
+
+    def fetch(self, hits, page):
+        """Fetch the hits (a LazyList) up to and including the given page.
+        Returns whether the page exists. This runs the search, so it should
+        not be called while holding the prompt's lock.
+        """
+        n = hits.fetch((page + 1) * self._page_size + 1)
+        return page == 0 or n > page * self._page_size
+
+    def get_lines(self):
+        if not self.active:
+            return []
+        if self._hits is None:
+            return [f"\x1b[0;7m {self._title}: searching ... \x1b[0m"]
+        i0 = self._page * self._page_size
+        n = len(self._hits)
+        hits = [self._hits[i] for i in range(i0, min(n, i0 + self._page_size))]
+        if hits:
+            more = "+" if n > i0 + self._page_size else ""
+            info = f"hits {i0 + 1}-{i0 + len(hits)}{more}, pageup/pagedown, escape"
+        else:
+            info = "no hits"
+        lines = [f"\x1b[0;7m {self._title}: {info} \x1b[0m"]
+        for line_number, line in hits:
+            text = self._escape_code_re.sub("", line.decode(errors="replace"))
+            text = f"{line_number:>6} {text}"
+            if len(text) > self._width:
+                text = text[: self._width - 1] + "…"
+            lines.append(text)
+        return lines
+
+
 class StatusHelper:
 
     def __init__(self):
@@ -1,4 +1,6 @@
+import io
 import os
+import ast
 import sys
 import time
 import queue
@@ -12,6 +14,15 @@ import keyword
 import inspect  # noqa - Must be in this namespace
 import bdb
 import linecache
+import tokenize
+import weakref
+import hashlib
+import marshal
+import importlib.util
+from collections import OrderedDict
+
+from .loops import get_main_thread_loop, new_private_loop
+from .magic import Magician
 
 
 print_direct = print
@@ -82,8 +93,13 @@ class Repl:
         # Init datase to store source code that we execute
         self._codeCollection = ExecutedSourceCollection()
 
+        # Init cache of compiled code, for code that is run repeatedly
+        cache_dir = os.getenv("PYTERM_CODE_CACHE", "") or None
+        self._codeCache = CodeCache(cache_dir=cache_dir)
+
         # Init buffer to deal with multi-line command in the shell
         self._buffer = []
+        self._completeness = CompletenessChecker()
 
         # Create compiler
         if sys.platform.startswith("java"):
@@ -92,9 +108,16 @@ class Repl:
             self._compile = compiler.compile  # or 'exec' does not work
         else:
             self._compile = CommandCompiler()
+            # Allow top-level await (Python 3.8+)
+            self._compile.compiler.flags |= getattr(
+                ast, "PyCF_ALLOW_TOP_LEVEL_AWAIT", 0
+            )
 
-        # # Instantiate magician and tracer
-        # self.magician = Magician()
+        # Loop to run coroutines in, when no asyncio loop is running
+        self._asyncLoop = None
+
+        # Instantiate magician (and tracer)
+        self.magician = Magician(self)
         # self.debugger = Debugger()
 
         # To keep track of whether to send a new prompt, and whether more
@@ -399,13 +422,15 @@ class Repl:
                 # Notify what we're doing
                 self.newPrompt = True
                 # Convert command
-                line2 = line1  # self.magician.convert_command(line1.rstrip("\n"))
+                line2 = line1.rstrip("\n")
+                if self.magician.collecting or not self.more:
+                    line2 = self.magician.convert_command(line2)
                 # Execute actual code
                 if line2 is not None:
                     for line3 in line2.split("\n"):  # not splitlines!
                         self.more = self.pushline(line3)
                 else:
-                    self.more = False
+                    self.more = self.magician.collecting
                     self._resetbuffer()
 
         elif False:
@@ -429,6 +454,7 @@ class Repl:
     def _resetbuffer(self):
         """Reset the input buffer."""
         self._buffer = []
+        self._completeness.reset()
 
     def pushline(self, line):
         """Push a line to the interpreter.
@@ -443,17 +469,23 @@ class Repl:
         value is 1 if more input is required, 0 if the line was dealt
         with in some way (this is the same as _runlines()).
 
+        The source is only compiled when it can be complete, so that
+        entering a block of code takes linear time.
         """
-        # Get buffer, join to get source
+        # Get buffer, and only compile if the source can be complete
         buffer = self._buffer
         buffer.append(line)
+        if not self._completeness.push(line):
+            return True
         source = "\n".join(buffer)
         # Clear buffer and run source
-        self._resetbuffer()
+        self._buffer = []
         more = self._runlines(source, self._filename)
-        # Create buffer if needed
+        # Restore buffer if needed
         if more:
             self._buffer = buffer
+        else:
+            self._completeness.reset()
         return more
 
     def _runlines(self, source, filename="<input>", symbol="single"):
@@ -512,6 +544,7 @@ class Repl:
         source, fname, lineno = msg["source"], msg["fname"], msg["lineno"]
         cellName = msg.get("cellName", "")
         source += "\n"
+        display_last = False
 
         # Change directory?
         if msg.get("changeDir", False) and os.path.isfile(fname):
@@ -533,28 +566,8 @@ class Repl:
                 lineno1,
                 fname_show,
             )
-            # Try to get the last expression printed in the cell.
-            try:
-                import ast
-
-                tree = ast.parse(source, fname, "exec")
-                if (
-                    isinstance(tree.body[-1], ast.Expr)
-                    and tree.body[-1].col_offset == 0
-                ):
-                    e = tree.body[-1]
-                    lines = source.splitlines()
-                    lines[e.lineno - 1] = "_=\\\n" + lines[e.lineno - 1]
-                    source2 = (
-                        "\n".join(lines).rstrip()
-                        + "\nif _ is not None:\n  print(repr(_))\n"
-                    )
-                    ast.parse(
-                        source2, fname, "exec"
-                    )  # This is to make sure it still compiles
-                    source = source2
-            except Exception:
-                pass
+            # Show the value of the last expression in the cell
+            display_last = True
         elif lineno1 == lineno2:
             runtext = '(executing line %i of "%s")\n' % (lineno1, fname_show)
         else:
@@ -577,11 +590,17 @@ class Repl:
         if lineno:
             fname = "%s+%i" % (fname, lineno)
 
+        # Cells can start with a magic command
+        if self.magician.run_cell(source, fname):
+            return
+
         # Try compiling the source
         code = None
         try:
             # Compile
-            code = self.compilecode(source, fname, "exec")
+            code = self.compilecode_cached(
+                source, fname, "exec", display_last=display_last
+            )
 
         except (OverflowError, SyntaxError, ValueError):
             self.showsyntaxerror(fname)
@@ -625,7 +644,7 @@ class Repl:
         code = None
         try:
             # Compile
-            code = self.compilecode(source, fname, "exec")
+            code = self.compilecode_cached(source, fname, "exec")
         except (OverflowError, SyntaxError, ValueError):
             time.sleep(0.2)  # Give stdout time to be send
             self.showsyntaxerror(fname)
@@ -640,9 +659,10 @@ class Repl:
             # Incomplete code
             self.write("Could not run code because it is incomplete.\n")
 
-    def compilecode(self, source, filename, mode, *args, **kwargs):
+    def compilecode(self, source, filename, mode, *args, display_last=False, **kwargs):
         """Compile source code.
         Will mangle coding definitions on first two lines.
+        If display_last is True, the value of a final expression is shown.
 
         * This method should be called with Unicode sources.
         * Source newlines should consist only of LF characters.
@@ -667,8 +687,50 @@ class Repl:
             source = "\n".join(parts)
 
         # Compile
+        if display_last:
+            return self._compile_display_last(source, filename, mode)
         return self._compile(source, filename, mode, *args, **kwargs)
 
+    def _compile_display_last(self, source, filename, mode):
+        """Compile via the AST, so that the value of a final expression
+        is passed to sys.displayhook, like in interactive mode. The source
+        is parsed once, and line numbers are unaffected.
+        """
+        compiler = getattr(self._compile, "compiler", None)
+        flags = getattr(compiler, "flags", 0)
+        tree = compile(source, filename, mode, flags | ast.PyCF_ONLY_AST, True)
+        last = tree.body[-1] if tree.body else None
+        if isinstance(last, ast.Expr):
+            # __import__('sys').displayhook(<expr>)
+            get_sys = ast.Call(
+                func=ast.Name(id="__import__", ctx=ast.Load()),
+                args=[ast.Constant(value="sys")],
+                keywords=[],
+            )
+            displayhook = ast.Attribute(
+                value=get_sys, attr="displayhook", ctx=ast.Load()
+            )
+            last.value = ast.Call(func=displayhook, args=[last.value], keywords=[])
+            ast.fix_missing_locations(tree)
+        return compile(tree, filename, mode, flags, True)
+
+    def compilecode_cached(self, source, filename, mode, display_last=False):
+        """Compile source code, using a cache of code objects.
+
+        Only complete code is cached. The compiler flags (e.g. from
+        __future__ imports) are part of the key.
+        """
+        compiler = getattr(self._compile, "compiler", None)
+        flags = getattr(compiler, "flags", 0)
+        key_mode = mode + "+display" if display_last else mode
+        key = self._codeCache.get_key(source, filename, key_mode, flags)
+        code = self._codeCache.get(key)
+        if code is None:
+            code = self.compilecode(source, filename, mode, display_last=display_last)
+            if code:
+                self._codeCache.put(key, code)
+        return code
+
     def execcode(self, code):
         """Execute a code object.
 
@@ -681,18 +743,25 @@ class Repl:
         caller should be prepared to deal with it.
 
         The globals variable is used when in debug mode.
+
+        Returns whether the code ran without errors.
         """
 
+        # Code with top-level await produces a coroutine
+        run = exec
+        if code.co_flags & inspect.CO_COROUTINE:
+            run = self._eval_coroutine
+
         try:
             if self._dbFrames:
                 self.apply_breakpoints()
-                exec(code, self.globals, self.locals)
+                run(code, self.globals, self.locals)
             else:
                 # Turn debugger on at this point. If there are no breakpoints,
                 # the tracing is disabled for better performance.
                 self.apply_breakpoints()
                 # self.debugger.set_on()
-                exec(code, self.locals)
+                run(code, self.locals)
         except bdb.BdbQuit:
             self.dbstop_handler()
         except Exception:
@@ -701,6 +770,54 @@ class Repl:
         except KeyboardInterrupt:  # is a BaseException, not an Exception
             time.sleep(0.2)
             self.showtraceback()
+        else:
+            return True
+        return False
+
+    def _eval_coroutine(self, code, globals, locals=None):
+        coro = eval(code, globals, locals)
+        self.runcoroutine(coro, code)
+
+    def runcoroutine(self, coro, code=None):
+        """Run a coroutine from code with top-level await.
+
+        If the main thread runs an asyncio loop, the coroutine is scheduled
+        on that loop, so it does not block. Otherwise, it is run to
+        completion in a private loop. Exceptions are shown when it is done.
+        """
+        loop = get_main_thread_loop()
+        if loop is not None:
+            import asyncio
+
+            future = asyncio.run_coroutine_threadsafe(coro, loop)
+            future.add_done_callback(lambda f: self._on_coroutine_done(f, code))
+            return
+
+        if self._asyncLoop is None or self._asyncLoop.is_closed():
+            self._asyncLoop = new_private_loop()
+        task = self._asyncLoop.create_task(coro)
+        try:
+            self._asyncLoop.run_until_complete(task)
+        except BaseException:
+            if not task.done():
+                task.cancel()  # e.g. KeyboardInterrupt while waiting
+                raise
+        self._on_coroutine_done(task, code)
+
+    def _on_coroutine_done(self, future, code):
+        if future.cancelled() or future.exception() is None:
+            return
+        err = future.exception()
+        if isinstance(err, SystemExit):
+            raise err
+        # Show the traceback from the executed code onwards
+        tb = err.__traceback__
+        while tb is not None and tb.tb_frame.f_code is not code:
+            tb = tb.tb_next
+        try:
+            raise err.with_traceback(tb or err.__traceback__)
+        except BaseException:
+            self.showtraceback()
 
     def apply_breakpoints(self):
         """Breakpoints are updated at each time a command is given,
@@ -882,16 +999,49 @@ class ExecutedSourceCollection:
     the linecache module so that we first try our cache to look up the
     lines. In that way we also allow third party modules
     to get the lines for executed cells.
+
+    The sources are stored as lists of lines, ready for linecache. When the
+    total size exceeds max_bytes, the least recently used sources are
+    dropped, except those for which a code object is still alive (e.g. a
+    function defined in it, or a frame in a traceback).
     """
 
-    def __init__(self):
-        self._cache = {}
+    def __init__(self, max_bytes=32 * 2**20):
+        self._max_bytes = max_bytes
+        self._nbytes = 0
+        self._cache = OrderedDict()  # filename -> (lines, nbytes, code refs)
         self._patch()
 
+    @property
+    def nbytes(self):
+        """The total size of the stored sources."""
+        return self._nbytes
+
     def store_source(self, code_object, source):
-        self._cache[code_object.co_filename] = source
+        filename = code_object.co_filename
+        lines = [line + "\n" for line in source.splitlines()]
+        refs = [weakref.ref(code) for code in _iter_code_objects(code_object)]
+        old = self._cache.pop(filename, None)
+        if old is not None:
+            self._nbytes -= old[1]
+        self._cache[filename] = lines, len(source), refs
+        self._nbytes += len(source)
+        if self._nbytes > self._max_bytes:
+            self._evict()
+
+    def _evict(self):
+        for filename, (lines, nbytes, refs) in list(self._cache.items()):
+            if self._nbytes <= self._max_bytes:
+                break
+            if any(ref() is not None for ref in refs):
+                continue  # pinned
+            del self._cache[filename]
+            self._nbytes -= nbytes
 
     def _patch(self):
+        original_getlines = linecache.getlines
+        cache = self._cache
+
         def getlines(filename, module_globals=None):
             # !!! do not use "import" inside this function because it can
             # cause an infinite recursion loop with the import override in
@@ -899,15 +1049,223 @@ class ExecutedSourceCollection:
 
             # Try getting the source from our own cache,
             # otherwise fallback to linecache's own cache
-            src = self._cache.get(filename, "")
-            if src:
-                return [line + "\n" for line in src.splitlines()]
+            item = cache.get(filename)
+            if item is not None and item[0]:
+                cache.move_to_end(filename)
+                return item[0]
             else:
                 if module_globals is None:
-                    return linecache._getlines(filename)  # only valid sig in 2.4
+                    return original_getlines(filename)  # only valid sig in 2.4
                 else:
-                    return linecache._getlines(filename, module_globals)
+                    return original_getlines(filename, module_globals)
 
         # Monkey patch
-        linecache._getlines = linecache.getlines
+        linecache._getlines = original_getlines
         linecache.getlines = getlines
+
+
+def _iter_code_objects(code):
+    yield code
+    for ob in code.co_consts:
+        if isinstance(ob, type(code)):
+            yield from _iter_code_objects(ob)
+
+
+class CompletenessChecker:
+    """Tracks whether multi-line input can be complete, line by line.
+
+    For each pushed line, the open brackets, string state and line
+    continuation are updated by tokenizing only that line. The input can
+    be complete when nothing is open, and the current logical line is the
+    first, starts at column zero, or is empty. Only then is it worth
+    running the (real) compiler on the whole input. This makes entering
+    (or pasting) a block of n lines O(n) instead of O(n**2).
+    """
+
+    _closing = {")": "(", "]": "[", "}": "{"}
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._brackets = ""  # stack of open brackets
+        self._string = None  # quote that closes an open multi-line string
+        self._continued = False  # whether the last line ended with a backslash
+        self._nlines = 0  # number of logical lines started
+        self._indented = False  # whether the current logical line is indented
+
+    def push(self, line):
+        """Push a line (without newline). Returns whether the input so far
+        can be complete.
+        """
+        at_line_start = not (self._brackets or self._string or self._continued)
+        if at_line_start:
+            self._nlines += 1
+            self._indented = line[:1].isspace()
+            if not line.strip():
+                return True
+
+        rest = line
+        if self._string:
+            rest = self._consume_string(line)
+            if rest is None and len(self._string) == 1:
+                if not line.rstrip().endswith("\\"):
+                    return True  # unterminated, let the compiler report it
+        self._continued = False
+        if rest is not None and not self._tokenize(rest):
+            return True  # invalid, let the compiler report the error
+
+        if self._brackets or self._string or self._continued:
+            return False
+        return self._nlines == 1 or not self._indented
+
+    def _consume_string(self, line):
+        # Find the end of the open string. Returns the rest of the line or None.
+        quote = self._string
+        i = 0
+        while True:
+            i = line.find(quote, i)
+            if i < 0:
+                return None
+            n_backslashes = len(line[:i]) - len(line[:i].rstrip("\\"))
+            if n_backslashes % 2 == 0:
+                self._string = None
+                return line[i + len(quote) :]
+            i += 1
+
+    def _tokenize(self, line):
+        # Returns False if the line is certainly invalid.
+        # Prefix the open brackets, so the tokenizer sees a consistent state
+        prefix = self._brackets
+        text = prefix + line + "\n"
+        brackets = []
+        try:
+            for token in tokenize.generate_tokens(io.StringIO(text).readline):
+                if token.type == tokenize.OP:
+                    if token.string in "([{":
+                        brackets.append(token.string)
+                    elif token.string in ")]}":
+                        if not brackets or brackets[-1] != self._closing[token.string]:
+                            return False  # a mismatched closing bracket
+                        brackets.pop()
+                elif token.type == tokenize.ERRORTOKEN and token.string in "'\"":
+                    return False  # an unterminated string (Python < 3.12)
+        except tokenize.TokenError as err:
+            msg, (row, col) = err.args
+            if "string" in msg and row == 1:
+                # The column points at the start of the string, or (on
+                # Python 3.12+) one character further.
+                i = min(col, len(text))
+                while i > 0 and text[i - 1] in "'\"rbfuRBFU":
+                    i -= 1
+                quote = text[i:].lstrip("rbfuRBFU")[:3]
+                if quote in ('"""', "'''"):
+                    self._string = quote  # an open triple quoted string
+                elif line.rstrip().endswith("\\"):
+                    self._string = quote[:1]  # a backslash-continued string
+                else:
+                    return False  # an unterminated string
+            elif not brackets:
+                self._continued = line.rstrip().endswith("\\")
+        except SyntaxError:
+            pass  # Let the compiler report it
+        self._brackets = "".join(brackets)
+        return True
+
+
+class CodeCache:
+    """An LRU cache of code objects, so that re-running unchanged code
+    skips compilation.
+
+    Code objects are keyed by a hash of the source, filename, mode and
+    compiler flags. If a cache_dir is given, code objects are also stored
+    there as marshal files, so they survive a restart. That directory holds
+    at most max_files files: the least recently used are removed.
+    """
+
+    def __init__(self, maxsize=64, cache_dir=None, max_files=1000):
+        self._maxsize = maxsize
+        self._cache_dir = cache_dir
+        self._max_files = max_files
+        self._cache = OrderedDict()  # key -> code
+
+    def get_key(self, source, filename, mode, flags=0):
+        """Get the key (a hex digest) for the given compile arguments."""
+        h = hashlib.sha256(f"{filename}\0{mode}\0{flags}\0".encode())
+        h.update(source.encode("utf-8", "surrogatepass"))
+        return h.hexdigest()
+
+    def get(self, key):
+        """Get a code object, or None."""
+        code = self._cache.get(key)
+        if code is not None:
+            self._cache.move_to_end(key)
+        elif self._cache_dir:
+            code = self._load(key)
+            if code is not None:
+                self._add(key, code)
+        return code
+
+    def put(self, key, code):
+        """Store a code object."""
+        self._add(key, code)
+        if self._cache_dir:
+            self._save(key, code)
+
+    def _add(self, key, code):
+        self._cache[key] = code
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+
+    def _load(self, key):
+        filename = os.path.join(self._cache_dir, key + ".bin")
+        try:
+            with open(filename, "rb") as f:
+                bb = f.read()
+        except OSError:
+            return None
+        # The magic number is specific to the Python version
+        magic = importlib.util.MAGIC_NUMBER
+        if not bb.startswith(magic):
+            return None
+        try:
+            code = marshal.loads(bb[len(magic) :])
+        except Exception:
+            return None
+        try:
+            os.utime(filename)  # mark as recently used
+        except OSError:
+            pass
+        return code
+
+    def _save(self, key, code):
+        filename = os.path.join(self._cache_dir, key + ".bin")
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            with open(tmp_filename, "wb") as f:
+                f.write(importlib.util.MAGIC_NUMBER + marshal.dumps(code))
+            os.replace(tmp_filename, filename)
+            self._prune()
+        except (OSError, ValueError):
+            pass  # Best effort
+
+    def _prune(self):
+        # Remove the least recently used files if there are too many
+        entries = []
+        with os.scandir(self._cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".bin"):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        pass
+        if len(entries) <= self._max_files:
+            return
+        entries.sort()
+        for _, path in entries[: len(entries) - self._max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -15,5 +15,9 @@ is why we have a base Terminal class, with implementations for Unix and Windows.
 """
 
 from ._context import TerminalContext  # noqa
-from ._input_reader import InputReader  # noqa
+from ._input_reader import InputReader, LineReader  # noqa
+from ._input_buffer import InputBuffer  # noqa
 from ._io_proxies import ProxyStdin, ProxyStdout  # noqa
+from ._output import OutputBuffer, OutputWriter, ThreadLineBuffer  # noqa
+from ._scrollback import Scrollback  # noqa
+from ._session_log import SessionLog, SessionLogTee  # noqa
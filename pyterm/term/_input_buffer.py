@@ -0,0 +1,143 @@
+import queue
+import threading
+
+
+class InputBuffer:
+    """A thread-safe byte buffer for stdin, fed with the submitted lines.
+
+    All reads (lines, bytes, and async reads) consume from the same buffer,
+    so they can be mixed. Reads block until enough data is available, or
+    until the buffer is closed (EOF). The ``get()`` and ``get_nowait()``
+    methods provide a queue-like interface that produces whole lines.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._eof = False
+        self._lock = threading.Lock()
+        self._has_data = threading.Condition(self._lock)
+        self._async_waiters = []  # list of (loop, future)
+
+    @property
+    def closed(self):
+        return self._eof
+
+    def put(self, data):
+        """Add data (str or bytes) to the buffer. A str is a line."""
+        if isinstance(data, str):
+            data = (data + "\n").encode()
+        with self._lock:
+            self._buffer += data
+            self._wake()
+
+    def close(self):
+        """Signal EOF. Pending data can still be read."""
+        with self._lock:
+            self._eof = True
+            self._wake()
+
+    def _wake(self):
+        # Called with the lock held
+        self._has_data.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_set_future_done, future)
+            except RuntimeError:
+                pass  # loop is closed
+
+    def _take(self, n):
+        # Called with the lock held
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    def _line_end(self, size):
+        # Called with the lock held. Get the end of the next line, or None.
+        buffer = self._buffer
+        i = buffer.find(b"\n")
+        if i >= 0:
+            end = i + 1
+        elif self._eof or (size >= 0 and len(buffer) >= size):
+            end = len(buffer)
+        else:
+            return None
+        return end if size < 0 else min(end, size)
+
+    # --- Reading
+
+    def read(self, size=-1):
+        """Read size bytes, or until EOF if size is negative or not given."""
+        with self._lock:
+            if size is None or size < 0:
+                while not self._eof:
+                    self._has_data.wait()
+                return self._take(len(self._buffer))
+            while len(self._buffer) < size and not self._eof:
+                self._has_data.wait()
+            return self._take(size)
+
+    def read1(self, size=-1):
+        """Read at most size bytes, waiting only until some data is available."""
+        if size == 0:
+            return b""  # like io.BufferedReader, don't wait
+        with self._lock:
+            while not self._buffer and not self._eof:
+                self._has_data.wait()
+            if size is None or size < 0:
+                size = len(self._buffer)
+            return self._take(size)
+
+    def readinto(self, b):
+        """Read bytes into the given writable buffer. Returns the number of bytes."""
+        with memoryview(b) as view:
+            data = self.read1(view.nbytes)
+            view[: len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        """Read a line (including the newline), or b"" on EOF."""
+        size = -1 if size is None else size
+        with self._lock:
+            end = self._line_end(size)
+            while end is None:
+                self._has_data.wait()
+                end = self._line_end(size)
+            return self._take(end)
+
+    async def areadline(self, size=-1):
+        """Read a line without blocking the event loop."""
+        import asyncio  # no import at module level, because of loop patching
+
+        loop = asyncio.get_running_loop()
+        size = -1 if size is None else size
+        while True:
+            with self._lock:
+                end = self._line_end(size)
+                if end is not None:
+                    return self._take(end)
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            await future
+
+    # --- Queue-like interface
+
+    def get(self, block=True, timeout=None):
+        """Get the next line. Raises queue.Empty if there is no complete line."""
+        with self._lock:
+            if block:
+                self._has_data.wait_for(
+                    lambda: self._line_end(-1) is not None, timeout
+                )
+            end = self._line_end(-1)
+            if not end:
+                raise queue.Empty()
+            return self._take(end)
+
+    def get_nowait(self):
+        return self.get(False)
+
+
+def _set_future_done(future):
+    if not future.done():
+        future.set_result(None)
@@ -43,3 +43,35 @@ class InputReader(threading.Thread):
             logger.error(f"io thread errored: {str(err)}")
         else:
             logger.info("io thread stopped")
+
+
+class LineReader(threading.Thread):
+    """A thread that reads lines from a binary file, e.g. stdin when it is not
+    in raw mode, and passes them (as bytes) to the callback. At EOF, the
+    callback is called with b"".
+    """
+
+    def __init__(self, file, callback):
+        super().__init__()
+        self._file = file
+        self._callback = callback
+        self.daemon = True
+
+    def run(self):
+        logger.info("line input thread started")
+        readline = self._file.readline
+        callback = self._callback
+
+        try:
+            while True:
+                line = readline()
+                try:
+                    callback(line)
+                except Exception as err:
+                    logger.error(f"Error in handling input: {err}")
+                if not line:  # stdin is closed
+                    break
+        except Exception as err:
+            logger.error(f"io thread errored: {str(err)}")
+        else:
+            logger.info("io thread stopped")
@@ -1,43 +1,113 @@
 import io
 import sys
+import time
+import codecs
 import logging
+import weakref
 import threading
 
+from .. import _trace
+from ._output import OutputBuffer, ThreadLineBuffer
+
 
 logger = logging.getLogger("pyterm")
 
+SGR_RESET = b"\x1b[0m"
+
+# The pending progress of the streams that share a prompt, see
+# ProxyStdoutBuffer._write_progress().
+_pending_progress = weakref.WeakKeyDictionary()
+
 
 class ProxyStdin(io.TextIOWrapper):
-    """Object representing a proxy/fake text stdin stream."""
+    """Object representing a proxy/fake text stdin stream.
+
+    All reads go straight to the underlying InputBuffer (we don't use the
+    TextIOWrapper's internal buffer), so different kinds of reads can be
+    mixed, also with reads from ``sys.stdin.buffer``.
+    """
 
-    def __init__(self, lines_queue, name):
-        super().__init__(ProxyStdinBuffer(lines_queue, name))
+    def __init__(self, input_buffer, name):
+        super().__init__(ProxyStdinBuffer(input_buffer, name), encoding="utf-8")
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._decoder.decode(self.buffer.read(), final=True)
+        text = ""
+        while len(text) < size:
+            # Each byte is at most one character, so we never read too much
+            bb = self.buffer.read1(size - len(text))
+            if not bb:
+                break  # EOF
+            text += self._decoder.decode(bb)
+        return text
 
     def readline(self, size=-1):
-        return self.buffer.readline(size).decode()
+        return self._decoder.decode(self.buffer.readline(size))
+
+    async def areadline(self, size=-1):
+        """Read a line without blocking the event loop."""
+        return self._decoder.decode(await self.buffer.areadline(size))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration()
+        return line
 
 
 class ProxyStdout(io.TextIOWrapper):
     """Object representing a proxy/fake text stdout stream."""
 
-    def __init__(self, original_file, name, prompt=None):
+    def __init__(
+        self,
+        original_file,
+        name,
+        prompt=None,
+        flood_control=None,
+        writer=None,
+        scrollback=None,
+        color=None,
+        thread_lines=False,
+        session_log=None,
+    ):
         super().__init__(
-            ProxyStdoutBuffer(original_file.buffer, name, prompt),
+            ProxyStdoutBuffer(
+                original_file.buffer,
+                name,
+                prompt,
+                flood_control=flood_control,
+                writer=writer,
+                scrollback=scrollback,
+                color=color,
+                thread_lines=thread_lines,
+                session_log=session_log,
+            ),
             encoding=original_file.encoding,
+            errors=original_file.errors,
         )
+        self._encoding = self.encoding
+        self._errors = self.errors
+        self._buffer_write = self.buffer.write
 
     def write(self, text):
-        self.buffer.write(text.encode(self.encoding))
+        # Encode once, and pass the bytes on without further copies
+        self._buffer_write(text.encode(self._encoding, self._errors))
+        return len(text)
 
 
 class ProxyStdinBuffer:
     """Object representing a proxy/fake binary stdin stream."""
 
-    def __init__(self, lines_queue, name="<stdin>", isatty=True):
+    def __init__(self, input_buffer, name="<stdin>", isatty=True):
         self._name = name
         self._closed = False
         self._isatty = isatty
-        self.lines_queue = lines_queue
+        self.input_buffer = input_buffer
 
     def __del__(self):
         self.close()
@@ -56,6 +126,7 @@ class ProxyStdinBuffer:
 
     def close(self):
         """Close the file object."""
+        self.input_buffer.close()
         sys.__stdin__.close()
         self._closed = True
         return
@@ -81,28 +152,104 @@ class ProxyStdinBuffer:
     # def fileno(self) -> if we implement it to raise an error, TextIOWrapper(..) fails
 
     def read(self, size=-1):
-        raise io.UnsupportedOperation(
-            "If your application reads from stdin, you should probably not boot it via pyterm! Note that readline is supported though."
-        )
+        return self.input_buffer.read(size)
+
+    def read1(self, size=-1):
+        return self.input_buffer.read1(size)
+
+    def readinto(self, b):
+        return self.input_buffer.readinto(b)
 
     def readline(self, size=-1):
-        return self.lines_queue.get()
+        return self.input_buffer.readline(size)
+
+    async def areadline(self, size=-1):
+        return await self.input_buffer.areadline(size)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration()
+        return line
 
 
 class ProxyStdoutBuffer:
-    """Object representing a proxy/fake binary stdout stream."""
+    """Object representing a proxy/fake binary stdout stream.
+
+    Writes that only rewrite the current line (i.e. a carriage return but no
+    newline, like progress bars do) are coalesced, and rendered at most
+    frame_rate times per second.
+
+    If flood_control is given ("block" or "skip"), output is collected in
+    an OutputBuffer, and written to the terminal in large chunks. To keep the
+    order of the writes to multiple streams, pass a shared OutputBuffer
+    instead. If an OutputWriter is given, writes are queued, and written by
+    its thread. If a Scrollback is given, all output is also stored in it.
 
-    def __init__(self, original_file, name, prompt=None, isatty=True):
+    The color is an SGR parameter string (e.g. "31" for red), to colorize
+    all output of this stream.
+
+    If thread_lines is True, the output of each thread is buffered until it
+    completes a line, so that partial lines of threads don't get mixed up.
+    Use "prefix" to also prefix these lines with the thread name.
+    """
+
+    frame_rate = 30
+
+    def __init__(
+        self,
+        original_file,
+        name,
+        prompt=None,
+        isatty=True,
+        flood_control=None,
+        writer=None,
+        scrollback=None,
+        color=None,
+        thread_lines=False,
+        session_log=None,
+    ):
         self._name = name
         self._closed = False
         self._isatty = isatty
         self._original_file = original_file
+        self._scrollback = scrollback
+        self._session_log = session_log
+        self._progress_timer = None
+        self._last_progress = None  # latest state of the rewritten line
+        self._last_write_time = 0
+        self._output = None
+        self._own_output = False
+        self._writer = writer
+        self._queue = None
+        # Pre-encode the escape codes for the color
+        self._color_prefix = f"\x1b[{color}m".encode() if color else None
+        if flood_control and writer is not None:
+            raise ValueError("Cannot use both flood_control and a writer.")
+        elif isinstance(flood_control, OutputBuffer):
+            self._output = flood_control
+        elif flood_control:
+            self._output = OutputBuffer(self._write, policy=flood_control)
+            self._own_output = True
+        elif writer is not None:
+            self._queue = writer.add_stream(original_file)
+        self._thread_lines = None
+        if thread_lines:
+            prefix = thread_lines == "prefix"
+            self._thread_lines = ThreadLineBuffer(self._emit, prefix=prefix)
 
         self._prompt = StubPrompt(original_file) if prompt is None else prompt
         assert hasattr(self._prompt, "file")
         assert hasattr(self._prompt, "lock")
         assert hasattr(self._prompt, "clear")
         assert hasattr(self._prompt, "write_prompt")
+        with self._prompt.lock:
+            self._pending = _pending_progress.setdefault(
+                self._prompt, PendingProgress()
+            )
 
     def __del__(self):
         self.close()
@@ -121,6 +268,21 @@ class ProxyStdoutBuffer:
 
     def close(self):
         """Close the file object."""
+        if self._thread_lines is not None:
+            self._thread_lines.flush_all()
+        if self._progress_timer is not None:
+            self._progress_timer.cancel()
+        if self._pending.owner is self:
+            self._write(b"")
+        if self._last_progress is not None:
+            self._record_progress()
+        if self._output is not None:
+            if self._own_output:
+                self._output.close()
+            else:
+                self._output.flush()
+        elif self._writer is not None:
+            self._writer.flush()
         self._original_file.close()
         self._closed = True
         return
@@ -138,6 +300,14 @@ class ProxyStdoutBuffer:
         return False
 
     def flush(self):
+        if self._thread_lines is not None:
+            self._thread_lines.flush()
+        if self._pending.owner is self:
+            self._write(b"")
+        if self._output is not None:
+            self._output.flush()
+        elif self._writer is not None:
+            self._writer.flush()
         self._original_file.flush()
 
     def isatty(self):
@@ -146,24 +316,127 @@ class ProxyStdoutBuffer:
     # def fileno(self) -> if we implement it to raise an error, TextIOWrapper(..) fails
 
     def write(self, bb):
-        logger.info(f"stdout buffer write {id(self._original_file)}: {bb}")
-        with self._prompt.lock:
-            self._prompt.clear()
-            result = self._original_file.write(bb)
-            if self._prompt.file is not self._original_file:
-                self._original_file.flush()
-            self._prompt.write_prompt()
-            return result
+        n = len(bb)
+        if self._thread_lines is not None:
+            self._thread_lines.write(bb)
+        else:
+            self._emit(bb)
+        return n
+
+    def _emit(self, bb):
+        if (
+            self._queue is None
+            and self._output is None
+            and isinstance(bb, bytes)
+            and b"\r" in bb
+            and b"\n" not in bb
+        ):
+            self._write_progress(bb)
+            return
+        if self._last_progress is not None:
+            self._record_progress()
+        if self._scrollback is not None:
+            self._scrollback.append(bb)
+        if self._session_log is not None:
+            self._session_log.write(bb)
+        if self._color_prefix is not None:
+            bb = b"".join([self._color_prefix, bb, SGR_RESET])
+        if self._queue is not None:
+            self._writer.write(self._queue, bb)
+        elif self._output is not None:
+            self._output.write(bb, self._write)
+        else:
+            self._write(bb)
 
     def writelines(self, lines):
-        logger.info("stdout buffer write lines")
+        self.write(b"".join(lines))
+
+    def _write(self, bb):
+        t0 = time.perf_counter() if _trace.enabled else 0
         with self._prompt.lock:
+            owner, progress = self._pending.pop()
+            if owner is not None and owner._color_prefix is not None:
+                progress = b"".join([owner._color_prefix, progress, SGR_RESET])
+            if owner is self:
+                bb = progress + bb
             self._prompt.clear()
-            for line in lines:
-                self._original_file.write(line)
+            if owner is not None and owner is not self:
+                # Pending progress of another stream goes first
+                owner._original_file.write(progress)
+                owner._original_file.flush()
+            self._original_file.write(bb)
             if self._prompt.file is not self._original_file:
                 self._original_file.flush()
             self._prompt.write_prompt()
+            self._last_write_time = time.perf_counter()
+        if _trace.enabled:
+            t1 = time.perf_counter()
+            _trace.event("stdout.write", nbytes=len(bb), duration=t1 - t0)
+
+    def _write_progress(self, bb):
+        # An in-place rewrite of the current line, e.g. by a progress bar. Only
+        # the last non-empty segment between carriage returns is visible, so we
+        # keep only that (and a trailing carriage return, if any), and render
+        # it at most frame_rate times per second. Because we write the last
+        # state in full, the cursor column ends up correct. The pending state
+        # is shared by the streams of the prompt, and written before the
+        # output of any of them, so that the order of the output is kept.
+        with self._prompt.lock:
+            pending = self._pending
+            if pending.owner is not None and pending.owner is not self:
+                self._write(b"")
+            progress = bb if pending.owner is None else pending.data + bb
+            end = len(progress.rstrip(b"\r"))
+            start = max(progress.rfind(b"\r", 0, end), 0)
+            pending.owner = self
+            pending.data = progress[start:end] + progress[end : end + 1]
+            self._last_progress = pending.data
+            next_time = self._last_write_time + 1 / self.frame_rate
+            wait_time = next_time - time.perf_counter()
+            if wait_time <= 0:
+                self._write(b"")
+            elif self._progress_timer is None:
+                self._progress_timer = threading.Timer(wait_time, self._flush_progress)
+                self._progress_timer.daemon = True
+                self._progress_timer.start()
+        if _trace.enabled:
+            _trace.event("stdout.progress", nbytes=len(bb))
+        return len(bb)
+
+    def _record_progress(self):
+        # Only the last state of a rewritten line goes into the scrollback and
+        # session log, when other output follows, rather than every update.
+        with self._prompt.lock:
+            progress, self._last_progress = self._last_progress, None
+        progress = (progress or b"").strip(b"\r")
+        if not progress:
+            return
+        if self._scrollback is not None:
+            self._scrollback.append(progress)
+        if self._session_log is not None:
+            self._session_log.write(progress)
+
+    def _flush_progress(self):
+        with self._prompt.lock:
+            self._progress_timer = None
+            if self._pending.owner is self:
+                self._write(b"")
+
+
+class PendingProgress:
+    """The pending in-place rewrite of the current line, of one of the streams
+    that share a prompt. Only used while holding the prompt's lock.
+    """
+
+    def __init__(self):
+        self.owner = None  # the ProxyStdoutBuffer that wrote it
+        self.data = b""
+
+    def pop(self):
+        """Get the owner and data, and clear them."""
+        owner, data = self.owner, self.data
+        self.owner, self.data = None, b""
+        return owner, data
 
 
 class StubPrompt:
@@ -0,0 +1,412 @@
+import os
+import time
+import logging
+import tempfile
+import weakref
+import itertools
+import threading
+from collections import deque
+
+from .. import _trace
+
+
+logger = logging.getLogger("pyterm")
+
+
+class OutputBuffer:
+    """A bounded buffer for output, that is flushed in large chunks.
+
+    Writes are collected in the buffer, and a background thread flushes
+    them with a single call to ``write_func(data)`` at most every interval
+    seconds. This means that many small writes result in a few large
+    terminal writes. The data is a memoryview of a reused buffer, so it is
+    only valid during the call.
+
+    A buffer can be shared by multiple streams (e.g. stdout and stderr), by
+    passing their own write_func to ``write()``. The writes are flushed in
+    the order in which they were made, consecutive writes of the same stream
+    in a single call.
+
+    When the buffer is full, the terminal is not keeping up, and the policy
+    determines what happens:
+
+    * "block": the writer flushes the buffer itself, so it waits for the
+      terminal (backpressure).
+    * "skip": the pending output is collapsed into a "N lines skipped"
+      marker. The skipped text is written to a spill file.
+    """
+
+    def __init__(
+        self,
+        write_func,
+        max_size=2**20,
+        interval=1 / 30,
+        policy="block",
+        spill_filename=None,
+    ):
+        if policy not in ("block", "skip"):
+            raise ValueError(f"Invalid flood control policy: {policy!r}")
+        self._write_func = write_func
+        self._max_size = max_size
+        self._interval = interval
+        self._policy = policy
+        self._spill_filename = spill_filename
+        self._spill_file = None
+        self._skipped_lines = 0
+
+        self._buffer = bytearray()
+        self._spare_buffer = bytearray()  # the two buffers are swapped on flush
+        self._runs = []  # list of [write_func, end] for the data in the buffer
+        self._lock = threading.Lock()
+        self._has_data = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()  # keeps flushes in order
+        self._closed = False
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    @property
+    def spill_filename(self):
+        """The name of the file that skipped output is written to (or None)."""
+        return self._spill_filename if self._spill_file else None
+
+    def write(self, bb, write_func=None):
+        """Add the given bytes to the buffer. Returns the number of bytes."""
+        write_func = write_func or self._write_func
+        n = len(bb)
+        while True:
+            with self._lock:
+                buffer = self._buffer
+                if buffer and len(buffer) + n > self._max_size:
+                    if self._policy == "skip":
+                        self._spill(buffer)
+                        buffer.clear()
+                        self._runs.clear()
+                if not buffer or len(buffer) + n <= self._max_size:
+                    buffer += bb
+                    runs = self._runs
+                    if runs and runs[-1][0] == write_func:
+                        runs[-1][1] = len(buffer)
+                    else:
+                        runs.append([write_func, len(buffer)])
+                    self._has_data.notify()
+                    return n
+            # Backpressure: wait for the terminal, then try again
+            self.flush()
+
+    def flush(self):
+        """Write the pending output now (from the calling thread)."""
+        with self._flush_lock:
+            with self._lock:
+                data, runs = self._buffer, self._runs
+                self._buffer, self._runs = self._spare_buffer, []
+                skipped, self._skipped_lines = self._skipped_lines, 0
+                if skipped:
+                    self._spill_file.flush()
+            # The data buffer is ours now, until we make it the spare again
+            if skipped:
+                marker = f"\n[{skipped} lines skipped, see {self.spill_filename}]\n"
+                self._write_func(memoryview(marker.encode()))
+            if data:
+                with memoryview(data) as view:
+                    start = 0
+                    for write_func, end in runs:
+                        write_func(view[start:end])
+                        start = end
+            data.clear()
+            self._spare_buffer = data
+
+    def close(self):
+        """Flush the pending output and stop the background thread."""
+        with self._lock:
+            self._closed = True
+            self._has_data.notify()
+        self.flush()
+        if self._spill_file is not None:
+            self._spill_file.close()
+
+    def _spill(self, data):
+        # Called with the lock held
+        if self._spill_file is None:
+            if self._spill_filename is None:
+                fd, self._spill_filename = tempfile.mkstemp(
+                    prefix="pyterm-spill-", suffix=".txt"
+                )
+                os.close(fd)
+            self._spill_file = open(self._spill_filename, "ab")
+        self._spill_file.write(data)
+        self._skipped_lines += data.count(b"\n")
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while not self._buffer and not self._closed:
+                    self._has_data.wait()
+                if self._closed:
+                    return
+            # Wait a bit, so that more writes are collected in this chunk
+            time.sleep(self._interval)
+            self.flush()
+
+
+class OutputWriter(threading.Thread):
+    """A thread that writes the output of multiple streams to the terminal.
+
+    Each stream (e.g. stdout and stderr) has its own queue. Writing to a
+    stream only appends to its queue, so the writing thread never waits for
+    the terminal (or the prompt lock). This thread merges the queued writes
+    in the order in which they were made, and per batch it clears the prompt
+    once, writes the data, and redraws the prompt once.
+    """
+
+    def __init__(self, prompt):
+        super().__init__()
+        self.daemon = True
+        self._prompt = prompt
+        self._streams = []  # list of (file, deque)
+        self._counter = itertools.count()  # global sequence numbers
+        self._held = []  # items taken from the queues, for the next batch
+        self._wakeup = threading.Event()
+        self._write_lock = threading.Lock()  # keeps batches in order
+
+    def add_stream(self, file):
+        """Add a stream that writes to the given (binary) file. Returns its queue."""
+        queue = deque()
+        self._streams.append((file, queue))
+        return queue
+
+    def write(self, queue, bb):
+        """Queue the given bytes for the stream with the given queue."""
+        if type(bb) is not bytes:
+            bb = bytes(bb)  # the caller may reuse the buffer
+        # Getting the next number and appending are both atomic
+        queue.append((next(self._counter), bb))
+        self._wakeup.set()
+        return len(bb)
+
+    def flush(self):
+        """Write all queued output now (from the calling thread)."""
+        self._write_batch()
+
+    def run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self._write_batch()
+            except Exception as err:
+                logger.error(f"Error in output writer: {err}")
+
+    def _write_batch(self):
+        with self._write_lock:
+            t0 = time.perf_counter() if _trace.enabled else 0
+            # Writes made after this point are held back until the next batch.
+            # Otherwise, a write to one stream could be taken while an earlier
+            # write (from the same thread) to a stream that we already
+            # drained is not.
+            watermark = next(self._counter)
+            items, held = [], self._held
+            self._held = []
+            for file, queue in self._streams:
+                try:
+                    while True:
+                        seq, bb = queue.popleft()
+                        if seq < watermark:
+                            items.append((seq, file, bb))
+                        else:
+                            held.append((seq, file, bb))
+                except IndexError:
+                    pass
+            for item in held:
+                if item[0] < watermark:
+                    items.append(item)
+                else:
+                    self._held.append(item)
+            if not items:
+                return
+            # Restore the global order of the writes
+            items.sort(key=lambda item: item[0])
+
+            prompt = self._prompt
+            nbytes = 0
+            with prompt.lock:
+                prompt.clear()
+                i = 0
+                while i < len(items):
+                    # Join consecutive writes to the same file
+                    file = items[i][1]
+                    j = i + 1
+                    while j < len(items) and items[j][1] is file:
+                        j += 1
+                    if j == i + 1:
+                        data = items[i][2]
+                    else:
+                        data = b"".join(item[2] for item in items[i:j])
+                    file.write(data)
+                    if file is not prompt.file:
+                        file.flush()
+                    nbytes += len(data)
+                    i = j
+                prompt.write_prompt()
+            if _trace.enabled:
+                t1 = time.perf_counter()
+                _trace.event(
+                    "output.batch", nwrites=len(items), nbytes=nbytes, duration=t1 - t0
+                )
+
+
+def get_thread_name():
+    """Get the name of the current thread, or None for the main thread."""
+    thread = threading.current_thread()
+    return None if thread is threading.main_thread() else thread.name
+
+
+class _PendingLine:
+    """The incomplete line of a thread."""
+
+    __slots__ = ["data", "time", "name", "at_line_start"]
+
+    def __init__(self, name):
+        self.data = bytearray()
+        self.time = time.perf_counter()
+        self.name = name
+        self.at_line_start = True
+
+
+class _ThreadSentinel:
+    """Object that lives in a thread-local, to detect that a thread ended."""
+
+
+class ThreadLineBuffer:
+    """Buffers output per thread, so that partial lines of threads don't mix.
+
+    Output of a thread is held until it completes a line, and then all its
+    complete lines are passed to ``write_func(data)`` at once. Optionally,
+    lines of threads other than the main thread are prefixed with the
+    thread name. A partial line is written anyway when it gets larger than
+    max_size, when it is older than timeout seconds, and when its thread
+    ends. Only threads that have a partial line take up space, and the
+    number of these is bounded as well.
+    """
+
+    def __init__(
+        self, write_func, prefix=False, max_size=2**16, timeout=0.5, max_threads=256
+    ):
+        self._write_func = write_func
+        self._prefix = prefix
+        self._max_size = max_size
+        self._timeout = timeout
+        self._max_threads = max_threads
+        self._pending = {}  # thread ident -> _PendingLine
+        self._lock = threading.Lock()
+        self._has_data = threading.Condition(self._lock)
+        self._local = threading.local()
+        self._sweeper = None
+
+    def write(self, bb):
+        """Write the given bytes for the current thread."""
+        if not isinstance(bb, bytes):
+            bb = bytes(bb)
+        ident = threading.get_ident()
+        i = bb.rfind(b"\n")
+        to_write = []
+        with self._lock:
+            entry = self._pending.get(ident)
+            if i >= 0 and entry is None:
+                # Common case: whole lines
+                to_write.append((bb[: i + 1], get_thread_name(), True))
+                bb = bb[i + 1 :]
+            elif i >= 0:
+                entry.data += bb[: i + 1]
+                to_write.append(self._take(entry))
+                bb = bb[i + 1 :]
+            if bb:
+                if entry is None:
+                    entry = self._add_entry(ident, to_write)
+                if not entry.data:
+                    entry.time = time.perf_counter()
+                entry.data += bb
+                if len(entry.data) > self._max_size:
+                    to_write.append(self._take(entry))
+                else:
+                    self._has_data.notify()
+            elif entry is not None and entry.at_line_start:
+                del self._pending[ident]  # nothing pending anymore
+        for args in to_write:
+            self._write_lines(*args)
+
+    def flush(self):
+        """Write the partial line of the current thread.
+
+        The partial lines of other threads are left alone, so that e.g.
+        ``print(..., flush=True)`` in one thread does not break the lines
+        of other threads.
+        """
+        with self._lock:
+            entry = self._pending.get(threading.get_ident())
+            args = self._take(entry) if entry and entry.data else None
+        if args:
+            self._write_lines(*args)
+
+    def flush_all(self):
+        """Write the partial lines of all threads."""
+        with self._lock:
+            to_write = [self._take(e) for e in self._pending.values() if e.data]
+        for args in to_write:
+            self._write_lines(*args)
+
+    def _add_entry(self, ident, to_write):
+        # Called with the lock held
+        if not hasattr(self._local, "sentinel"):
+            self._local.sentinel = _ThreadSentinel()
+            weakref.finalize(self._local.sentinel, self._on_thread_end, ident)
+        while len(self._pending) >= self._max_threads:
+            oldest = self._pending.pop(next(iter(self._pending)))
+            if oldest.data:
+                to_write.append(self._take(oldest))
+        entry = self._pending[ident] = _PendingLine(get_thread_name())
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep_loop, daemon=True)
+            self._sweeper.start()
+        return entry
+
+    def _take(self, entry):
+        # Called with the lock held. Take the data of the entry, to write it.
+        data = bytes(entry.data)
+        entry.data.clear()
+        at_line_start = entry.at_line_start
+        entry.at_line_start = data.endswith(b"\n")
+        return data, entry.name, at_line_start
+
+    def _on_thread_end(self, ident):
+        with self._lock:
+            entry = self._pending.pop(ident, None)
+            args = self._take(entry) if entry and entry.data else None
+        if args:
+            self._write_lines(*args)
+
+    def _sweep_loop(self):
+        while True:
+            with self._lock:
+                while not any(e.data for e in self._pending.values()):
+                    self._has_data.wait()
+            time.sleep(self._timeout / 2)
+            deadline = time.perf_counter() - self._timeout
+            with self._lock:
+                to_write = [
+                    self._take(e)
+                    for e in self._pending.values()
+                    if e.data and e.time < deadline
+                ]
+            for args in to_write:
+                self._write_lines(*args)
+
+    def _write_lines(self, data, name, at_line_start):
+        if self._prefix and name:
+            prefix = f"[{name}] ".encode()
+            if data.endswith(b"\n"):
+                data = data[:-1].replace(b"\n", b"\n" + prefix) + b"\n"
+            else:
+                data = data.replace(b"\n", b"\n" + prefix)
+            if at_line_start:
+                data = prefix + data
+        self._write_func(data)
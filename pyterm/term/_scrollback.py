@@ -0,0 +1,140 @@
+import re
+import threading
+from array import array
+from bisect import bisect_right
+
+
+class Scrollback:
+    """A fixed-size ring buffer that keeps the last output.
+
+    The output is stored as bytes in a single bytearray, and the lines are
+    indexed by the (absolute) offsets at which they start, in a compact
+    array. When the buffer is full, the oldest lines are dropped. Writing
+    and searching can happen from different threads.
+    """
+
+    def __init__(self, max_bytes=16 * 2**20):
+        self._size = max_bytes
+        self._data = bytearray(max_bytes)
+        self._total = 0  # number of bytes ever written
+        self._starts = array("q", [0])  # absolute offsets of line starts
+        self._first = 0  # index in _starts of the oldest line
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            self._evict()
+            n = len(self._starts) - self._first
+            return n - 1 if self._starts[-1] == self._total else n
+
+    @property
+    def nbytes(self):
+        """The number of bytes in the buffer."""
+        return min(self._total, self._size)
+
+    def append(self, bb):
+        """Add output to the buffer."""
+        n = len(bb)
+        if not n:
+            return
+        with self._lock:
+            total = self._total
+            size = self._size
+            if n > size:
+                bb = bb[n - size :]
+                total += n - size
+                n = size
+            # Copy into the ring, in one or two parts
+            i = total % size
+            n1 = min(n, size - i)
+            self._data[i : i + n1] = bb[:n1]
+            if n1 < n:
+                self._data[: n - n1] = bb[n1:]
+            # Index the newlines
+            if not isinstance(bb, (bytes, bytearray)):
+                bb = bytes(bb)
+            starts = self._starts
+            find = bb.find
+            j = find(b"\n")
+            while j >= 0:
+                starts.append(total + j + 1)
+                j = find(b"\n", j + 1)
+            self._total = total + n
+            self._evict()
+
+    def get_lines(self):
+        """Get a list of all lines in the buffer (as bytes, without newline)."""
+        with self._lock:
+            data, base, starts = self._snapshot()
+        ends = starts[1:]
+        ends.append(base + len(data) + 1)
+        lines = [data[s - base : e - base - 1] for s, e in zip(starts, ends)]
+        if not lines[-1]:
+            lines.pop()  # the current line is empty
+        return lines
+
+    def search(self, pattern, regex=False, ignore_case=False):
+        """Get a generator that yields (line_number, line) for lines that match.
+
+        The pattern is a str or bytes, which is searched as a substring, or
+        as a regular expression if regex is True. The lines are bytes. The
+        line number is relative to the oldest line in the buffer. Searching
+        uses a snapshot, so output can continue to be added meanwhile.
+        """
+        if isinstance(pattern, str):
+            pattern = pattern.encode()
+        if not regex:
+            pattern = re.escape(pattern)
+        flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        compiled = re.compile(pattern, flags)
+
+        with self._lock:
+            data, base, starts = self._snapshot()
+        return self._iter_hits(compiled, data, base, starts)
+
+    def _iter_hits(self, compiled, data, base, starts):
+        pos = 0
+        while True:
+            m = compiled.search(data, pos)
+            if m is None:
+                return
+            # Find the line, yield it, and continue at the next line
+            index = bisect_right(starts, base + m.start()) - 1
+            start = starts[index] - base
+            end = data.find(b"\n", start)
+            end = len(data) if end < 0 else end
+            yield index, data[start:end]
+            pos = end + 1
+            if pos > len(data):
+                return
+
+    def _evict(self):
+        # Called with the lock held. Drop lines that are (partly) overwritten.
+        oldest = self._total - self._size
+        starts = self._starts
+        first = self._first
+        while first < len(starts) - 1 and starts[first] < oldest:
+            first += 1
+        if first > 1024 and first > len(starts) // 2:
+            del starts[:first]
+            first = 0
+        self._first = first
+
+    def _snapshot(self):
+        # Called with the lock held, so it only copies. Returns the data as
+        # one bytes object (starting at the oldest line), its absolute offset,
+        # and the line starts (an array, which works with bisect).
+        self._evict()
+        starts = self._starts[self._first :]
+        base = max(starts[0], self._total - self._size)
+        starts[0] = base
+        size = self._size
+        i = base % size
+        n = self._total - base
+        view = memoryview(self._data)
+        if i + n <= size:
+            data = view[i : i + n].tobytes()
+        else:
+            data = b"".join([view[i:], view[: i + n - size]])
+        view.release()
+        return data, base, starts
@@ -0,0 +1,211 @@
+import os
+import gzip
+import time
+import logging
+import threading
+from collections import deque
+
+
+logger = logging.getLogger("pyterm")
+
+
+def open_compressed(filename, compression):
+    """Open a file for appending, with "zstd", "gzip", or no compression.
+
+    Existing content is kept: the new data is written as a new gzip member
+    or zstd frame, and such files can be decompressed as a whole.
+
+    Returns the file to write to, and the underlying (raw) file.
+    """
+    raw_file = open(filename, "ab")
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().stream_writer(raw_file), raw_file
+    elif compression == "gzip":
+        return gzip.GzipFile(fileobj=raw_file, mode="ab"), raw_file
+    elif not compression:
+        return raw_file, raw_file
+    else:
+        raw_file.close()
+        raise ValueError(f"Invalid compression: {compression!r}")
+
+
+def get_default_compression():
+    """Get "zstd" if the zstandard library is available, and "gzip" otherwise."""
+    try:
+        import zstandard  # noqa
+    except ImportError:
+        return "gzip"
+    return "zstd"
+
+
+class SessionLog(threading.Thread):
+    """Thread that writes a transcript of the session to a (compressed) file.
+
+    Writing to the log only appends the data to a queue, so it never waits
+    for disk I/O. The thread writes the queued data in batches. When the
+    queue is full (e.g. because the disk is slow), records are dropped, and
+    this is noted in the log. An existing log is appended to, so that the
+    transcripts of earlier sessions are kept. When the file exceeds max_bytes,
+    it is rotated like logging.handlers.RotatingFileHandler does, keeping
+    backup_count older files.
+
+    If compression is "auto", zstd is used if available, and gzip otherwise.
+    The suffix for the compression is added to the filename if needed.
+    """
+
+    suffixes = {"zstd": ".zst", "gzip": ".gz"}
+
+    def __init__(
+        self,
+        filename,
+        compression="auto",
+        max_bytes=64 * 2**20,
+        backup_count=5,
+        max_pending=8 * 2**20,
+        interval=0.1,
+        flush_interval=1.0,
+    ):
+        super().__init__()
+        self.daemon = True
+        if compression == "auto":
+            compression = get_default_compression()
+        suffix = self.suffixes.get(compression, "")
+        if not filename.endswith(suffix):
+            filename += suffix
+        self._filename = filename
+        self._compression = compression
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._max_pending = max_pending
+        self._interval = interval
+        self._flush_interval = flush_interval
+        self._queue = deque()
+        self._pending = 0  # number of bytes in the queue
+        self._lock = threading.Lock()  # never held during I/O
+        self._stop_event = threading.Event()
+        self._file = None
+        self._raw_file = None
+        self.dropped = 0  # total number of dropped records
+        self._dropped_unreported = 0
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def write(self, bb):
+        """Add output (bytes) to the log. Never blocks on I/O."""
+        n = len(bb)
+        with self._lock:
+            if self._pending + n > self._max_pending:
+                self.dropped += 1
+                self._dropped_unreported += 1
+                return
+            self._queue.append(bytes(bb))
+            self._pending += n
+
+    def stop(self, timeout=1):
+        """Stop the thread, after writing the remaining records."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        try:
+            if os.path.isfile(self._filename):
+                if os.path.getsize(self._filename) >= self._max_bytes:
+                    self._rotate()
+            self._open()
+        except Exception as err:
+            logger.error(f"Cannot open session log {self._filename}: {err}")
+            return
+        last_flush = time.perf_counter()
+        while not self._stop_event.wait(self._interval):
+            self._write_queued()
+            if time.perf_counter() - last_flush > self._flush_interval:
+                last_flush = time.perf_counter()
+                self._call_file("flush")
+        self._write_queued()
+        self._close()
+
+    def _write_queued(self):
+        with self._lock:
+            records = self._queue
+            dropped = self._dropped_unreported
+            self._queue = deque()
+            self._pending = 0
+            self._dropped_unreported = 0
+        if dropped:
+            records.append(f"\n[session log: dropped {dropped} records]\n".encode())
+        if not records:
+            return
+        if not self._call_file("write", b"".join(records)):
+            with self._lock:
+                self.dropped += len(records)
+            return
+        if self._raw_file.tell() >= self._max_bytes:
+            self._close()
+            try:
+                self._rotate()
+                self._open()
+            except Exception as err:
+                logger.error(f"Cannot rotate session log {self._filename}: {err}")
+                self._file = None
+
+    def _call_file(self, method, *args):
+        if self._file is None:
+            return False
+        try:
+            getattr(self._file, method)(*args)
+        except Exception as err:
+            logger.warning(f"Session log {method} failed: {err}")
+            return False
+        return True
+
+    def _close(self):
+        self._call_file("close")
+        try:
+            self._raw_file.close()  # gzip does not close it
+        except Exception:
+            pass
+
+    def _open(self):
+        self._file, self._raw_file = open_compressed(
+            self._filename, self._compression
+        )
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        self._file.write(f"[session log: opened at {stamp}]\n".encode())
+
+    def _rotate(self):
+        if self._backup_count <= 0:
+            os.remove(self._filename)
+            return
+        for i in range(self._backup_count - 1, 0, -1):
+            src = f"{self._filename}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self._filename}.{i + 1}")
+        os.replace(self._filename, f"{self._filename}.1")
+
+
+class SessionLogTee:
+    """A thin wrapper for a text stream, that also writes the text to a
+    session log. Used when output is not written via a ProxyStdout.
+    """
+
+    def __init__(self, stream, session_log):
+        self._stream = stream
+        self._session_log = session_log
+        self._encoding = getattr(stream, "encoding", None) or "utf-8"
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def write(self, s):
+        n = self._stream.write(s)
+        self._session_log.write(s.encode(self._encoding, "replace"))
+        return n
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
@@ -1,27 +1,152 @@
+import time
+import errno
 import socket
+import struct
 import logging
+import threading
+from collections import deque
 
 logger = logging.getLogger("pyterm")
 logger.setLevel(logging.INFO)
 
 PORT = 12013
 
+# Log records are sent in batches. Each datagram starts with a magic
+# header, followed by a sequence of frames. Each frame is a small header
+# (time created, level, message size) followed by the utf-8 message.
+# The datagram size stays below the default limit on macOS (9216 bytes).
+DATAGRAM_MAGIC = b"PTL1"
+FRAME_HEADER = struct.Struct("<dBI")
+MAX_DATAGRAM_SIZE = 8192
+MIN_DATAGRAM_SIZE = 512
+
+
+def pack_records(records, max_size=MAX_DATAGRAM_SIZE):
+    """Pack (created, levelno, message) tuples into datagrams.
+
+    Returns a list of bytes objects. Messages that do not fit in a single
+    datagram are truncated.
+    """
+    datagrams = []
+    parts = [DATAGRAM_MAGIC]
+    size = len(DATAGRAM_MAGIC)
+    max_msg_size = max_size - len(DATAGRAM_MAGIC) - FRAME_HEADER.size
+    for created, levelno, msg in records:
+        bb = msg.encode(errors="replace")[:max_msg_size]
+        frame_size = FRAME_HEADER.size + len(bb)
+        if size + frame_size > max_size:
+            datagrams.append(b"".join(parts))
+            parts = [DATAGRAM_MAGIC]
+            size = len(DATAGRAM_MAGIC)
+        parts.append(FRAME_HEADER.pack(created, levelno, len(bb)))
+        parts.append(bb)
+        size += frame_size
+    if len(parts) > 1:
+        datagrams.append(b"".join(parts))
+    return datagrams
+
+
+def unpack_datagram(data):
+    """Unpack a datagram into a list of (created, levelno, message) tuples."""
+    if not data.startswith(DATAGRAM_MAGIC):
+        return [(time.time(), logging.INFO, data.decode(errors="replace"))]
+    records = []
+    i = len(DATAGRAM_MAGIC)
+    while i + FRAME_HEADER.size <= len(data):
+        created, levelno, n = FRAME_HEADER.unpack_from(data, i)
+        i += FRAME_HEADER.size
+        records.append((created, levelno, data[i : i + n].decode(errors="replace")))
+        i += n
+    return records
+
+
+class UDPSender(threading.Thread):
+    """Thread that sends the queued log records in batches over UDP.
+
+    If the system does not accept datagrams of the current size, the records
+    are sent in smaller datagrams from then on. Datagrams that cannot be sent
+    are counted in ``dropped``.
+    """
+
+    def __init__(self, queue, address, interval=0.05):
+        super().__init__()
+        self.daemon = True
+        self._queue = queue
+        self._address = address
+        self._interval = interval
+        self._max_size = MAX_DATAGRAM_SIZE
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._stop_event = threading.Event()
+        self.dropped = 0  # number of datagrams that could not be sent
+
+    def stop(self, timeout=1):
+        """Stop the thread, after sending the remaining records."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        # We poll the queue, so that adding records needs no synchronization.
+        while not self._stop_event.wait(self._interval):
+            self._send_queued()
+        self._send_queued()
+        self._socket.close()
+
+    def _send_queued(self):
+        queue = self._queue
+        records = []
+        try:
+            while True:
+                records.append(queue.popleft())
+        except IndexError:
+            pass
+        for datagram in pack_records(records, self._max_size):
+            self._send(datagram)
+
+    def _send(self, datagram):
+        try:
+            self._socket.sendto(datagram, self._address)
+        except OSError as err:
+            if err.errno == errno.EMSGSIZE and len(datagram) > MIN_DATAGRAM_SIZE:
+                # Too large for this system, split it up
+                self._max_size = max(len(datagram) // 2, MIN_DATAGRAM_SIZE)
+                records = unpack_datagram(datagram)
+                for part in pack_records(records, self._max_size):
+                    self._send(part)
+            else:
+                self.dropped += 1  # Nobody listening, or the network is down
+
 
 class UDPHandler(logging.Handler):
+    """Logging handler that ships records to ``pyterm --listen``.
+
+    Records are formatted and put in a bounded queue, which does not block.
+    A background thread sends them in batches. If the queue is full, the
+    oldest records are dropped.
+    """
+
     udp_address = ("127.0.0.1", PORT)
 
-    def __init__(self):
+    def __init__(self, maxlen=10_000):
         super().__init__()
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._queue = deque(maxlen=maxlen)
+        self._sender = None
 
     def emit(self, record):
-        msg = self.format(record)
-        bb = msg.encode()
-        size = 2**10
-        while bb:
-            bb1 = bb[:size]
-            bb = bb[size:]
-            self._socket.sendto(bb1, self.udp_address)
+        # Handler.handle() holds the handler lock, so starting the thread is safe
+        try:
+            self._queue.append((record.created, record.levelno, self.format(record)))
+        except Exception:
+            self.handleError(record)
+        if self._sender is None:
+            self._sender = UDPSender(self._queue, self.udp_address)
+            self._sender.start()
+
+    def close(self):
+        if self._sender is not None:
+            self._sender.stop()
+            self._sender = None
+        super().close()
 
 
 logger.addHandler(UDPHandler())
@@ -39,5 +164,6 @@ def listen_to_logs():
     sock.bind(("127.0.0.1", PORT))
 
     while True:
-        data, addr = sock.recvfrom(2**20)
-        print(data.decode())
+        data, addr = sock.recvfrom(2**16)
+        for _, _, msg in unpack_datagram(data):
+            print(msg)
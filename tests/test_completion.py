@@ -0,0 +1,504 @@
+import gc
+import io
+import os
+import sys
+import time
+import threading
+
+from pyterm.prompt import Prompt, AutocompHelper
+from pyterm.completion import (
+    MORE,
+    CompletionWorker,
+    DirectoryCache,
+    DirectoryListing,
+    FuzzyIndex,
+    KeyCache,
+    LazyList,
+    ModuleIndex,
+    SignatureCache,
+    get_call_name,
+    get_context,
+    split_name_at_end,
+)
+from pyterm.completion._completer import get_completions
+
+
+def make_file():
+    return io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+
+
+def wait_for(condition, timeout=2):
+    etime = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < etime, "timeout"
+        time.sleep(0.001)
+
+
+def test_split_name_at_end():
+    assert split_name_at_end("") == ("", "")
+    assert split_name_at_end("fo") == ("", "fo")
+    assert split_name_at_end("x = foo.bar.sp") == ("foo.bar", "sp")
+    assert split_name_at_end("foo.") == ("foo", "")
+    assert split_name_at_end("print(foo.b") == ("foo", "b")
+    assert split_name_at_end("3.1") is None
+    assert split_name_at_end("'foo.b") is None
+
+
+def test_get_completions():
+    class Foo:
+        spam = 1
+        spam_and_eggs = 2
+        _private = 3
+
+    namespace = {"foo": Foo(), "foobar": 42}
+
+    def complete(text):
+        (kind, base), prefix, index = get_completions(namespace, text)
+        assert kind == "name"
+        return base, prefix, index.match(prefix)
+
+    assert complete("foo")[2][:2] == ["foo", "foobar"]
+    assert "for" in complete("fo")[2]  # keyword
+    assert "float" in complete("f")[2]  # builtin
+    assert complete("foo.sp") == ("foo", "sp", ["spam", "spam_and_eggs"])
+    assert complete("foo.sae") == ("foo", "sae", ["spam_and_eggs"])
+    assert complete("foo._pr")[2] == ["_private", "__repr__"]
+    assert complete("nope.x") == ("nope", "x", [])
+    assert get_completions(namespace, "'foo'")[0] is None
+
+
+def test_fuzzy_index():
+    names = ["spam", "spam_and_eggs", "eggs", "_private", "aspmx", "Spanish", "zz"]
+    index = FuzzyIndex(names)
+    assert len(index) == len(names)
+
+    # Tiers: prefix, substring, subsequence
+    assert index.match("sp") == ["spam", "spam_and_eggs", "Spanish", "aspmx"]
+    assert index.match("spm") == ["aspmx", "spam", "spam_and_eggs"]
+    assert index.match("spm", k=1) == ["aspmx"]
+    assert index.match("eg") == ["eggs", "spam_and_eggs"]
+    assert index.match("x") == ["aspmx"]
+    assert index.match("z") == ["zz"]
+    assert index.match("zz") == ["zz"]
+    assert index.match("zzz") == []
+
+    # Private names only when asked for
+    assert "_private" not in index.match("")
+    assert index.match("_p") == ["_private"]
+
+    # Refining while typing gives the same result as a fresh match
+    for query in ["s", "sp", "spa", "spam", "spam_", "spam_e", "s", "se", "seg"]:
+        assert index.match(query) == FuzzyIndex(names).match(query)
+
+
+def test_fuzzy_index_keeps_partial_scan():
+    names = [f"a{i:04}b{i % 7}" for i in range(5000)]
+    index = FuzzyIndex(names)
+
+    # A search that stops early keeps the candidates scanned so far
+    assert len(index.match("ab", k=10)) == 10
+    query, bits, verified, end, containing = index._last
+    assert query == "ab" and 0 < end < len(names)
+    assert containing == []  # no names contain "ab"
+    assert len(verified) == 10
+
+    # Refining uses that, and gives the same result as a fresh match
+    for query in ["ab3", "ab", "a1b", "a12b3"]:
+        for k in (1, 10, 10_000):
+            assert index.match(query, k=k) == FuzzyIndex(names).match(query, k=k)
+
+
+def test_completion_worker_drops_stale_results():
+    results = []
+    release = threading.Event()
+
+    def slow_job(x):
+        release.wait()
+        return x
+
+    worker = CompletionWorker(lambda generation, result: results.append(result))
+    worker.start()
+
+    worker.submit(slow_job, "first")
+    time.sleep(0.05)  # first job is now running
+    worker.submit(slow_job, "second")
+    worker.submit(slow_job, "third")  # replaces second before it starts
+    release.set()
+
+    wait_for(lambda: results)
+    time.sleep(0.05)
+    assert results == ["third"]
+
+    worker.cancel()
+    assert worker.is_current(worker.generation)
+
+
+def test_prompt_completion_is_async():
+    class Slow:
+        @property
+        def __dict__(self):
+            time.sleep(0.3)
+            return {"alpha": 1, "beta": 2}
+
+    prompt = Prompt(make_file(), {"slow": Slow()})
+
+    for c in "slow.":
+        prompt.on_key(c)
+
+    t0 = time.perf_counter()
+    prompt.on_key("tab")
+    assert time.perf_counter() - t0 < 0.1  # tab does not block
+
+    wait_for(lambda: prompt._autocomp.active)
+    assert "alpha" in prompt._autocomp._list
+
+    prompt.on_key("tab")
+    assert prompt._in1 == "slow.alpha"
+    assert not prompt._autocomp.active
+
+
+def test_prompt_completion_stale_on_input_change():
+    prompt = Prompt(make_file(), {"foo": 1, "bar": 2})
+    prompt.on_key("f")
+    prompt.on_key("tab")
+    prompt.on_key("o")
+    wait_for(lambda: prompt._autocomp.active)
+    assert "foo" in prompt._autocomp._list
+    assert prompt._autocomp.prefix == "fo"  # result for "f" was dropped
+
+    # Typing refines the candidates without a new request
+    generation = prompt._completer._worker.generation
+    prompt.on_key("o")
+    assert prompt._autocomp._list[0] == "foo"
+    prompt.on_key("b")
+    assert not prompt._autocomp.active
+    prompt.on_key("backspace")
+    assert prompt._autocomp._list[0] == "foo"
+    assert prompt._completer._worker.generation > generation  # cancelled only
+    assert not prompt._completer._worker._pending
+    prompt.on_key("escape")
+    assert not prompt._autocomp.active
+
+
+def test_lazy_list():
+    # Sequences are used as-is
+    source = [1, 2, 3]
+    ll = LazyList(source)
+    assert ll.exhausted and len(ll) == 3 and ll._items is source
+
+    # Iterables are consumed on demand
+    ll = LazyList(iter(range(10)))
+    assert not ll.exhausted and len(ll) == 0
+    assert ll[4] == 4
+    assert len(ll) == 5
+    assert ll.fetch(7) == 7
+    assert list(ll) == list(range(10))
+    assert ll.exhausted and len(ll) == 10
+
+
+def test_autocomp_helper_is_lazy():
+    pulled = []
+
+    def candidates():
+        for i in range(1_000_000):
+            pulled.append(i)
+            yield Entry(i)
+
+    class Entry:
+        def __init__(self, i):
+            self.i = i
+
+        def __str__(self):
+            stringified.append(self.i)
+            return f"entry{self.i}"
+
+    stringified = []
+    ah = AutocompHelper()
+    ah.show(candidates())
+    lines = ah.get_lines()
+    assert len(lines) == 7
+    assert "entry0" in lines[0] and "entry6" in lines[6]
+    assert len(pulled) < 10
+    assert sorted(stringified) == list(range(7))
+
+    # Scrolling pages in more
+    for _ in range(20):
+        ah.down()
+    lines = ah.get_lines()
+    assert "entry20" in "".join(lines)
+    assert len(pulled) < 40
+
+    # Up from the top does not wrap to the (unknown) end
+    ah = AutocompHelper()
+    ah.show(candidates())
+    ah.up()
+    assert ah.get_selected() == "entry0"
+
+
+def test_get_context():
+    assert get_context("foo.ba") == (("name", "foo"), "ba")
+    assert get_context("import nu") == (("module", ""), "nu")
+    assert get_context("import os, nu") == (("module", ""), "nu")
+    assert get_context("import numpy.li") == (("module", "numpy"), "li")
+    assert get_context("from nu") == (("module", ""), "nu")
+    assert get_context("x = 3; from numpy import li") == (("module", "numpy"), "li")
+    assert get_context("from numpy import fft, li") == (("module", "numpy"), "li")
+    assert get_context("'foo'") is None
+
+    # Inside strings we complete paths
+    assert get_context("'foo") == (("path", ""), "foo")
+    assert get_context("open('data/sub/fi") == (("path", "data/sub/"), "fi")
+    assert get_context('x = """~/') == (("path", "~/"), "")
+    assert get_context("'a\\\\b") == (("path", ""), "a\\b")  # unescaped
+    assert get_context("r'a\\\\b") == (("path", ""), "a\\\\b")  # raw
+
+    # Subscripts complete keys
+    assert get_context("d[") == (("key", "d"), "")
+    assert get_context("x = foo.d['ba") == (("key", "foo.d"), "'ba")
+    assert get_context('d["ba') == (("key", "d"), "'ba")
+    assert get_context("d[1") == (("key", "d"), "1")
+    assert get_context("d['a'") is None
+    assert get_context("d[x") == (("name", ""), "x")
+
+
+def test_module_index(tmp_path, monkeypatch):
+    site = tmp_path / "site"
+    (site / "apkg" / "sub").mkdir(parents=True)
+    (site / "apkg" / "__init__.py").write_text("")
+    (site / "apkg" / "sub" / "__init__.py").write_text("")
+    (site / "apkg" / "amod.py").write_text("")
+    (site / "toplevel_mod.py").write_text("")
+    monkeypatch.setattr(sys, "path", [str(site)])
+
+    cache_file = str(tmp_path / "cache" / "modules.json")
+    index = ModuleIndex(cache_file)
+
+    # The first request does not block; the scan happens in the background
+    names = index.get_toplevel_names()
+    assert "toplevel_mod" not in names
+    assert "sys" in names  # builtin
+    index._refresh_thread.join()
+    names = index.get_toplevel_names()
+    assert {"apkg", "toplevel_mod"}.issubset(names)
+
+    # Submodules
+    assert index.get_submodule_names("apkg") == {"amod", "sub"}
+    assert index.get_submodule_names("nope") == set()
+    assert index.get_submodule_names(".") == set()
+    assert index.get_submodule_names(".apkg") == set()
+
+    # Rescan when the directory changes
+    (site / "new_mod.py").write_text("")
+    os.utime(site, (time.time() + 10, time.time() + 10))
+    index.refresh().join()
+    assert "new_mod" in index.get_toplevel_names()
+
+    # The cache is used by a new index, without scanning
+    index2 = ModuleIndex(cache_file)
+    monkeypatch.setattr("pyterm.completion._modules.scan_directory", lambda path: 1 / 0)
+    index2.refresh().join()
+    assert "new_mod" in index2.get_toplevel_names()
+    assert index2.get_submodule_names("apkg") == {"amod", "sub"}
+
+    # The cache is loaded on the first request, also if no refresh is due
+    index3 = ModuleIndex(cache_file, min_refresh_interval=1e9)
+    assert "new_mod" in index3.get_toplevel_names()
+
+    # Completions
+    _, prefix, names = get_completions({}, "from apkg import a", index2)
+    assert names.match(prefix) == ["amod"]
+
+
+def test_get_call_name():
+    assert get_call_name("foo(") == "foo"
+    assert get_call_name("x = foo.bar(1, spam(2), ") == "foo.bar"
+    assert get_call_name("foo(spam(") == "spam"
+    assert get_call_name("foo([1, 2") == "foo"
+    assert get_call_name("foo(')', ") == "foo"
+    assert get_call_name("foo(1)") is None
+    assert get_call_name("(1 + ") is None
+    assert get_call_name("foo") is None
+
+
+def test_signature_cache():
+    def spam(a, b=2):
+        """Make spam.
+
+        More details.
+        """
+
+    class Foo:
+        def eggs(self, x):
+            pass
+
+    cache = SignatureCache()
+    info = cache.get_info(spam)
+    assert info.signature == "spam(a, b=2)"
+    assert info.summary == "Make spam."
+    assert cache.get_info(spam) is info
+    lines = info.get_lines(80)
+    assert info.get_lines(80) is lines
+    assert "spam(a, b=2)" in lines[0] and "Make spam." in lines[1]
+    assert "…" in info.get_lines(8)[0]
+
+    # Bound methods are keyed by their function
+    foo = Foo()
+    info = cache.get_info(foo.eggs)
+    assert info.signature == "eggs(x)"
+    assert cache.get_info(foo.eggs) is info
+
+    # Builtins that cannot be weakly referenced
+    info = cache.get_info(len)
+    assert info.signature.startswith("len(")
+    assert cache.get_info(len) is info
+
+    # The cache does not keep functions alive
+    n = len(cache._weak)
+    del spam
+    gc.collect()
+    assert len(cache._weak) == n - 1
+
+
+def test_prompt_shows_call_tip():
+    def spam(a, b=2):
+        pass
+
+    prompt = Prompt(make_file(), {"spam": spam})
+    for c in "spam(1, ":
+        prompt.on_key(c)
+    wait_for(lambda: prompt._tip.active)
+    assert "spam(a, b=2)" in prompt._tip.get_lines()[0]
+
+    # Moving within the call does not make a new request
+    generation = prompt._tipper._worker.generation
+    prompt.on_key("left")
+    prompt.on_key("right")
+    prompt.on_key("3")
+    assert prompt._tipper._worker.generation == generation
+
+    prompt.on_key(")")
+    assert not prompt._tip.active
+
+
+def test_directory_listing(tmp_path):
+    for i in range(50):
+        (tmp_path / f"file{i:02}.txt").write_text("")
+    (tmp_path / "subdir").mkdir()
+
+    cache = DirectoryCache(max_dirs=2)
+    listing = cache.get_listing(str(tmp_path))
+    assert listing.complete
+    assert listing.names[0] == "file00.txt"  # small listings are sorted
+    assert "subdir/" in listing.names
+    assert cache.get_listing(str(tmp_path)) is listing
+    assert list(listing.iter_matches("su")) == ["subdir/"]
+    assert len(list(listing.iter_matches("file"))) == 50
+    assert cache.get_listing(str(tmp_path / "nope")) is None
+
+    # A change to the directory invalidates the listing
+    (tmp_path / "new.txt").write_text("")
+    os.utime(tmp_path, (time.time() + 10, time.time() + 10))
+    listing2 = cache.get_listing(str(tmp_path))
+    assert listing2 is not listing
+    assert "new.txt" in listing2.names
+
+    # The cache is bounded
+    cache.get_listing(str(tmp_path / "subdir"))
+    cache.get_listing(os.path.dirname(str(tmp_path)))
+    assert len(cache._listings) == 2
+    assert listing2.complete  # closed
+
+
+def test_directory_listing_is_incremental_and_capped(tmp_path):
+    for i in range(300):
+        (tmp_path / f"f{i}").write_text("")
+
+    listing = DirectoryListing(str(tmp_path), 0, max_entries=200)
+    assert listing.names == []
+    matches = listing.iter_matches("f")
+    assert next(matches).startswith("f")
+    assert len(listing.names) < 200  # only read what was needed
+
+    matches = list(listing.iter_matches(""))
+    assert len(matches) == 201
+    assert matches[-1] is MORE
+    assert len(listing.names) < 300
+
+    ah = AutocompHelper()
+    ah.show(listing, "")
+    ah.up()
+    assert ah.get_selected().startswith("f")
+
+    # With a prefix, the names beyond max_entries are found too
+    listing = DirectoryListing(str(tmp_path), 0, max_entries=200)
+    expected = sorted(f"f{i}" for i in range(300) if str(i).startswith("2"))
+    assert sorted(listing.iter_matches("f2")) == expected
+    assert len(listing.names) == 300
+
+
+def test_prompt_path_completion(tmp_path, monkeypatch):
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "values.csv").write_text("")
+    (tmp_path / "data" / "other.csv").write_text("")
+    monkeypatch.chdir(tmp_path)
+
+    prompt = Prompt(make_file(), {})
+    for c in "open('da":
+        prompt.on_key(c)
+    prompt.on_key("tab")
+    wait_for(lambda: prompt._autocomp.active)
+    prompt.on_key("tab")
+    assert prompt._in1 == "open('data/"
+
+    prompt.on_key("tab")
+    wait_for(lambda: prompt._autocomp.active)
+    prompt.on_key("v")  # refined in the worker
+    wait_for(lambda: list(prompt._autocomp._list) == ["values.csv"])
+    assert prompt._autocomp.prefix == "v"
+    prompt.on_key("enter")  # no explicit selection, so this submits
+    assert not prompt._autocomp.active
+
+
+def test_key_cache():
+    class Frame:
+        # Looks like a pandas DataFrame
+        dtypes = None
+
+        def __init__(self, columns):
+            self.columns = columns
+
+    cache = KeyCache(time_budget=10, max_keys=1000)
+    d = {"alpha": 1, "beta": 2, 3: 3, object(): 4}
+    index = cache.get_index(d)
+    assert sorted(index.match("")) == ["'alpha'", "'beta'", "3"]
+    assert cache.get_index(d) is index  # cached
+    d["gamma"] = 5
+    index = cache.get_index(d)
+    assert "'gamma'" in index.match("'g")  # version stamp changed
+
+    assert cache.get_index(Frame(["x", "y"])).match("") == ["'x'", "'y'"]
+    assert cache.get_index(3) is None
+
+    # Large mappings are sampled
+    big = {f"key{i}": i for i in range(5000)}
+    assert len(cache.get_index(big).match("", k=None)) == 1000
+    cache = KeyCache(time_budget=0)
+    assert len(cache.get_index(big).match("", k=None)) < 5000
+
+
+def test_prompt_key_completion():
+    ns = {"d": {"alpha": 1, "beta": 2}}
+    context, prefix, index = get_completions(ns, "d['al")
+    assert context == ("key", "d")
+    assert index.match(prefix) == ["'alpha'"]
+
+    prompt = Prompt(make_file(), ns)
+    for c in "d[":
+        prompt.on_key(c)
+    prompt.on_key("tab")
+    wait_for(lambda: prompt._autocomp.active)
+    prompt.on_key('"')
+    prompt.on_key("b")
+    assert list(prompt._autocomp._list) == ["'beta'"]
+    prompt.on_key("tab")
+    assert prompt._in1 == "d['beta'"
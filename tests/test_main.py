@@ -0,0 +1,98 @@
+import io
+import sys
+import threading
+from functools import partial
+
+import pyterm._main
+from pyterm.loops import RawLoop
+from pyterm.term import OutputBuffer, OutputWriter, SessionLog
+
+
+def run_passthrough(monkeypatch):
+    class FakeStdin:
+        buffer = io.BytesIO(b"print('hi')\n")
+
+        def close(self):
+            pass
+
+    def fail(*args, **kwargs):
+        raise AssertionError("should not be used when stdout is not a tty")
+
+    loops = []
+    stdins = []
+    ProxyStdin = pyterm._main.ProxyStdin
+
+    def create_loop():
+        loops.append(RawLoop())
+        return loops[-1]
+
+    def create_stdin(*args):
+        stdins.append(ProxyStdin(*args))
+        return stdins[-1]
+
+    monkeypatch.setattr(sys, "stdout", io.StringIO())
+    monkeypatch.setattr(sys, "stdin", sys.stdin)
+    monkeypatch.setattr(sys, "__stdin__", FakeStdin())
+    monkeypatch.setattr(pyterm._main, "create_loop", create_loop)
+    for name in ("TerminalContext", "Prompt", "ProxyStdout"):
+        monkeypatch.setattr(pyterm._main, name, fail)
+    monkeypatch.setattr(pyterm._main, "ProxyStdin", create_stdin)
+
+    # At the end of stdin, main() returns
+    t = threading.Thread(target=pyterm._main.main, daemon=True)
+    t.start()
+    t.join(5)
+    assert not t.is_alive()
+    assert len(loops) == 1 and not loops[0].is_running()
+    assert sys.stdin is sys.__stdin__
+    return stdins[0]
+
+
+def test_main_passthrough(monkeypatch):
+    monkeypatch.delenv("PYTERM_SESSION_LOG", raising=False)
+    stdin = run_passthrough(monkeypatch)
+
+    # The lines of stdin were available to the code
+    assert stdin.readline() == "print('hi')\n"
+    assert stdin.readline() == ""
+    stdin.close()
+
+
+def test_main_passthrough_session_log(monkeypatch, tmp_path):
+    filename = str(tmp_path / "session.log")
+    monkeypatch.setenv("PYTERM_SESSION_LOG", filename)
+    monkeypatch.setattr(pyterm._main, "SessionLog", partial(SessionLog, compression=None))
+    run_passthrough(monkeypatch).close()
+    assert isinstance(sys.stdout, io.StringIO)  # the original is restored
+
+    # The input lines were written to the log
+    with open(filename, "rb") as f:
+        assert f.read().splitlines()[1:] == [b"pyterm> print('hi')"]
+
+
+def test_output_options(monkeypatch):
+    prompt = object()
+    monkeypatch.delenv("PYTERM_FLOOD_CONTROL", raising=False)
+    monkeypatch.delenv("PYTERM_OUTPUT_WRITER", raising=False)
+    monkeypatch.delenv("PYTERM_THREAD_LINES", raising=False)
+    assert pyterm._main.get_output_options(prompt) == {}
+
+    monkeypatch.setenv("PYTERM_FLOOD_CONTROL", "skip")
+    options = pyterm._main.get_output_options(prompt)
+    assert isinstance(options["flood_control"], OutputBuffer)
+    assert options["flood_control"]._policy == "skip"
+
+    monkeypatch.setenv("PYTERM_FLOOD_CONTROL", "nope")
+    assert pyterm._main.get_output_options(prompt) == {}
+
+    # The writer takes precedence
+    monkeypatch.setenv("PYTERM_OUTPUT_WRITER", "1")
+    options = pyterm._main.get_output_options(prompt)
+    assert list(options) == ["writer"]
+    assert isinstance(options["writer"], OutputWriter)
+    assert options["writer"].is_alive()
+
+    monkeypatch.setenv("PYTERM_THREAD_LINES", "prefix")
+    assert pyterm._main.get_output_options(prompt)["thread_lines"] == "prefix"
+    monkeypatch.setenv("PYTERM_THREAD_LINES", "1")
+    assert pyterm._main.get_output_options(prompt)["thread_lines"] is True
@@ -0,0 +1,424 @@
+import io
+import time
+import threading
+
+from pyterm.prompt import Prompt
+from pyterm.term._output import OutputBuffer, OutputWriter, ThreadLineBuffer
+from pyterm.term._io_proxies import ProxyStdoutBuffer
+
+
+def test_output_buffer_coalesces_writes():
+    chunks = []
+    output = OutputBuffer(lambda data: chunks.append(bytes(data)), interval=0.01)
+    for i in range(1000):
+        output.write(f"line {i}\n".encode())
+    output.flush()
+    assert b"".join(chunks) == b"".join(f"line {i}\n".encode() for i in range(1000))
+    assert len(chunks) < 10
+    output.close()
+
+
+def test_output_buffer_block_policy():
+    chunks = []
+    output = OutputBuffer(
+        lambda data: chunks.append(bytes(data)), max_size=100, interval=10
+    )
+    for i in range(100):
+        output.write(b"0123456789")
+    # The writer flushed itself, so the buffer never exceeds its max size
+    assert len(chunks) >= 9
+    assert all(len(chunk) <= 110 for chunk in chunks)
+    output.close()
+    assert b"".join(chunks) == b"0123456789" * 100
+
+
+def test_output_buffer_skip_policy(tmp_path):
+    chunks = []
+
+    def slow_write(data):
+        time.sleep(0.01)
+        chunks.append(bytes(data))
+
+    filename = str(tmp_path / "spill.txt")
+    output = OutputBuffer(
+        slow_write,
+        max_size=1000,
+        interval=0.001,
+        policy="skip",
+        spill_filename=filename,
+    )
+    lines = [f"line {i}\n".encode() for i in range(10_000)]
+    for line in lines:
+        output.write(line)
+    output.close()
+
+    text = b"".join(chunks).decode()
+    assert "lines skipped" in text
+    assert text.endswith("line 9999\n")
+    with open(filename, "rb") as f:
+        spilled = f.read()
+    shown = [line for line in text.splitlines() if line.startswith("line")]
+    assert len(shown) + spilled.count(b"\n") == len(lines)
+
+
+def test_proxy_with_flood_control():
+    f = io.BytesIO()
+    buffer = ProxyStdoutBuffer(f, "<stdout>", flood_control="block")
+    for i in range(100):
+        assert buffer.write(b"hi\n") == 3
+    buffer.flush()
+    assert f.getvalue() == b"hi\n" * 100
+
+
+class CountingPrompt:
+    def __init__(self):
+        self.file = None
+        self.lock = threading.RLock()
+        self.nclears = self.nredraws = 0
+
+    def clear(self):
+        self.nclears += 1
+
+    def write_prompt(self):
+        self.nredraws += 1
+
+
+def test_output_writer_merges_streams_in_order():
+    prompt = CountingPrompt()
+    writer = OutputWriter(prompt)
+    f = io.BytesIO()
+    stdout = ProxyStdoutBuffer(f, "<stdout>", prompt, writer=writer)
+    stderr = ProxyStdoutBuffer(f, "<stderr>", prompt, writer=writer)
+
+    # Without the thread running, writes are only queued
+    for i in range(100):
+        stdout.write(f"out {i}\n".encode())
+        stderr.write(bytearray(f"err {i}\n".encode()))
+    assert f.getvalue() == b""
+
+    stdout.flush()
+    expected = "".join(f"out {i}\nerr {i}\n" for i in range(100))
+    assert f.getvalue().decode() == expected
+    assert prompt.nclears == prompt.nredraws == 1
+
+
+def test_output_writer_thread():
+    prompt = CountingPrompt()
+    writer = OutputWriter(prompt)
+    writer.start()
+    files = [io.BytesIO() for i in range(4)]
+    buffers = [ProxyStdoutBuffer(f, "<stdout>", prompt, writer=writer) for f in files]
+
+    def work(buffer):
+        for i in range(1000):
+            buffer.write(f"{i}\n".encode())
+
+    threads = [threading.Thread(target=work, args=(b,)) for b in buffers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    buffers[0].flush()
+
+    expected = "".join(f"{i}\n" for i in range(1000))
+    assert all(f.getvalue().decode() == expected for f in files)
+    assert prompt.nredraws < 4000  # batched
+
+
+def test_progress_updates_are_collapsed():
+    prompt = CountingPrompt()
+    f = io.BytesIO()
+    buffer = ProxyStdoutBuffer(f, "<stdout>", prompt)
+    buffer.write(b"start\n")
+    for i in range(1000):
+        assert buffer.write(f"\rprogress {i}%".encode()) == len(f"\rprogress {i}%")
+    assert prompt.nredraws < 10
+
+    # The last state is rendered soon after
+    time.sleep(0.1)
+    assert f.getvalue().endswith(b"\rprogress 999%")
+    nredraws = prompt.nredraws
+
+    # A regular write follows the last state
+    buffer.write(b"\rprogress 1000%")
+    buffer.write(b" done\n")
+    assert f.getvalue().endswith(b"\rprogress 1000% done\n")
+    assert prompt.nredraws <= nredraws + 2
+
+    text = f.getvalue().decode()
+    assert text.startswith("start\n\rprogress ")
+    assert text.count("\r") < 10
+
+
+def test_progress_with_trailing_carriage_return():
+    # Some progress bars write the text first, and then a carriage return
+    prompt = CountingPrompt()
+    f = io.BytesIO()
+    buffer = ProxyStdoutBuffer(f, "<stdout>", prompt)
+    for i in range(1, 4):
+        buffer.write(f"{i * 25}%\r".encode())
+    buffer.flush()
+    text = f.getvalue()
+    assert text.startswith(b"25%\r") and text.endswith(b"75%\r")
+
+    # Also with color, and the last state in one write
+    log = []
+    buffer = ProxyStdoutBuffer(RecordingFile("err", log), "<stderr>", color="31")
+    buffer.write(b"1%\r2%\r\r")
+    buffer.flush()
+    assert b"".join(data for _, data in log) == b"\x1b[31m\r2%\r\x1b[0m"
+
+
+def test_progress_is_written_before_other_streams():
+    log = []
+    prompt = CountingPrompt()
+    stdout = ProxyStdoutBuffer(RecordingFile("out", log), "<stdout>", prompt)
+    stderr = ProxyStdoutBuffer(RecordingFile("err", log), "<stderr>", prompt)
+    stdout.write(b"step 1\n")
+    stdout.write(b"\rprogress 50%")
+    stderr.write(b"Traceback...\n")
+    assert log == [
+        ("out", b"step 1\n"),
+        ("out", b"\rprogress 50%"),
+        ("err", b"Traceback...\n"),
+    ]
+
+    # Also when both streams show progress
+    stdout.write(b"\rprogress 60%")
+    stderr.write(b"\rwarning")
+    stdout.write(b"\n")
+    stdout.flush()
+    stderr.flush()
+    assert [name for name, data in log[3:] if data] == ["out", "err", "out"]
+    assert b"".join(data for _, data in log[3:]) == b"\rprogress 60%\rwarning\n"
+
+
+def test_progress_is_recorded_once():
+    # Only the last state goes into the scrollback (and session log)
+    records = []
+
+    class Recorder:
+        append = write = records.append
+
+    f = io.BytesIO()
+    buffer = ProxyStdoutBuffer(
+        f, "<stdout>", CountingPrompt(), scrollback=Recorder(), session_log=Recorder()
+    )
+    buffer.write(b"start\n")
+    for i in range(100):
+        buffer.write(f"\rprogress {i}%".encode())
+    buffer.write(b"\n")
+    for i in range(3):
+        buffer.write(f"{i}%\r".encode())
+    buffer.close()
+    assert records == [b"start\n"] * 2 + [b"progress 99%"] * 2 + [b"\n"] * 2 + [b"2%"] * 2
+
+
+def test_progress_keeps_cursor_column():
+    # The prompt saves the cursor right after the progress text, and restores
+    # it before the next write, so the next carriage return works as intended.
+    f = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+    prompt = Prompt(f)
+    buffer = ProxyStdoutBuffer(f.buffer, "<stdout>", prompt)
+    buffer.write(b"\rprogress 1%")
+    buffer.flush()
+    buffer.write(b"\rprogress 2%")
+    buffer.flush()
+    text = f.buffer.getvalue().decode()
+    assert "\rprogress 1%\x1b7" in text
+    i = text.index("\rprogress 2%")
+    assert text.rfind("\x1b8", 0, i) > text.index("\rprogress 1%")
+
+
+class RecordingFile:
+    """A binary file that records its writes in a list shared with other files."""
+
+    def __init__(self, name, log):
+        self.name = name
+        self.log = log
+
+    def write(self, data):
+        self.log.append((self.name, bytes(data)))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def check_interleaving(mode):
+    log = []
+    prompt = CountingPrompt()
+    files = RecordingFile("out", log), RecordingFile("err", log)
+    kwargs = {}
+    if mode == "flood_control":
+        kwargs["flood_control"] = OutputBuffer(None, interval=0.001)
+    elif mode == "writer":
+        kwargs["writer"] = OutputWriter(prompt)
+        kwargs["writer"].start()
+    stdout, stderr = [ProxyStdoutBuffer(f, f.name, prompt, **kwargs) for f in files]
+
+    def work(t):
+        for i in range(300):
+            buffer = stderr if i % 3 == 0 else stdout
+            buffer.write(f"{t}:{i};".encode())
+
+    threads = [threading.Thread(target=work, args=(t,)) for t in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stdout.flush()
+
+    # Each write went to the right stream, and per thread the order is kept
+    tokens = [
+        (name, token)
+        for name, data in log
+        for token in data.decode().split(";")
+        if token
+    ]
+    assert len(tokens) == 4 * 300
+    for name, token in tokens:
+        i = int(token.split(":")[1])
+        assert name == ("err" if i % 3 == 0 else "out")
+    for t in range(4):
+        numbers = [int(tok.split(":")[1]) for _, tok in tokens if tok[0] == str(t)]
+        assert numbers == list(range(300))
+
+
+def test_interleaving_direct():
+    check_interleaving("direct")
+
+
+def test_interleaving_flood_control():
+    check_interleaving("flood_control")
+
+
+def test_interleaving_writer():
+    for i in range(5):
+        check_interleaving("writer")
+
+
+def test_stderr_color():
+    log = []
+    buffer = ProxyStdoutBuffer(RecordingFile("err", log), "<stderr>", color="31")
+    assert buffer.write(b"oops\n") == 5
+    assert log == [("err", b"\x1b[31moops\n\x1b[0m")]
+
+
+def test_thread_line_buffer():
+    log = []
+    lines = ThreadLineBuffer(log.append, prefix=True, timeout=0.1)
+
+    def work(t):
+        for i in range(100):
+            lines.write(f"t{t} ".encode())
+            lines.write(f"line {i}".encode())
+            lines.write(b"\n")
+
+    threads = [threading.Thread(target=work, args=(t,), name=f"w{t}") for t in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    text = b"".join(log).decode()
+    result = text.splitlines()
+    assert len(result) == 400
+    for line in result:
+        name, t, _, i = line.split()
+        assert name == f"[w{t[1]}]"
+    assert not lines._pending  # nothing left for the finished threads
+
+    # The main thread gets no prefix
+    log.clear()
+    lines.write(b"main\n")
+    assert log == [b"main\n"]
+
+
+def test_thread_line_buffer_partial_lines():
+    log = []
+    lines = ThreadLineBuffer(log.append, prefix=True, max_size=100, timeout=0.1)
+
+    # Flushed on thread exit
+    t = threading.Thread(target=lambda: lines.write(b"no newline"), name="x")
+    t.start()
+    t.join()
+    wait_until(lambda: log)
+    assert log == [b"[x] no newline"]
+
+    # Flushed on timeout, and the rest of the line gets no prefix
+    log.clear()
+    event = threading.Event()
+
+    def work():
+        lines.write(b"waiting...")
+        event.wait()
+        lines.write(b" done\nnext\n")
+
+    t = threading.Thread(target=work, name="y")
+    t.start()
+    wait_until(lambda: log)
+    assert log == [b"[y] waiting..."]
+    event.set()
+    t.join()
+    assert log[1:] == [b" done\n[y] next\n"]
+
+    # Long partial lines are written
+    log.clear()
+    lines.write(b"x" * 150)
+    assert log == [b"x" * 150]
+
+
+def test_proxy_with_thread_lines():
+    log = []
+    buffer = ProxyStdoutBuffer(RecordingFile("out", log), "<stdout>", thread_lines=True)
+
+    def work():
+        buffer.write(b"a")
+        buffer.write(b"b\n")
+
+    t = threading.Thread(target=work)
+    t.start()
+    t.join()
+    assert log == [("out", b"ab\n")]
+
+
+def test_thread_line_buffer_flush():
+    # A flush only writes the partial line of the current thread
+    log = []
+    lines = ThreadLineBuffer(log.append, prefix=True, timeout=10)
+    written, done = threading.Event(), threading.Event()
+
+    def work():
+        lines.write(b"worker: part1 ")
+        written.set()
+        done.wait(5)
+        lines.write(b"part2\n")
+
+    t = threading.Thread(target=work, name="W")
+    t.start()
+    written.wait(5)
+    lines.write(b"main says hi")
+    lines.flush()
+    assert log == [b"main says hi"]
+    done.set()
+    t.join()
+    assert log == [b"main says hi", b"[W] worker: part1 part2\n"]
+
+    # flush_all() writes all of them
+    log.clear()
+    lines.write(b"a")
+    t = threading.Thread(target=lambda: (lines.write(b"b"), lines.flush_all()), name="T")
+    t.start()
+    t.join()
+    assert log == [b"a", b"[T] b"]
+
+
+def wait_until(condition, timeout=2):
+    etime = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < etime, "timeout"
+        time.sleep(0.001)
@@ -0,0 +1,369 @@
+import gc
+import os
+import ast
+import asyncio
+import sys
+import time
+import linecache
+from codeop import compile_command, CommandCompiler
+
+import pyterm.repl
+from pyterm.repl import Repl, CompletenessChecker, CodeCache, ExecutedSourceCollection
+from pyterm.magic import Magician, parse_options, format_time
+
+
+SNIPPETS = [
+    "x = 1",
+    "if x:\n    y = 2\n\n",
+    "def foo(a,\n        b):\n    return (a +\n        b)\n\n",
+    "@dec\ndef foo():\n    pass\n\n",
+    "try:\n    pass\nexcept Exception:\n    pass\n\n",
+    "s = '''hello\n\nworld)'''\n",
+    's = """a \\""" b\n"""\n',
+    "x = [\n\n1,\n  2,\n]\n",
+    "x = 1 + \\\n  2\n",
+    "class A:\n    s = '''\ndef\n'''\n    def f(self):\n        return {\n'a': 1}\n\n",
+    "x = (1,  # a comment (\n2)\n",
+    "x = ')'",
+    "d = {'a': [1, (2, 3)],\n     'b': 4}\n",
+    "x = 'abc",
+    "s = 'a\\\nb'\n",
+]
+
+
+def check_snippet(source):
+    checker = CompletenessChecker()
+    lines = source.split("\n")
+    n_compiles = 0
+    for i, line in enumerate(lines):
+        can_be_complete = checker.push(line)
+        partial = "\n".join(lines[: i + 1])
+        if can_be_complete:
+            n_compiles += 1
+        else:
+            # If the checker says the code is incomplete, it really is
+            assert compile_command(partial) is None, repr(partial)
+    return n_compiles
+
+
+def test_completeness_checker():
+    for source in SNIPPETS:
+        check_snippet(source)
+
+
+def test_completeness_checker_compiles_rarely():
+    lines = ["class A:"]
+    for i in range(1000):
+        lines += [f"    def f{i}(self, x=({i},", "            ''' a doc", "''')):"]
+        lines += ["        return [x,", "            x]"]
+    lines.append("")
+
+    # Only the first line, and the empty last line, can be complete
+    checker = CompletenessChecker()
+    results = [checker.push(line) for line in lines]
+    assert results[0] and results[-1]
+    assert sum(results) == 2
+
+    # Check against the compiler on a smaller version
+    check_snippet("\n".join(lines[:16]) + "\n")
+
+
+def test_completeness_checker_unterminated_string():
+    # An unterminated string is an error, which the compiler should report
+    checker = CompletenessChecker()
+    assert checker.push("x = 'abc")
+    checker.reset()
+    assert checker.push("if x:")
+    assert not checker.push("    y = (1,")
+    assert checker.push("    'abc")
+    checker.reset()
+    assert not checker.push("x = 'abc\\")
+    assert checker.push("def")
+
+
+def test_completeness_checker_mismatched_bracket():
+    # A mismatched closing bracket is an error, which the compiler should report
+    checker = CompletenessChecker()
+    assert checker.push("x = (]")
+    checker.reset()
+    assert not checker.push("x = [1,")
+    assert checker.push("    2)")
+    checker.reset()
+    assert checker.push("if x:")
+    assert checker.push("    y)")
+
+
+def test_completeness_checker_reset():
+    checker = CompletenessChecker()
+    assert not checker.push("x = (")
+    checker.reset()
+    assert checker.push("x = 1")
+    assert checker.push("y = 2")
+
+
+def test_code_cache(tmp_path):
+    cache = CodeCache(maxsize=2)
+    keys = [cache.get_key(f"x = {i}", "<cell>", "exec") for i in range(3)]
+    assert len(set(keys)) == 3
+    assert cache.get_key("x = 0", "<cell>", "exec", 0) == keys[0]
+    assert cache.get_key("x = 0", "<cell>", "exec", 1) != keys[0]
+    assert cache.get_key("x = 0", "<other>", "exec") != keys[0]
+
+    for i, key in enumerate(keys):
+        assert cache.get(key) is None
+        cache.put(key, compile(f"x = {i}", "<cell>", "exec"))
+    # LRU eviction
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[1]) is not None
+
+    # Persisted as marshal files
+    cache1 = CodeCache(cache_dir=str(tmp_path))
+    code = compile("y = 42", "foo.py", "exec")
+    key = cache1.get_key("y = 42", "foo.py", "exec")
+    cache1.put(key, code)
+    cache2 = CodeCache(cache_dir=str(tmp_path))
+    code2 = cache2.get(key)
+    assert code2 is not code and code2 == code
+    ns = {}
+    exec(code2, ns)
+    assert ns["y"] == 42
+
+    # Invalid files are ignored
+    (tmp_path / (key + ".bin")).write_bytes(b"invalid")
+    assert CodeCache(cache_dir=str(tmp_path)).get(key) is None
+
+
+def test_code_cache_dir_is_bounded(tmp_path):
+    cache = CodeCache(cache_dir=str(tmp_path), max_files=5)
+    keys = []
+    for i in range(10):
+        keys.append(cache.get_key(f"x = {i}", "<cell>", "exec"))
+        cache.put(keys[-1], compile(f"x = {i}", "<cell>", "exec"))
+        # Distinct mtimes, also on file systems with a coarse resolution
+        os.utime(str(tmp_path / (keys[-1] + ".bin")), (i, i))
+        if i == 5:
+            # Loading a file marks it as recently used
+            assert CodeCache(cache_dir=str(tmp_path)).get(keys[2]) is not None
+
+    names = sorted(p.name for p in tmp_path.iterdir())
+    assert names == sorted(key + ".bin" for key in [keys[2]] + keys[6:])
+
+
+def test_executed_source_collection(monkeypatch):
+    # Undo the patching of linecache when done
+    monkeypatch.setattr(linecache, "getlines", linecache.getlines)
+    monkeypatch.setattr(linecache, "_getlines", None, raising=False)
+
+    collection = ExecutedSourceCollection(max_bytes=100)
+    ns = {}
+    for i in range(10):
+        source = f"def f{i}():\n    return {i}\n" if i == 0 else f"x = {i}\n" * 4
+        code = compile(source, f"<cell{i}>", "exec")
+        collection.store_source(code, source)
+        exec(code, ns)
+        lines = linecache.getlines(f"<cell{i}>")
+        assert lines == source.splitlines(keepends=True)
+        assert linecache.getlines(f"<cell{i}>") is lines  # no copies
+    del code
+    gc.collect()
+
+    # The oldest sources are dropped, except the one with a live function
+    assert collection.nbytes <= 100
+    assert linecache.getlines("<cell0>") == ["def f0():\n", "    return 0\n"]
+    assert linecache.getlines("<cell1>") == []
+    assert linecache.getlines("<cell9>")
+
+    # Once unreferenced, it can be dropped too
+    del ns["f0"]
+    gc.collect()
+    for i in range(10, 15):
+        source = f"x = {i}\n" * 4
+        collection.store_source(compile(source, f"<cell{i}>", "exec"), source)
+    assert linecache.getlines("<cell0>") == []
+
+
+def make_repl(monkeypatch):
+    # A repl without the side effects of its initialization
+    monkeypatch.setattr(linecache, "getlines", linecache.getlines)
+    monkeypatch.setattr(linecache, "_getlines", None, raising=False)
+    repl = Repl.__new__(Repl)
+    repl._codeCollection = ExecutedSourceCollection()
+    repl._filename = "<console>"
+    repl._buffer = []
+    repl._completeness = CompletenessChecker()
+    repl._compile = CommandCompiler()
+    repl._compile.compiler.flags |= ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+    repl._dbFrames = []
+    repl._asyncLoop = None
+    repl.locals = {}
+    repl.magician = Magician(repl, timeit_target=0.01, timeit_repeat=3)
+    return repl
+
+
+def test_compile_display_last(monkeypatch):
+    repl = make_repl(monkeypatch)
+
+    shown = []
+    monkeypatch.setattr(sys, "displayhook", shown.append)
+
+    source = "x = 1\nx + 1  # comment (\n# the end\n"
+    code = repl.compilecode(source, "<cell>", "exec", display_last=True)
+    exec(code, {})
+    assert shown == [2]
+
+    # Only a final expression is shown
+    code = repl.compilecode("3\nx = 4\n", "<cell>", "exec", display_last=True)
+    exec(code, {})
+    code = repl.compilecode("5\n", "<cell>", "exec")
+    exec(code, {})
+    assert shown == [2]
+
+    # Line numbers are preserved
+    source = "x = 1\n\n(y +\n  x)\n"
+    code = repl.compilecode(source, "<cell>", "exec", display_last=True)
+    try:
+        exec(code, {})
+    except NameError as err:
+        assert err.__traceback__.tb_next.tb_lineno == 3
+    else:
+        assert False, "expected NameError"
+
+
+def test_top_level_await(monkeypatch):
+    repl = make_repl(monkeypatch)
+    shown = []
+    monkeypatch.setattr(sys, "displayhook", shown.append)
+    errors = []
+    monkeypatch.setattr(repl, "showtraceback", lambda: errors.append(sys.exc_info()))
+
+    # Without a running loop, a private loop is used
+    repl.pushline("import asyncio")
+    repl.pushline("x = await asyncio.sleep(0, result=3)")
+    repl.pushline("await asyncio.sleep(0, result=x + 1)")
+    assert shown == [4]
+    repl.pushline("async def fail():")
+    repl.pushline("    raise ValueError()")
+    repl.pushline("")
+    repl.pushline("await fail()")
+    assert len(errors) == 1
+    assert errors[0][0] is ValueError
+
+    # With a running loop (normally detected via the patched asyncio), the
+    # coroutine is scheduled, without blocking the loop
+    async def main():
+        loop = asyncio.get_running_loop()
+        monkeypatch.setattr(pyterm.repl, "get_main_thread_loop", lambda: loop)
+        repl.pushline("await asyncio.sleep(0.05, result=5)")
+        assert shown == [4]
+        await asyncio.sleep(0.2)
+        assert shown == [4, 5]
+        repl.pushline("await fail()")
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert len(errors) == 2
+
+
+def test_magic_helpers():
+    assert parse_options("-n 10 -r 3 x = 1", {"n": 0, "r": 7}) == (
+        {"n": 10, "r": 3},
+        "x = 1",
+    )
+    assert parse_options("x - 1", {"n": 0}) == ({"n": 0}, "x - 1")
+    assert parse_options("-x 1", {"n": 0}) == ({"n": 0}, "-x 1")
+    assert format_time(2) == "2 s"
+    assert format_time(0.0123) == "12.3 ms"
+    assert format_time(4e-6) == "4 µs"
+    assert format_time(5e-8) == "50 ns"
+
+
+def test_magics(capsys, monkeypatch):
+    repl = make_repl(monkeypatch)
+    magician = repl.magician
+
+    assert magician.convert_command("x = 1") == "x = 1"
+    assert magician.convert_command("%time y = 2") is None
+    assert repl.locals["y"] == 2
+    assert "Wall time:" in capsys.readouterr().out
+
+    assert magician.convert_command("%timeit -n 3 y += 1") is None
+    assert repl.locals["y"] == 2 + 1 + 3 * 3  # once, then 3 repeats of 3 loops
+    assert "per loop (min" in capsys.readouterr().out
+
+    # Only the first run is via execcode, the loops are timed in one call
+    calls = []
+    execcode = repl.execcode
+    monkeypatch.setattr(repl, "execcode", lambda code: calls.append(code) or execcode(code))
+    magician.convert_command("%timeit y += 1")
+    assert len(calls) == 1
+    assert "loops each" in capsys.readouterr().out
+
+    # At the first error, the timing stops
+    errors = []
+    monkeypatch.setattr(repl, "showtraceback", lambda: errors.append(sys.exc_info()))
+    repl.locals["items"] = [0] + [1] * 10
+    magician.convert_command("%timeit -n 5 1 / items.pop()")
+    assert [e[0] for e in errors] == [ZeroDivisionError]
+    assert repl.locals["items"] == []
+    assert "per loop" not in capsys.readouterr().out
+
+    # Invalid options
+    for command in ("%timeit -r 0 x = 1", "%timeit -n -5 x = 1", "%prun -l 0 x = 1"):
+        assert magician.convert_command(command) is None
+        assert "must be at least" in capsys.readouterr().out
+
+    # A multi-line cell, interactively
+    assert magician.convert_command("%%prun -l 3") is None
+    assert magician.collecting
+    assert magician.convert_command("def f():") is None
+    assert magician.convert_command("    return sorted(range(10))") is None
+    assert magician.convert_command("z = f()") is None
+    assert magician.convert_command("") is None
+    assert not magician.collecting
+    assert repl.locals["z"] == list(range(10))
+    out = capsys.readouterr().out
+    assert "function calls" in out and "restriction <3>" in out
+
+    # And as a cell
+    assert magician.run_cell("%%time\nw = 3\nw + 1\n")
+    assert not magician.run_cell("w = 3\n")
+    assert capsys.readouterr().out.startswith("4\nWall time")
+
+
+def test_magic_cell_tracebacks(capsys, monkeypatch):
+    repl = make_repl(monkeypatch)
+    errors = []
+    monkeypatch.setattr(repl, "showtraceback", lambda: errors.append(sys.exc_info()))
+
+    # The code keeps the line numbers of the cell, and its source is stored
+    assert repl.magician.run_cell("\n%%time\nx = 1\ny = 1 / 0\n", "<cell 1>")
+    tb = errors[0][2]
+    while tb.tb_next:
+        tb = tb.tb_next
+    assert tb.tb_lineno == 4
+    assert linecache.getlines("<cell 1>")[3] == "y = 1 / 0\n"
+
+    # The wall time does not include the handling of the error
+    monkeypatch.setattr(repl, "showtraceback", lambda: time.sleep(0.2))
+    repl.magician.convert_command("%time 1 / 0")
+    out = capsys.readouterr().out
+    value, unit = out.split("Wall time: ")[1].split()
+    assert unit != "s" and not (unit == "ms" and float(value) >= 100)
+
+
+def test_magics_async(capsys, monkeypatch):
+    repl = make_repl(monkeypatch)
+    exec("import asyncio", repl.locals)
+    repl.magician.convert_command("%time await asyncio.sleep(0.01)")
+    assert "Wall time:" in capsys.readouterr().out
+
+    # In a running loop, the magic does not block
+    async def main():
+        loop = asyncio.get_running_loop()
+        monkeypatch.setattr(pyterm.repl, "get_main_thread_loop", lambda: loop)
+        repl.magician.convert_command("%timeit -n 2 await asyncio.sleep(0)")
+        assert "per loop" not in capsys.readouterr().out
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert "per loop" in capsys.readouterr().out
@@ -0,0 +1,117 @@
+import io
+import time
+import threading
+
+from pyterm.prompt import Prompt
+from pyterm.term import Scrollback
+from pyterm.term._io_proxies import ProxyStdoutBuffer
+
+
+def test_scrollback_ring():
+    sb = Scrollback(100)
+    assert len(sb) == 0
+    sb.append(b"foo\nbar\n")
+    assert len(sb) == 2
+    assert sb.get_lines() == [b"foo", b"bar"]
+    sb.append(b"spam")
+    assert sb.get_lines() == [b"foo", b"bar", b"spam"]
+
+    # Wrap around; lines that are (partly) overwritten are dropped
+    for i in range(100):
+        sb.append(f"line {i}\n".encode())
+    lines = sb.get_lines()
+    assert lines[-1] == b"line 99"
+    assert lines[0] == b"line %i" % (100 - len(lines))
+    assert sb.nbytes == 100
+    assert len(sb) == len(lines)
+
+    # A write that is larger than the buffer
+    sb.append(b"x" * 250)
+    assert sb.get_lines() == [b"x" * 100]
+
+    # The index stays bounded
+    for i in range(10_000):
+        sb.append(b"a\n")
+    assert len(sb._starts) < 2000
+
+
+def test_scrollback_search():
+    sb = Scrollback(10_000)
+    for i in range(100):
+        sb.append(f"line {i}: {'even' if i % 2 == 0 else 'odd'}\n".encode())
+    sb.append(memoryview(b"The End"))
+
+    hits = list(sb.search("7"))
+    assert [line for _, line in hits][:3] == [
+        b"line 7: odd",
+        b"line 17: odd",
+        b"line 27: odd",
+    ]
+    assert len(hits) == 19
+    assert all(sb.get_lines()[i] == line for i, line in hits)
+
+    hits = list(sb.search(r"^line \d: even$", regex=True))
+    assert len(hits) == 5
+    assert list(sb.search("the end", ignore_case=True)) == [(100, b"The End")]
+
+    # Searching does not block writing
+    gen = sb.search("line")
+    next(gen)
+    sb.append(b"line new\n")
+    assert len(list(gen)) == 99
+
+
+def test_prompt_search_command():
+    sb = Scrollback(10_000)
+    f = io.BytesIO()
+    out = ProxyStdoutBuffer(f, "<stdout>", scrollback=sb)
+    for i in range(50):
+        out.write(f"result {i}\n".encode())
+    assert f.getvalue().count(b"\n") == 50
+
+    prompt = Prompt(io.TextIOWrapper(io.BytesIO(), encoding="utf-8"), {}, sb)
+    prompt.submit("%search -r result 1\\d")
+    lines = wait_for_search(prompt, "hits 1-")
+    assert "hits 1-8+" in lines[0]
+    assert "result 10" in lines[1]
+    prompt.on_key("pagedown")
+    lines = wait_for_search(prompt, "hits 9-")
+    assert "hits 9-10" in lines[0]
+    assert "result 19" in lines[-1]
+    prompt.on_key("escape")
+    assert not prompt._search.active
+
+    prompt.submit("%search -r (")
+    assert "Invalid regex" in wait_for_search(prompt, "Invalid")[0]
+
+
+def test_prompt_search_without_lock():
+    # The search runs in a thread, without holding the prompt's lock
+    started, done = threading.Event(), threading.Event()
+
+    class SlowScrollback:
+        def search(self, pattern, regex=False, ignore_case=False):
+            started.set()
+            done.wait(5)
+            yield 0, b"found it"
+
+    f = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+    prompt = Prompt(f, {}, SlowScrollback())
+    prompt.submit("%search it")
+    assert "searching" in prompt._search.get_lines()[0]
+    assert started.wait(5)
+    assert prompt.lock.acquire(timeout=1)
+    prompt.lock.release()
+    done.set()
+    assert "found it" in wait_for_search(prompt, "hits 1-1")[1]
+
+
+def wait_for_search(prompt, text, timeout=2):
+    etime = time.perf_counter() + timeout
+    while time.perf_counter() < etime:
+        with prompt.lock:
+            lines = prompt._search.get_lines()
+        if lines and text in lines[0]:
+            return lines
+        time.sleep(0.005)
+    raise AssertionError(f"search did not show {text!r}: {lines}")
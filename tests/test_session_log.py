@@ -0,0 +1,110 @@
+import io
+import gzip
+import os
+import time
+
+from pyterm.term import SessionLog, SessionLogTee, ProxyStdout
+
+
+def test_session_log_gzip(tmp_path):
+    log = SessionLog(str(tmp_path / "session.log"), interval=0.01)
+    assert log.filename.endswith((".gz", ".zst"))
+    log = SessionLog(str(tmp_path / "session.log"), compression="gzip")
+    assert log.filename.endswith(".log.gz")
+
+    log.start()
+    log.write(b"hello\n")
+    log.write(memoryview(b"world\n"))
+    log.stop()
+
+    with gzip.open(log.filename, "rb") as f:
+        lines = f.read().splitlines()
+    assert lines[0].startswith(b"[session log: opened at ")
+    assert lines[1:] == [b"hello", b"world"]
+    assert log.dropped == 0
+
+
+def test_session_log_drops_when_full(tmp_path):
+    filename = str(tmp_path / "session.log")
+    log = SessionLog(filename, compression=None, max_pending=10)
+
+    # The thread is not started, like when the disk would be very slow
+    log.write(b"12345\n")
+    log.write(b"abcde\n")
+    log.write(b"xyz\n")
+    assert log.dropped == 1
+
+    log.start()
+    log.stop()
+    with open(filename, "rb") as f:
+        lines = f.read().splitlines()
+    assert lines[1:] == [b"12345", b"xyz", b"", b"[session log: dropped 1 records]"]
+
+
+def test_session_log_rotation(tmp_path):
+    filename = str(tmp_path / "session.log")
+    log = SessionLog(
+        filename, compression=None, max_bytes=100, backup_count=2, interval=0.001
+    )
+    log.start()
+    for i in range(10):
+        log.write(b"x" * 100 + b"\n")
+        time.sleep(0.02)  # each record in its own batch
+    log.stop()
+
+    names = sorted(os.listdir(tmp_path))
+    assert names == ["session.log", "session.log.1", "session.log.2"]
+
+
+def test_session_log_appends(tmp_path):
+    # A new session does not overwrite the log of the previous one
+    filename = str(tmp_path / "session.log")
+    for compression in ("gzip", None):
+        for i in range(2):
+            log = SessionLog(filename, compression=compression)
+            log.start()
+            log.write(f"session {i}\n".encode())
+            log.stop()
+        opener = gzip.open if compression else open
+        with opener(log.filename, "rb") as f:
+            lines = f.read().splitlines()
+        assert lines[1::2] == [b"session 0", b"session 1"]
+        assert all(line.startswith(b"[session log: opened") for line in lines[::2])
+
+    # Unless it is too large, then it is rotated first
+    log = SessionLog(filename, compression=None, max_bytes=10)
+    log.start()
+    log.stop()
+    assert os.path.isfile(filename + ".1")
+    with open(filename, "rb") as f:
+        assert f.read().startswith(b"[session log: opened")
+
+
+def test_proxy_tee(tmp_path):
+    log = SessionLog(str(tmp_path / "session.log"), compression="gzip")
+    file = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+    stdout = ProxyStdout(file, "<stdout>", color="31", session_log=log)
+    log.start()
+    print("hi there", file=stdout)
+    stdout.flush()
+    log.stop()
+
+    # The log has the output, but without the color
+    with gzip.open(log.filename, "rb") as f:
+        assert f.read().splitlines()[1:] == [b"hi there"]
+    assert b"\x1b[31m" in file.buffer.getvalue()
+
+
+def test_session_log_tee(tmp_path):
+    log = SessionLog(str(tmp_path / "session.log"), compression="gzip")
+    file = io.StringIO()
+    stdout = SessionLogTee(file, log)
+    log.start()
+    print("hi there", file=stdout)
+    stdout.writelines(["\u20ac\n"])
+    stdout.flush()
+    log.stop()
+
+    with gzip.open(log.filename, "rb") as f:
+        assert f.read().splitlines()[1:] == [b"hi there", "\u20ac".encode()]
+    assert file.getvalue() == "hi there\n\u20ac\n"
@@ -0,0 +1,149 @@
+import asyncio
+import queue
+import threading
+import time
+
+from pyterm.term import InputBuffer, ProxyStdin
+
+
+def feed_later(input_buffer, *items, delay=0.05):
+    def feed():
+        for item in items:
+            time.sleep(delay)
+            if item is None:
+                input_buffer.close()
+            else:
+                input_buffer.put(item)
+
+    t = threading.Thread(target=feed, daemon=True)
+    t.start()
+    return t
+
+
+def test_input_buffer_lines_and_bytes():
+    b = InputBuffer()
+    b.put("hello")
+    b.put("world")
+    b.put(b"abc")
+
+    # Reads of different kinds can be mixed
+    assert b.readline() == b"hello\n"
+    assert b.read(3) == b"wor"
+    assert b.read1(100) == b"ld\nabc"
+
+    buf = bytearray(4)
+    b.put("xy")
+    assert b.readinto(buf) == 3
+    assert buf[:3] == b"xy\n"
+
+    # Readline with size
+    b.put("12345")
+    assert b.readline(2) == b"12"
+    assert b.readline() == b"345\n"
+
+
+def test_input_buffer_blocking_and_eof():
+    b = InputBuffer()
+    feed_later(b, "foo", "bar", None)
+    assert b.read(6) == b"foo\nba"
+    assert b.read() == b"r\n"
+    assert b.read() == b""
+    assert b.readline() == b""
+    assert b.closed
+
+    # Pending data can still be read after closing
+    b = InputBuffer()
+    b.put(b"no newline")
+    b.close()
+    assert b.readline() == b"no newline"
+    assert b.readline() == b""
+
+
+def test_input_buffer_zero_size_reads():
+    # Like io.BufferedReader, reading zero bytes does not wait for data
+    b = InputBuffer()
+    assert b.read(0) == b""
+    assert b.read1(0) == b""
+    assert b.readline(0) == b""
+    assert b.readinto(bytearray()) == 0
+    b.put("x")
+    assert b.read1(0) == b""
+    assert b.read1() == b"x\n"
+
+
+def test_input_buffer_queue_interface():
+    b = InputBuffer()
+    try:
+        b.get_nowait()
+    except queue.Empty:
+        pass
+    else:
+        assert False, "expected queue.Empty"
+
+    # An incomplete line is not a line yet
+    b.put(b"partial")
+    try:
+        b.get(timeout=0.01)
+    except queue.Empty:
+        pass
+    else:
+        assert False, "expected queue.Empty"
+
+    b.put(b" line\n")
+    assert b.get_nowait() == b"partial line\n"
+
+    feed_later(b, "later")
+    assert b.get(timeout=5) == b"later\n"
+
+
+def test_input_buffer_async_readline():
+    b = InputBuffer()
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.ensure_future(ticker())
+        feed_later(b, "one", "two", None, delay=0.1)
+        lines = [await b.areadline(), await b.areadline(), await b.areadline()]
+        task.cancel()
+        return lines, ticks
+
+    lines, ticks = asyncio.run(main())
+    assert lines == [b"one\n", b"two\n", b""]
+    assert ticks > 5  # the loop was not blocked
+
+
+def test_proxy_stdin():
+    b = InputBuffer()
+    stdin = ProxyStdin(b, "<stdin>")
+
+    b.put("hello")
+    b.put("wörld")
+    assert stdin.readline() == "hello\n"
+    assert stdin.read(2) == "wö"
+    assert stdin.buffer.read(2) == b"rl"
+    assert stdin.read(2) == "d\n"
+
+    # A multi-byte character split across reads
+    b.put("ö".encode()[:1])
+    b.put("ö".encode()[1:] + b"x\n")
+    assert stdin.read(2) == "öx"
+
+    b.put("a")
+    b.put("b")
+    b.close()
+    assert list(stdin) == ["\n", "a\n", "b\n"]
+    assert stdin.read() == ""
+
+
+def test_proxy_stdin_async_readline():
+    b = InputBuffer()
+    stdin = ProxyStdin(b, "<stdin>")
+    feed_later(b, "ö")
+    assert asyncio.run(stdin.areadline()) == "ö\n"
@@ -0,0 +1,55 @@
+import io
+import logging
+
+from pyterm import _trace
+from pyterm.term._io_proxies import ProxyStdoutBuffer
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_trace_disabled_is_silent():
+    handler = RecordingHandler()
+    logger = logging.getLogger("pyterm")
+    logger.addHandler(handler)
+    try:
+        _trace.disable()
+        _trace.clear()
+        f = io.BytesIO()
+        buffer = ProxyStdoutBuffer(f, "<stdout>")
+        for i in range(10):
+            assert buffer.write(b"hello\n") == 6
+        assert f.getvalue() == b"hello\n" * 10
+        assert _trace.get_events() == []
+        assert handler.records == []
+    finally:
+        logger.removeHandler(handler)
+
+
+def test_trace_records_structured_events():
+    _trace.clear()
+    _trace.enable()
+    try:
+        f = io.BytesIO()
+        buffer = ProxyStdoutBuffer(f, "<stdout>")
+        buffer.write(b"x" * 100)
+        buffer.writelines([b"ab", b"cd\n"])
+    finally:
+        _trace.disable()
+
+    events = _trace.get_events()
+    assert [e[2] for e in events] == ["stdout.write", "stdout.write"]
+    assert events[0][3]["nbytes"] == 100
+    assert events[0][3]["duration"] >= 0
+    assert events[1][3]["nbytes"] == 5
+
+    summary = _trace.summarize()
+    assert summary["stdout.write"]["count"] == 2
+    assert summary["stdout.write"]["nbytes"] == 105
+    _trace.clear()
@@ -0,0 +1,87 @@
+import errno
+import socket
+import logging
+from collections import deque
+
+from pyterm.utils import UDPHandler, UDPSender, pack_records, unpack_datagram
+
+
+def test_pack_records():
+    records = [(1.5, logging.INFO, "hello"), (2.5, logging.ERROR, "wörld")]
+    datagrams = pack_records(records)
+    assert len(datagrams) == 1
+    assert unpack_datagram(datagrams[0]) == records
+
+    # Many records are spread over multiple datagrams
+    records = [(float(i), logging.INFO, "x" * 100) for i in range(100)]
+    datagrams = pack_records(records, max_size=1000)
+    assert len(datagrams) > 10
+    assert all(len(datagram) <= 1000 for datagram in datagrams)
+    unpacked = [
+        record for datagram in datagrams for record in unpack_datagram(datagram)
+    ]
+    assert unpacked == records
+
+    # Too large messages are truncated
+    (datagram,) = pack_records([(0.0, logging.INFO, "x" * 2000)], max_size=1000)
+    assert len(datagram) == 1000
+
+    # Old-style datagrams are plain text
+    assert unpack_datagram(b"hi")[0][2] == "hi"
+
+
+def test_udp_handler_is_async_and_batched():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(2)
+
+    handler = UDPHandler()
+    handler.udp_address = sock.getsockname()
+    logger = logging.getLogger("pyterm.test_utils")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for i in range(50):
+            logger.warning(f"message {i}")
+        assert handler._sender.is_alive()
+
+        messages = []
+        while len(messages) < 50:
+            data, _ = sock.recvfrom(2**16)
+            messages += [msg for _, _, msg in unpack_datagram(data)]
+        assert messages == [f"message {i}" for i in range(50)]
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+        sock.close()
+
+
+def test_udp_sender_splits_large_datagrams():
+    # Like on macOS, where datagrams are limited to 9216 bytes by default
+    class LimitedSocket:
+        def __init__(self, limit):
+            self.limit = limit
+            self.sent = []
+
+        def sendto(self, data, address):
+            if len(data) > self.limit:
+                raise OSError(errno.EMSGSIZE, "Message too long")
+            self.sent.append(data)
+
+        def close(self):
+            pass
+
+    records = [(float(i), logging.INFO, "x" * 100) for i in range(500)]
+    sender = UDPSender(deque(records), ("127.0.0.1", 0))
+    sender._socket.close()
+    sender._socket = LimitedSocket(3000)
+    sender._send_queued()
+    unpacked = [record for data in sender._socket.sent for record in unpack_datagram(data)]
+    assert unpacked == records
+    assert sender.dropped == 0
+
+    # Datagrams that cannot be sent are counted
+    sender._socket = LimitedSocket(100)
+    sender._queue.extend(records[:10])
+    sender._send_queued()
+    assert sender.dropped > 0